@@ -5,10 +5,17 @@ import json
 import os
 from dotenv import load_dotenv
 import hashlib
-import re
+import uuid
 from components.knowledge_base_supabase import KnowledgeBaseSupabase as KnowledgeBase
 from components.question_logger import QuestionLogger
+from components.answer_cache import ExactAnswerCache, MemoryAnswerStore, SemanticAnswerCache, SqliteAnswerStore
+from components.openai_scheduler import OpenAIScheduler
+from components.question_pipeline import QuestionPipeline
+from components.single_flight import SqliteFlightStore
+from components.prompt_builder import PROMPT_VERSION
 from utils.auth import check_password
+from utils.links import extract_links
+from utils.tokens import CHAT_MODEL
 
 load_dotenv()
 
@@ -30,46 +37,130 @@ def init_knowledge_base():
 def init_question_logger():
     return QuestionLogger()
 
+@st.cache_resource
+def init_answer_cache(_kb):
+    return SemanticAnswerCache(
+        _kb.get_content_versions,
+        threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+        max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "500"))
+    )
+
+@st.cache_resource
+def init_exact_answer_cache():
+    # EXACT_ANSWER_CACHE_PATH を設定するとSQLiteに保存し、同じマシンの複数のワーカープロセスで共有する
+    ttl = float(os.getenv("EXACT_ANSWER_CACHE_TTL", "86400"))
+    max_entries = int(os.getenv("EXACT_ANSWER_CACHE_MAX_ENTRIES", "1000"))
+    path = os.getenv("EXACT_ANSWER_CACHE_PATH")
+    store = SqliteAnswerStore(path, max_entries, ttl) if path else MemoryAnswerStore(max_entries, ttl)
+    return ExactAnswerCache(store, model=CHAT_MODEL, prompt_version=PROMPT_VERSION)
+
+@st.cache_resource
+def init_flight_store():
+    # SINGLE_FLIGHT_DB_PATH を設定すると、同じマシンの他のワーカープロセスで処理中の同じ質問の回答も共有する
+    path = os.getenv("SINGLE_FLIGHT_DB_PATH")
+    return SqliteFlightStore(path) if path else None
+
+@st.cache_resource
+def init_openai_scheduler():
+    # プロセス全体でのOpenAI APIの同時実行数と、1分あたりのリクエスト数・トークン数（利用プランのレート制限に合わせる）
+    return OpenAIScheduler({
+        'completion': {
+            'max_concurrent': int(os.getenv("OPENAI_MAX_CONCURRENT_COMPLETIONS", "4")),
+            'requests_per_minute': float(os.getenv("OPENAI_COMPLETION_RPM", "500")),
+            'tokens_per_minute': float(os.getenv("OPENAI_COMPLETION_TPM", "200000"))
+        },
+        'embedding': {
+            'max_concurrent': int(os.getenv("OPENAI_MAX_CONCURRENT_EMBEDDINGS", "8")),
+            'requests_per_minute': float(os.getenv("OPENAI_EMBEDDING_RPM", "3000")),
+            'tokens_per_minute': float(os.getenv("OPENAI_EMBEDDING_TPM", "1000000"))
+        }
+    })
+
 kb = init_knowledge_base()
 logger = init_question_logger()
+answer_cache = init_answer_cache(kb)
+exact_answer_cache = init_exact_answer_cache()
+flight_store = init_flight_store()
+scheduler = init_openai_scheduler()
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
-def extract_youtube_urls(text):
-    """テキストからYouTube URLを抽出"""
-    youtube_patterns = [
-        r'https?://(?:www\.)?youtube\.com/watch\?v=[\w-]+(?:&[\w=]*)?',
-        r'https?://(?:www\.)?youtu\.be/[\w-]+(?:\?[\w=]*)?',
-        r'https?://(?:www\.)?youtube\.com/embed/[\w-]+',
-        r'https?://(?:www\.)?youtube\.com/v/[\w-]+'
-    ]
-    
-    urls = []
-    for pattern in youtube_patterns:
-        matches = re.findall(pattern, text)
-        urls.extend(matches)
-    
-    return list(set(urls))  # 重複を除去
+# 回答キャッシュの種類ごとの表示
+CACHE_CAPTIONS = {
+    'semantic': "⚡ 類似の質問への回答を再利用しました",
+    'exact': "⚡ 同じ質問への回答を再利用しました"
+}
 
-def extract_all_urls(text):
-    """テキストから全てのURLを抽出（YouTube以外）"""
-    # 一般的なURLパターン
-    url_pattern = r'https?://[^\s<>"{}|\\^`\[\]]+(?:[.,;!?](?=\s)|[^\s.,;!?])*'
+def content_links(doc):
+    """本文中のYouTube URL・資料URL（登録時に抽出済みのものを使い、ない場合だけ本文から抽出）"""
+    if doc.get('links') is None:
+        doc['links'] = extract_links(doc['content'])
+    return doc['links']
+
+def doc_links(doc):
+    """教材のUtage URL・YouTube URLと、本文中のYouTube URL・資料URLを参考リンクとしてまとめる"""
+    links = []
     
-    all_urls = re.findall(url_pattern, text)
-    youtube_urls = extract_youtube_urls(text)
+    # Utage URL
+    if doc.get('url'):
+        links.append({'type': 'utage', 'url': doc['url']})
     
-    # YouTube URL以外を返す
-    other_urls = [url for url in all_urls if url not in youtube_urls]
+    # YouTube URL (メタデータ)
+    if doc.get('youtube_url'):
+        links.append({'type': 'youtube', 'url': doc['youtube_url']})
     
-    # URLの末尾の句読点を除去
-    cleaned_urls = []
-    for url in other_urls:
-        # 末尾の句読点を除去
-        url = re.sub(r'[.,;!?]+$', '', url)
-        cleaned_urls.append(url)
+    # コンテンツ内のYouTube URLと資料URL
+    links.extend(content_links(doc))
     
-    return list(set(cleaned_urls))  # 重複を除去
+    return links
+
+def render_references(relevant_docs):
+    """参照した教材（上位3件）を折りたたみで表示する"""
+    if not relevant_docs:
+        return
+    with st.expander("📚 参照した教材", expanded=False):
+        for i, doc in enumerate(relevant_docs[:3], 1):
+            st.markdown(f"**{i}. {doc.get('title', '無題')}**")
+            st.caption(f"関連度スコア: {1 - doc.get('score', 1):.2%}")
+            st.text(doc['content'][:200] + "...")
+            if doc.get('url'):
+                st.markdown(f"[Utageリンク]({doc['url']})")
+            if doc.get('youtube_url'):
+                st.markdown(f"[🎥 YouTube動画]({doc['youtube_url']})")
+            
+            # テキスト内のYouTube URLと資料URLも表示（URLを表示）
+            for link in content_links(doc):
+                if link['type'] == 'youtube':
+                    st.markdown(f"🎬 YouTube: {link['url']}")
+                else:
+                    st.markdown(f"📄 資料: {link['url']}")
+            
+            st.divider()
+
+@st.cache_resource
+def init_question_pipeline(_kb, _answer_cache, _exact_answer_cache, _flight_store, _scheduler, _logger):
+    return QuestionPipeline(
+        _kb, _answer_cache, _logger,
+        exact_cache=_exact_answer_cache,
+        flight_store=_flight_store,
+        scheduler=_scheduler,
+        get_links=doc_links,
+        n_candidates=int(os.getenv("CONTEXT_CANDIDATES", "10")),
+        max_chunks=int(os.getenv("CONTEXT_MAX_CHUNKS", "5")),
+        max_chunks_per_lesson=int(os.getenv("CONTEXT_MAX_CHUNKS_PER_LESSON", "2")),
+        min_similarity=float(os.getenv("CONTEXT_MIN_SIMILARITY")) if os.getenv("CONTEXT_MIN_SIMILARITY") else None,
+        token_budget=int(os.getenv("PROMPT_TOKEN_BUDGET", "4000"))
+    )
+
+pipeline = init_question_pipeline(kb, answer_cache, exact_answer_cache, flight_store, scheduler, logger)
+
+# OpenAI APIの順番待ちはセッションごとに公平に進める
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
+# 質問の検索はサイドバーや履歴を描画している間に裏で進める（入力欄は常に画面下部に表示される）
+prompt = st.chat_input("質問を入力してください...")
+run = pipeline.start(prompt, session_id=st.session_state.session_id) if prompt else None
 
 st.title("🎓 ブログスクール Q&Aボット")
 st.markdown("教材に関する質問にお答えします。")
@@ -85,6 +176,10 @@ with st.sidebar:
     3. AIが教材を参照して回答します
     """)
     
+    queued = scheduler.stats()['completion']['queued']
+    if queued:
+        st.warning(f"⏳ 現在混み合っています（回答待ち {queued} 件）")
+    
     if st.button("🔄 履歴をクリア"):
         st.session_state.messages = []
         st.rerun()
@@ -128,160 +223,46 @@ if "messages" not in st.session_state:
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
+        if message.get("cached"):
+            st.caption(CACHE_CAPTIONS.get(message["cached"], CACHE_CAPTIONS['semantic']))
 
-if prompt := st.chat_input("質問を入力してください..."):
+if run:
     st.session_state.messages.append({"role": "user", "content": prompt})
     with st.chat_message("user"):
         st.markdown(prompt)
     
     with st.chat_message("assistant"):
-        with st.spinner("回答を生成中..."):
-            try:
-                relevant_docs = kb.search(prompt, n_results=5)
-                
-                context = "\n\n".join([doc['content'] for doc in relevant_docs])
-                urls = [doc.get('url', '') for doc in relevant_docs if doc.get('url')]
-                youtube_urls = [doc.get('youtube_url', '') for doc in relevant_docs if doc.get('youtube_url')]
-                
-                # テキストコンテンツ内からYouTube URLと資料URLを抽出
-                extracted_youtube_urls = []
-                extracted_other_urls = []
-                for doc in relevant_docs:
-                    found_youtube = extract_youtube_urls(doc['content'])
-                    found_other = extract_all_urls(doc['content'])
-                    extracted_youtube_urls.extend(found_youtube)
-                    extracted_other_urls.extend(found_other)
-                
-                # 重複を除去して統合
-                all_youtube_urls = list(set(youtube_urls + extracted_youtube_urls))
-                all_other_urls = list(set(extracted_other_urls))
-                
-                # 参考リンク情報を整理
-                reference_links = []
-                for doc in relevant_docs:
-                    doc_links = {
-                        'title': doc.get('title', '無題'),
-                        'links': []
-                    }
-                    
-                    # Utage URL
-                    if doc.get('url'):
-                        doc_links['links'].append({
-                            'type': 'utage',
-                            'url': doc['url']
-                        })
-                    
-                    # YouTube URL (メタデータ)
-                    if doc.get('youtube_url'):
-                        doc_links['links'].append({
-                            'type': 'youtube',
-                            'url': doc['youtube_url']
-                        })
-                    
-                    # コンテンツ内のYouTube URL
-                    content_youtube = extract_youtube_urls(doc['content'])
-                    for url in content_youtube:
-                        doc_links['links'].append({
-                            'type': 'youtube',
-                            'url': url
-                        })
-                    
-                    # コンテンツ内の資料URL
-                    content_other = extract_all_urls(doc['content'])
-                    for url in content_other:
-                        doc_links['links'].append({
-                            'type': 'resource',
-                            'url': url
-                        })
-                    
-                    if doc_links['links']:
-                        reference_links.append(doc_links)
-                
-                # リンク情報を含むプロンプト
-                links_context = ""
-                if reference_links:
-                    links_context = "\n\n【参考リンク】\n"
-                    for ref in reference_links:
-                        links_context += f"\n教材「{ref['title']}」の関連リンク:\n"
-                        for link in ref['links']:
-                            if link['type'] == 'youtube':
-                                links_context += f"- YouTube動画: {link['url']}\n"
-                            elif link['type'] == 'resource':
-                                links_context += f"- 参考資料: {link['url']}\n"
-                            elif link['type'] == 'utage':
-                                links_context += f"- Utageリンク: {link['url']}\n"
-                
-                system_prompt = f"""
-                あなたはブログスクールの講師アシスタントです。
-                以下の教材内容を【厳密に】参考にして、生徒の質問に答えてください。
-                
-                【重要な指示】
-                1. 教材の内容を正確に理解し、その通りに伝える
-                2. 教材の意図や文脈を正しく把握する
-                3. 教材に書かれていることと逆の内容を言わない
-                4. 勝手な解釈や創作をしない
-                5. 教材の例示は、その意図（良い例/悪い例）を正確に理解して使用する
-                6. 関連するURLがある場合は、説明の該当箇所に自然に埋め込んで紹介する
-                
-                【教材内容】
-                {context}
-                {links_context}
-                
-                【回答ルール】
-                - 教材の内容を忠実に反映する
-                - 「〜というタイトルのように」などの具体例は、教材に明記されているもののみ使用
-                - 「驚きの事実」「知られざるエピソード」などのフレーズについて、教材で推奨/非推奨が明記されている場合はその通りに説明
-                - 教材にない情報は「教材には記載がありません」と明確に伝える
-                - 教材の文章をそのまま引用する場合は「教材では『〜』と説明されています」と明記
-                - 参考リンクがある場合は、関連する説明の箇所で「詳しくは[こちらの動画]({url})をご覧ください」のように自然に紹介
-                """
-                
-                response = openai.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.7,
-                    max_tokens=1000
-                )
-                
-                answer = response.choices[0].message.content
-                
-                # 参照した教材を表示
-                if relevant_docs:
-                    with st.expander("📚 参照した教材", expanded=False):
-                        for i, doc in enumerate(relevant_docs[:3], 1):
-                            st.markdown(f"**{i}. {doc.get('title', '無題')}**")
-                            st.caption(f"関連度スコア: {1 - doc.get('score', 1):.2%}")
-                            st.text(doc['content'][:200] + "...")
-                            if doc.get('url'):
-                                st.markdown(f"[Utageリンク]({doc['url']})")
-                            if doc.get('youtube_url'):
-                                st.markdown(f"[🎥 YouTube動画]({doc['youtube_url']})")
-                            
-                            # テキスト内のYouTube URLと資料URLも表示（URLを表示）
-                            content_youtube_urls = extract_youtube_urls(doc['content'])
-                            for url in content_youtube_urls:
-                                st.markdown(f"🎬 YouTube: {url}")
-                            
-                            content_other_urls = extract_all_urls(doc['content'])
-                            for url in content_other_urls:
-                                # URLからドメインを抽出して表示
-                                domain = url.split('/')[2] if len(url.split('/')) > 2 else url
-                                st.markdown(f"📄 資料: {url}")
-                            
-                            st.divider()
-                
-                # 回答の最後には参考リンクを追加しない（本文中に埋め込まれているため）
-                
+        try:
+            with st.spinner("教材を検索中..."):
+                relevant_docs = run.wait_context()
+            
+            # 参照した教材は回答の生成と並行して表示する
+            render_references(relevant_docs)
+            
+            # 回答の最後には参考リンクを追加しない（本文中に埋め込まれているため）
+            
+            if run.cached:
+                answer = "".join(run)
                 st.markdown(answer)
-                
-                st.session_state.messages.append({"role": "assistant", "content": answer})
-                
-                logger.log_question(prompt, answer, urls)
-                
-            except Exception as e:
-                error_msg = f"エラーが発生しました: {str(e)}"
-                st.error(error_msg)
-                st.session_state.messages.append({"role": "assistant", "content": error_msg})
\ No newline at end of file
+                st.caption(CACHE_CAPTIONS[run.cached])
+            else:
+                # 届いた断片から順に表示する（受信中は末尾にカーソルを付ける。混み合っている間は順番を表示する）
+                placeholder = st.empty()
+                placeholder.markdown("▌")
+                for delta in run.updates(0.5):
+                    if delta is not None:
+                        placeholder.markdown(run.answer + "▌")
+                    elif run.queue_position:
+                        placeholder.info(f"⏳ 混み合っています。あなたの順番は {run.queue_position} 番目です。このままお待ちください。")
+                    elif not run.answer:
+                        placeholder.markdown("▌")
+                answer = run.answer
+                placeholder.markdown(answer)
+            
+            # 回答キャッシュへの保存と質問ログの記録はパイプラインが回答後に行う
+            st.session_state.messages.append({"role": "assistant", "content": answer, "cached": run.cached})
+            
+        except Exception as e:
+            error_msg = f"エラーが発生しました: {str(e)}"
+            st.error(error_msg)
+            st.session_state.messages.append({"role": "assistant", "content": error_msg})
\ No newline at end of file
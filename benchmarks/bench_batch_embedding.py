@@ -0,0 +1,122 @@
+"""
+チャンクのembedding作成（components/batch_embedder.BatchEmbedder）のベンチマーク
+API呼び出しごとに待ち時間を入れるスタブを使い、従来のチャンクごとの embed_query と、
+バッチ + 並列実行 + レート制限時の再試行のスループットを比較します（ネットワーク不要）。
+
+実行:
+    python benchmarks/bench_batch_embedding.py --chunks 500 --latency-ms 300
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from components.batch_embedder import BatchEmbedder
+from components.hashing_embeddings import HashingEmbeddings
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+class LatencyEmbeddings:
+    """
+    1回のAPI呼び出しに latency_ms + テキストあたり per_text_ms かかるスタブ
+    同時実行数が max_concurrency を超えると429を返す（OpenAIのレート制限の代わり）
+    """
+
+    def __init__(self, latency_ms: float, per_text_ms: float, max_concurrency: int):
+        self.latency = latency_ms / 1000
+        self.per_text = per_text_ms / 1000
+        self.max_concurrency = max_concurrency
+        self.model = "latency-stub"
+        self.calls = 0
+        self.rate_limited = 0
+        self._active = 0
+        self._lock = threading.Lock()
+        self._vectors = HashingEmbeddings()
+
+    def _request(self, texts):
+        with self._lock:
+            self.calls += 1
+            self._active += 1
+            over = self._active > self.max_concurrency
+            if over:
+                self.rate_limited += 1
+        try:
+            if over:
+                time.sleep(0.01)
+                raise RateLimitError("Rate limit reached")
+            time.sleep(self.latency + self.per_text * len(texts))
+            return self._vectors.embed_documents(texts)
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def embed_query(self, text):
+        return self._request([text])[0]
+
+    def embed_documents(self, texts):
+        return self._request(texts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="バッチ並列embedding ベンチマーク")
+    parser.add_argument("--chunks", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="API呼び出し1回あたりの待ち時間")
+    parser.add_argument("--per-text-ms", type=float, default=2.0, help="テキスト1件あたりの追加の待ち時間")
+    parser.add_argument("--max-concurrency", type=int, default=3, help="これを超える同時実行は429になる")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--skip-sequential", action="store_true", help="従来方式の計測を省略")
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    chunks = [f"チャンク{i}: " + "ブログ記事の書き方とSEO対策について説明します。" * 20 for i in range(args.chunks)]
+    report = {
+        "chunks": args.chunks,
+        "latency_ms": args.latency_ms,
+        "per_text_ms": args.per_text_ms,
+        "max_concurrency": args.max_concurrency,
+        "batch_size": args.batch_size,
+        "workers": args.workers,
+    }
+
+    if not args.skip_sequential:
+        # 変更前の add_document と同じ、チャンクごとの embed_query
+        stub = LatencyEmbeddings(args.latency_ms, args.per_text_ms, args.max_concurrency)
+        started = time.perf_counter()
+        sequential = [stub.embed_query(chunk) for chunk in chunks]
+        seconds = time.perf_counter() - started
+        report["sequential_seconds"] = round(seconds, 2)
+        report["sequential_chunks_per_sec"] = round(args.chunks / seconds, 1)
+        report["sequential_api_calls"] = stub.calls
+
+    stub = LatencyEmbeddings(args.latency_ms, args.per_text_ms, args.max_concurrency)
+    embedder = BatchEmbedder(stub, batch_size=args.batch_size, max_workers=args.workers, initial_backoff=0.2)
+    started = time.perf_counter()
+    batched = embedder.embed_documents(chunks)
+    seconds = time.perf_counter() - started
+    report["batched_seconds"] = round(seconds, 2)
+    report["batched_chunks_per_sec"] = round(args.chunks / seconds, 1)
+    report["batched_api_calls"] = stub.calls
+    report["batched_rate_limited"] = stub.rate_limited
+    report["batched_retries"] = embedder.stats()["retries"]
+
+    if not args.skip_sequential:
+        report["same_vectors"] = sequential == batched
+        report["speedup"] = round(report["sequential_seconds"] / report["batched_seconds"], 1)
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
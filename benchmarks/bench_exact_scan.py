@@ -0,0 +1,92 @@
+"""
+完全走査フォールバック（components/vector_index.scan_top_k）のベンチマーク
+PostgRESTが返す形式（"[0.1,0.2,...]" の文字列）の合成チャンクを1000行ずつのページで与え、
+従来の1行ずつのコサイン類似度計算と、ブロック単位の行列積 + 上位kヒープのスループットを比較します。
+ネットワーク転送時間は含みません。
+
+実行:
+    python benchmarks/bench_exact_scan.py --chunks 20000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from components.vector_index import PAGE_SIZE, scan_top_k
+
+DIM = 1536
+
+
+def legacy_scan(query_embedding, pages, n_results):
+    """変更前の実装と同じ、1行ずつ np.linalg.norm を呼ぶ方式"""
+    docs = []
+    for rows in pages:
+        for item in rows:
+            embedding = json.loads(item["embedding"])
+            similarity = np.dot(query_embedding, embedding) / (
+                np.linalg.norm(query_embedding) * np.linalg.norm(embedding)
+            )
+            docs.append((similarity, item))
+    docs.sort(key=lambda x: -x[0])
+    return docs[:n_results]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="完全走査フォールバック ベンチマーク")
+    parser.add_argument("--chunks", type=int, default=20_000)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--skip-legacy", action="store_true", help="従来方式の計測を省略")
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((args.chunks, DIM)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    rows = [
+        {
+            "content_id": f"content-{i // 20}",
+            "chunk_index": i % 20,
+            "chunk_text": f"chunk {i}",
+            "embedding": "[" + ",".join(f"{x:.8f}" for x in vector) + "]"
+        }
+        for i, vector in enumerate(vectors)
+    ]
+    pages = [rows[i:i + PAGE_SIZE] for i in range(0, len(rows), PAGE_SIZE)]
+    query = (vectors[123] + 0.1 * rng.standard_normal(DIM)).tolist()
+
+    report = {"chunks": args.chunks, "k": args.k}
+
+    started = time.perf_counter()
+    top = scan_top_k(query, iter(pages), args.k)
+    seconds = time.perf_counter() - started
+    report["blocked_chunks_per_sec"] = round(args.chunks / seconds)
+
+    # 行列積部分だけのスループット（パース済みの場合）
+    matrix_pages = [vectors[i:i + PAGE_SIZE] for i in range(0, len(vectors), PAGE_SIZE)]
+    started = time.perf_counter()
+    for block in matrix_pages:
+        scores = block @ np.asarray(query, dtype=np.float32)
+        np.argpartition(-scores, args.k - 1)[:args.k]
+    report["matmul_only_chunks_per_sec"] = round(args.chunks / (time.perf_counter() - started))
+
+    if not args.skip_legacy:
+        started = time.perf_counter()
+        legacy = legacy_scan(query, pages, args.k)
+        seconds = time.perf_counter() - started
+        report["legacy_chunks_per_sec"] = round(args.chunks / seconds)
+        report["same_top_k"] = [row["chunk_text"] for _, row in top] == [row["chunk_text"] for _, row in legacy]
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
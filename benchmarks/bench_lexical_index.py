@@ -0,0 +1,110 @@
+"""
+BM25転置インデックス（components/lexical_index.py）のベンチマーク
+合成した日本語風コーパスでインデックスを構築し、クエリのレイテンシと保存サイズ、
+構築後の教材1件の更新（操作ログへの追記）と、他のプロセスに相当するインスタンスへの反映・ベースへの統合の時間を計測します。
+
+実行:
+    python benchmarks/bench_lexical_index.py --chunks 100000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from components.lexical_index import LexicalIndex
+
+# ひらがな・カタカナ・常用漢字の一部から語彙を作る
+CHAR_POOL = (
+    [chr(c) for c in range(0x3041, 0x3097)]
+    + [chr(c) for c in range(0x30A1, 0x30FB)]
+    + [chr(c) for c in range(0x4E00, 0x4E00 + 1500)]
+)
+ASCII_TERMS = ["SEO", "H2", "WordPress", "Cocoon", "SiteGuard", "AFFINGER", "https://example.com/guide"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BM25転置インデックス ベンチマーク")
+    parser.add_argument("--chunks", type=int, default=100_000)
+    parser.add_argument("--chunks-per-content", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    words = ["".join(rng.choice(CHAR_POOL) for _ in range(rng.randint(1, 4))) for _ in range(20_000)]
+    words += ASCII_TERMS
+
+    def sentence(n_words):
+        return "".join(rng.choice(words) for _ in range(n_words))
+
+    path = os.path.join(tempfile.mkdtemp(), "lexical_index.npz")
+    index = LexicalIndex(path)
+
+    started = time.perf_counter()
+    n_contents = max(1, args.chunks // args.chunks_per_content)
+    index.rebuild(
+        (
+            f"content-{content}",
+            [sentence(120) for _ in range(args.chunks_per_content)],
+            {"title": f"教材{content}", "doc_type": "video" if content % 3 == 0 else "text"}
+        )
+        for content in range(n_contents)
+    )
+    build_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    index = LexicalIndex(path)
+    load_seconds = time.perf_counter() - started
+
+    # 構築済みのインデックスに対する教材1件の更新（リクエストの処理中に行われる部分）
+    other = LexicalIndex(path)
+    update_ms, sync_ms = [], []
+    for i in range(20):
+        started = time.perf_counter()
+        index.replace_content(f"content-{i}", [sentence(120) for _ in range(args.chunks_per_content)],
+                              {"title": f"教材{i}（更新）", "doc_type": "text"})
+        update_ms.append((time.perf_counter() - started) * 1000)
+        started = time.perf_counter()
+        other.search("教材", 1)
+        sync_ms.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    index.compact()
+    compact_seconds = time.perf_counter() - started
+
+    queries = [sentence(rng.randint(2, 8)) for _ in range(args.queries)]
+    queries += [f"{term}とは" for term in ASCII_TERMS]
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        index.search(query, 20)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    report = {
+        "chunks": len(index),
+        "build_seconds": round(build_seconds, 2),
+        "load_seconds": round(load_seconds, 2),
+        "update_p50_ms": round(float(np.percentile(update_ms, 50)), 2),
+        "other_process_sync_p50_ms": round(float(np.percentile(sync_ms, 50)), 2),
+        "compact_seconds": round(compact_seconds, 2),
+        "file_mb": round(os.path.getsize(path) / 1024 / 1024, 2),
+        "query_p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "query_p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        "query_p99_ms": round(float(np.percentile(latencies, 99)), 3),
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+量子化ベクトル（components/vector_index.quantize）のベンチマーク
+クラスタ構造を持つ合成コーパスで、float32の完全検索と
+float16 / int8 の量子化行列 + float32再計算（rescore）の recall@k、レイテンシ、常駐メモリを比較します。
+LocalVectorIndex と同じく .npy をメモリマップで読み込み、検索後に実際にページインされた量（/proc/self/smaps の Rss）を
+resident_mb として、ファイルの合計サイズを disk_mb として記録します（rescore ではfloat32のファイルも残るため disk_mb は増えます）。
+
+実行:
+    python benchmarks/bench_quantization.py --chunks 100000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from components.vector_index import approximate_scores, quantize
+
+DIM = 1536
+
+
+def top_k(scores, k):
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def resident_mb(paths):
+    """指定したファイルのメモリマップのうち、このプロセスで実際に常駐しているページ量（MB）。Linux以外ではNone"""
+    try:
+        with open("/proc/self/smaps", "r") as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+
+    paths = {os.path.realpath(p) for p in paths}
+    total_kb = 0
+    mapped = False
+    for line in lines:
+        fields = line.split()
+        if fields and "-" in fields[0] and len(fields) >= 5 and not fields[0].endswith(":"):
+            mapped = len(fields) >= 6 and fields[5] in paths
+        elif mapped and fields[0] == "Rss:":
+            total_kb += int(fields[1])
+    return round(total_kb / 1024, 1)
+
+
+def disk_mb(paths):
+    return round(sum(os.path.getsize(p) for p in paths) / 1024 / 1024, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="量子化ベクトル ベンチマーク")
+    parser.add_argument("--chunks", type=int, default=100_000)
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--rescore-factor", type=int, default=10)
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    # 教材チャンクのembeddingは話題ごとに固まるため、クラスタ中心 + ノイズで近い候補が多い状況を作る
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((args.clusters, DIM)).astype(np.float32)
+    vectors = np.empty((args.chunks, DIM), dtype=np.float32)
+    for start in range(0, args.chunks, 10_000):
+        n = min(10_000, args.chunks - start)
+        block = centers[rng.integers(0, args.clusters, n)] + 0.8 * rng.standard_normal((n, DIM)).astype(np.float32)
+        vectors[start:start + n] = block / np.linalg.norm(block, axis=1, keepdims=True)
+
+    picks = rng.integers(0, args.chunks, args.queries)
+    queries = vectors[picks] + 0.3 * rng.standard_normal((args.queries, DIM)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    workdir = tempfile.mkdtemp(prefix="bench_quantization-")
+    vectors_file = os.path.join(workdir, "vectors.npy")
+    np.save(vectors_file, vectors)
+    compact_files = {}
+    for mode in ("float16", "int8"):
+        compact, scale = quantize(vectors, mode)
+        compact_files[mode] = os.path.join(workdir, f"{mode}.npy")
+        np.save(compact_files[mode], compact)
+        if scale is not None:
+            np.save(os.path.join(workdir, f"{mode}scale.npy"), scale)
+    del vectors, compact
+
+    latencies = []
+    truth = []
+    matrix = np.load(vectors_file, mmap_mode="r")
+    for query in queries:
+        started = time.perf_counter()
+        truth.append(top_k(matrix @ query, args.k))
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    report = {
+        "chunks": args.chunks,
+        "k": args.k,
+        "rescore_factor": args.rescore_factor,
+        "float32": {
+            "resident_mb": resident_mb([vectors_file]),
+            "disk_mb": disk_mb([vectors_file]),
+            "recall_at_k": 1.0,
+            "query_p50_ms": round(float(np.percentile(latencies, 50)), 2),
+            "query_p95_ms": round(float(np.percentile(latencies, 95)), 2),
+        }
+    }
+    del matrix
+
+    for mode in ("float16", "int8"):
+        scale_file = os.path.join(workdir, f"{mode}scale.npy")
+        scale = np.load(scale_file) if os.path.exists(scale_file) else None
+        n_candidates = args.k * args.rescore_factor
+
+        for rescore in (False, True):
+            # モードごとに開き直し、前の計測でページインしたマッピングを持ち越さない
+            compact = np.load(compact_files[mode], mmap_mode="r")
+            matrix = np.load(vectors_file, mmap_mode="r")
+            latencies = []
+            hits = 0
+            for query, expected in zip(queries, truth):
+                started = time.perf_counter()
+                approx = approximate_scores(compact, scale, query)
+                if rescore:
+                    candidates = np.sort(np.argpartition(-approx, n_candidates - 1)[:n_candidates])
+                    found = candidates[top_k(matrix[candidates] @ query, args.k)]
+                else:
+                    found = top_k(approx, args.k)
+                latencies.append((time.perf_counter() - started) * 1000)
+                hits += len(set(found.tolist()) & set(expected.tolist()))
+
+            files = [compact_files[mode]] + ([scale_file] if scale is not None else [])
+            if rescore:
+                files.append(vectors_file)
+            report[f"{mode}{'+rescore' if rescore else ''}"] = {
+                "resident_mb": resident_mb(files),
+                "disk_mb": disk_mb(files),
+                "recall_at_k": round(hits / (args.k * len(queries)), 4),
+                "query_p50_ms": round(float(np.percentile(latencies, 50)), 2),
+                "query_p95_ms": round(float(np.percentile(latencies, 95)), 2),
+            }
+            del compact, matrix
+
+    for name in os.listdir(workdir):
+        os.remove(os.path.join(workdir, name))
+    os.rmdir(workdir)
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
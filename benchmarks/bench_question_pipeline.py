@@ -0,0 +1,310 @@
+"""
+質問パイプライン（components/question_pipeline.QuestionPipeline）のベンチマーク
+embedding API・Supabase RPC・BM25検索・回答キャッシュの版確認・チャットAPIのストリーミング・質問ログの書き込み・
+サイドバーの描画を、指定した待ち時間で応答するスタブに置き換え、従来の app.py と同じ順番に1つずつ処理する場合と
+QuestionPipeline で並行に処理する場合のエンドツーエンドのレイテンシを比較します。
+検索・回答キャッシュ・プロンプトの組み立ては実際のコード（KnowledgeBaseSupabase.search / asearch など）を使います。
+
+計測する時間（質問の送信から）:
+    first_token_ms  回答の最初の断片が表示されるまで
+    answer_ms       回答の最後の断片が表示されるまで
+    script_ms       スクリプトの処理が終わるまで（従来の処理では質問ログの書き込みを含む）
+
+実行:
+    python benchmarks/bench_question_pipeline.py --questions 30
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from components.answer_cache import SemanticAnswerCache
+from components.answer_stream import stream_answer
+from components.context_builder import assemble_context
+from components.embedding_cache import CachedEmbeddings
+from components.hashing_embeddings import HashingEmbeddings
+from components.knowledge_base_supabase import KnowledgeBaseSupabase
+from components.prompt_builder import pack_prompt
+from components.question_logger import QuestionLogger
+from components.question_pipeline import QuestionPipeline
+from utils.links import extract_links
+
+CHAR_POOL = [chr(c) for c in range(0x3041, 0x3097)] + [chr(c) for c in range(0x4E00, 0x4E00 + 1500)]
+
+
+class LatencyEmbeddings:
+    """embed_query / aembed_query の前に待ち時間を入れる"""
+
+    def __init__(self, embeddings, latency: float):
+        self.embeddings = embeddings
+        self.latency = latency
+        self.model = embeddings.model
+
+    def embed_query(self, text):
+        time.sleep(self.latency)
+        return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text):
+        await asyncio.sleep(self.latency)
+        return self.embeddings.embed_query(text)
+
+    def embed_documents(self, texts):
+        time.sleep(self.latency)
+        return self.embeddings.embed_documents(texts)
+
+
+class StubRpc:
+    def __init__(self, rows, latency, asynchronous):
+        self.rows = rows
+        self.latency = latency
+        self.asynchronous = asynchronous
+
+    def execute(self):
+        if self.asynchronous:
+            return self._aexecute()
+        time.sleep(self.latency)
+        return SimpleNamespace(data=self.rows)
+
+    async def _aexecute(self):
+        await asyncio.sleep(self.latency)
+        return SimpleNamespace(data=self.rows)
+
+
+class StubSupabase:
+    """match_documents_filtered だけに応答するSupabaseクライアント（同期・非同期）"""
+
+    def __init__(self, chunks, latency, asynchronous=False):
+        self.chunks = chunks
+        self.latency = latency
+        self.asynchronous = asynchronous
+
+    def rpc(self, name, params):
+        rows = [dict(chunk, similarity=0.9 - i * 0.01) for i, chunk in enumerate(
+            random.Random(len(params["query_embedding"])).sample(self.chunks, params["match_count"])
+        )]
+        return StubRpc(rows, self.latency, self.asynchronous)
+
+
+class StubLexicalIndex:
+    def __init__(self, chunks, latency):
+        self.chunks = chunks
+        self.latency = latency
+
+    def search(self, query, n_results, chapter=None, lesson=None, doc_type=None):
+        time.sleep(self.latency)
+        return [dict(chunk, similarity=0.5) for chunk in self.chunks[:n_results]]
+
+
+class StubCompletions:
+    """最初の断片までと断片ごとの待ち時間を入れてストリーミングするチャットAPI"""
+
+    def __init__(self, first_token, per_token, tokens, asynchronous):
+        self.first_token = first_token
+        self.per_token = per_token
+        self.tokens = tokens
+        self.asynchronous = asynchronous
+
+    def _chunks(self):
+        for i in range(self.tokens):
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=f"回答{i}。"))], usage=None)
+        usage = SimpleNamespace(prompt_tokens=1000, completion_tokens=self.tokens)
+        yield SimpleNamespace(choices=[], usage=usage)
+
+    def create(self, **kwargs):
+        if self.asynchronous:
+            return self._acreate()
+        return self._stream()
+
+    def _stream(self):
+        time.sleep(self.first_token)
+        for i, chunk in enumerate(self._chunks()):
+            if i:
+                time.sleep(self.per_token)
+            yield chunk
+
+    async def _acreate(self):
+        return self._astream()
+
+    async def _astream(self):
+        await asyncio.sleep(self.first_token)
+        for i, chunk in enumerate(self._chunks()):
+            if i:
+                await asyncio.sleep(self.per_token)
+            yield chunk
+
+
+class LatencyLogger(QuestionLogger):
+    """ファイルへの書き込みの前に待ち時間を入れる（共有ストレージへの保存を想定）"""
+
+    def __init__(self, log_file, latency):
+        super().__init__(log_file)
+        self.latency = latency
+
+    def _save_logs(self):
+        time.sleep(self.latency)
+        super()._save_logs()
+
+
+def make_chunks(rng, n):
+    words = ["".join(rng.choice(CHAR_POOL) for _ in range(rng.randint(2, 4))) for _ in range(500)]
+    return [
+        {
+            "content_id": f"content-{i // 5}",
+            "chunk_index": i % 5,
+            "chunk_text": "".join(rng.choice(words) for _ in range(120)) + f" https://www.youtube.com/watch?v=vid{i:07d}",
+            "title": f"教材{i // 5}",
+            "url": f"https://utage.example.com/lesson/{i // 5}",
+            "chapter": f"第{i % 10}章",
+            "lesson": f"レッスン{i // 5}",
+            "doc_type": "text"
+        }
+        for i in range(n)
+    ]
+
+
+def make_kb(chunks, args, seconds):
+    """ネットワークの代わりにスタブを持つ KnowledgeBaseSupabase（__init__ は通さない）"""
+    kb = KnowledgeBaseSupabase.__new__(KnowledgeBaseSupabase)
+    kb.embeddings = CachedEmbeddings(LatencyEmbeddings(HashingEmbeddings(), seconds(args.embed_ms)), db_path=None)
+    kb.supabase = StubSupabase(chunks, seconds(args.rpc_ms))
+    kb._async_supabase = StubSupabase(chunks, seconds(args.rpc_ms), asynchronous=True)
+    kb._supabase_credentials = (None, None)
+    kb.lexical_index = StubLexicalIndex(chunks, seconds(args.lexical_ms)) if args.lexical_ms else None
+    kb.local_index = None
+    kb.ef_search = 40
+    return kb
+
+
+def render_sidebar(logger, latency):
+    """サイドバーの「よく聞かれるトピック」（ログの集計と描画）"""
+    time.sleep(latency)
+    return sum(1 for log in logger.get_all_logs() if "タイトル" in log["question"])
+
+
+def render_references(docs, latency):
+    time.sleep(latency)
+    return [extract_links(doc["content"]) for doc in docs[:3]]
+
+
+def sequential(question, kb, answer_cache, logger, client, args, seconds):
+    """従来の app.py と同じ順番で1つずつ処理する"""
+    started = time.perf_counter()
+    render_sidebar(logger, seconds(args.sidebar_ms))
+    question_embedding = kb.embeddings.embed_query(question)
+    answer_cache.lookup(question_embedding)
+    docs = assemble_context(kb.search(question, n_results=10), max_chunks=5, max_chunks_per_lesson=2)
+    packed = pack_prompt(docs, question, max_input_tokens=4000)
+    render_references(packed["docs"], seconds(args.render_ms))
+    streamed = stream_answer([{"role": "user", "content": question}], started=started, client=client)
+    for _ in streamed:
+        pass
+    answer_ms = (time.perf_counter() - started) * 1000
+    answer_cache.put(question, question_embedding, packed["docs"], streamed.text)
+    logger.log_question(question, streamed.text, [], metrics={})
+    return {"first_token_ms": streamed.first_token_ms, "answer_ms": answer_ms,
+            "script_ms": (time.perf_counter() - started) * 1000}
+
+
+def pipelined(question, pipeline, logger, args, seconds):
+    started = time.perf_counter()
+    run = pipeline.start(question)
+    render_sidebar(logger, seconds(args.sidebar_ms))
+    docs = run.wait_context()
+    render_references(docs, seconds(args.render_ms))
+    first_token_ms = None
+    for _ in run:
+        if first_token_ms is None:
+            first_token_ms = (time.perf_counter() - started) * 1000
+    answer_ms = (time.perf_counter() - started) * 1000
+    result = {"first_token_ms": first_token_ms, "answer_ms": answer_ms, "script_ms": answer_ms}
+    # 質問ログの書き込みは応答後に行われるため計測に含めない（次の質問と重ならないよう待つ）
+    run.wait_logged()
+    return result
+
+
+def summarize(samples):
+    summary = {}
+    for key in ("first_token_ms", "answer_ms", "script_ms"):
+        values = [sample[key] for sample in samples]
+        summary[key] = {
+            "p50": round(float(np.percentile(values, 50)), 1),
+            "p95": round(float(np.percentile(values, 95)), 1)
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="質問パイプライン ベンチマーク")
+    parser.add_argument("--questions", type=int, default=30)
+    parser.add_argument("--chunks", type=int, default=2_000)
+    parser.add_argument("--embed-ms", type=float, default=250.0, help="embedding API の待ち時間")
+    parser.add_argument("--rpc-ms", type=float, default=120.0, help="ベクトル検索RPCの待ち時間")
+    parser.add_argument("--lexical-ms", type=float, default=30.0, help="BM25検索の時間（0でハイブリッド検索なし）")
+    parser.add_argument("--versions-ms", type=float, default=60.0, help="回答キャッシュの版確認（contents の取得）の待ち時間")
+    parser.add_argument("--first-token-ms", type=float, default=600.0, help="チャットAPIの最初の断片までの待ち時間")
+    parser.add_argument("--per-token-ms", type=float, default=15.0, help="チャットAPIの断片ごとの待ち時間")
+    parser.add_argument("--answer-tokens", type=int, default=150)
+    parser.add_argument("--log-ms", type=float, default=80.0, help="質問ログの保存の待ち時間")
+    parser.add_argument("--sidebar-ms", type=float, default=40.0, help="サイドバーの描画時間")
+    parser.add_argument("--render-ms", type=float, default=30.0, help="参照した教材の描画時間")
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    def seconds(ms):
+        return ms / 1000
+
+    rng = random.Random(0)
+    chunks = make_chunks(rng, args.chunks)
+    questions = ["".join(rng.choice(CHAR_POOL) for _ in range(20)) + "とは何ですか？" for _ in range(args.questions)]
+
+    def get_versions(content_ids):
+        time.sleep(seconds(args.versions_ms))
+        return {content_id: "2026-01-01T00:00:00+00:00" for content_id in content_ids}
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        # 従来の処理
+        kb = make_kb(chunks, args, seconds)
+        answer_cache = SemanticAnswerCache(get_versions)
+        logger = LatencyLogger(os.path.join(tmp, "sequential.json"), seconds(args.log_ms))
+        client = SimpleNamespace(chat=SimpleNamespace(completions=StubCompletions(
+            seconds(args.first_token_ms), seconds(args.per_token_ms), args.answer_tokens, asynchronous=False
+        )))
+        results["sequential"] = summarize([
+            sequential(question, kb, answer_cache, logger, client, args, seconds) for question in questions
+        ])
+
+        # QuestionPipeline
+        kb = make_kb(chunks, args, seconds)
+        answer_cache = SemanticAnswerCache(get_versions)
+        logger = LatencyLogger(os.path.join(tmp, "pipeline.json"), seconds(args.log_ms))
+        client = SimpleNamespace(chat=SimpleNamespace(completions=StubCompletions(
+            seconds(args.first_token_ms), seconds(args.per_token_ms), args.answer_tokens, asynchronous=True
+        )))
+        pipeline = QuestionPipeline(kb, answer_cache, logger, client=client)
+        results["pipeline"] = summarize([pipelined(question, pipeline, logger, args, seconds) for question in questions])
+        pipeline.close()
+
+    results["p50_reduction"] = {
+        key: round(1 - results["pipeline"][key]["p50"] / results["sequential"][key]["p50"], 3)
+        for key in ("first_token_ms", "answer_ms", "script_ms")
+    }
+    report = {"config": vars(args), "results": results}
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
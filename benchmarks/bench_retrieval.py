@@ -0,0 +1,210 @@
+"""
+検索品質・レイテンシのベンチマーク
+sample_data.py の教材と、それに対する質問→正解教材のラベル付きセット、
+さらに合成した教材（規模の拡大用）を KnowledgeBase / KnowledgeBaseSupabase に登録し、
+search の recall@k・MRR・レイテンシ（p50/p95/p99）・メモリを計測します。
+
+embeddingは components/hashing_embeddings.HashingEmbeddings（文字n-gramの特徴ハッシュ）を使うため、
+OpenAI APIへの通信は発生せず、同じ引数なら毎回同じ結果になります。
+結果はJSONで出力されるので、チャンク分割や検索の変更前後で比較できます。
+
+実行:
+    # Chroma（一時ディレクトリに作成、ネットワーク不要）
+    python benchmarks/bench_retrieval.py --synthetic-lessons 500 --json results/retrieval.json
+
+    # Supabase（.env の SUPABASE_URL / SUPABASE_KEY。検証用プロジェクトで実行してください）
+    python benchmarks/bench_retrieval.py --backend supabase
+    登録した教材は終了時に削除します（--keep で残す）
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from components.hashing_embeddings import HashingEmbeddings
+from sample_data import SAMPLE_MATERIALS
+
+BENCH_CHAPTER = "__benchmark__"
+
+# sample_data.py の教材に対する質問と、回答の根拠になるべき教材のタイトル
+LABELED_QUERIES = [
+    ("ブログのタイトルは何文字以内がいいですか？", "ブログの基本構成"),
+    ("記事の導入文には何を書けばいい？", "ブログの基本構成"),
+    ("1段落は何行くらいにすべき？", "ブログの基本構成"),
+    ("記事のまとめで読者に何を促せばいいですか", "ブログの基本構成"),
+    ("キーワード選定のやり方を教えて", "SEOライティングの基礎"),
+    ("ロングテールキーワードとは？", "SEOライティングの基礎"),
+    ("H2やH3の見出しの使い方", "SEOライティングの基礎"),
+    ("内部リンクはいくつ貼るのが適切？", "SEOライティングの基礎"),
+    ("タイトルにメインキーワードを入れる位置は？", "SEOライティングの基礎"),
+    ("WordPressのパーマリンク設定はどれを選ぶ？", "WordPressの初期設定（動画文字起こし）"),
+    ("最低限入れておくべきプラグインは？", "WordPressの初期設定（動画文字起こし）"),
+    ("おすすめの無料テーマはありますか", "WordPressの初期設定（動画文字起こし）"),
+    ("スパム対策のプラグイン", "WordPressの初期設定（動画文字起こし）"),
+    ("ユーザー名とニックネームを分けるのはなぜ？", "WordPressの初期設定（動画文字起こし）"),
+]
+
+# 合成教材の語彙（ひらがな・カタカナ・常用漢字の一部）
+CHAR_POOL = (
+    [chr(c) for c in range(0x3041, 0x3097)]
+    + [chr(c) for c in range(0x30A1, 0x30FB)]
+    + [chr(c) for c in range(0x4E00, 0x4E00 + 1500)]
+)
+
+
+def synthetic_materials(n_lessons, seed=0):
+    """
+    合成教材と質問を作る。各教材は固有の話題語を3つ持ち、質問はそのうち2つを含む
+    本文の大部分は全教材で共通の語彙なので、話題語を手がかりに正しい教材を選べるかを測れる
+    """
+    rng = random.Random(seed)
+    words = ["".join(rng.choice(CHAR_POOL) for _ in range(rng.randint(2, 4))) for _ in range(n_lessons * 3 + 300)]
+    common, topics = words[:300], words[300:]
+
+    materials, queries = [], []
+    for i in range(n_lessons):
+        topic = topics[i * 3:i * 3 + 3]
+        sentences = []
+        for _ in range(rng.randint(10, 120)):
+            sentence = rng.sample(common, 6)
+            if rng.random() < 0.4:
+                sentence.insert(rng.randrange(len(sentence)), rng.choice(topic))
+            sentences.append("".join(sentence) + "。")
+        title = f"合成レッスン{i}"
+        materials.append({
+            "title": title,
+            "content": "\n".join(sentences),
+            "url": f"https://example.com/synthetic/{i}",
+            "doc_type": "text"
+        })
+        queries.append((f"{topic[0]}と{topic[1]}について教えてください", title))
+    return materials, queries
+
+
+def peak_rss_mb():
+    """このプロセスの最大常駐メモリ（Linuxはキロバイト、macOSはバイト単位）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def open_knowledge_base(backend):
+    # 実際のAPIキーは不要（embeddingは差し替える）が、OpenAIEmbeddings の初期化に値が必要
+    os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+    if backend == "chroma":
+        from components.knowledge_base import KnowledgeBase
+
+        # KnowledgeBase は ./chroma_db に保存するため、一時ディレクトリで作成する
+        os.chdir(tempfile.mkdtemp())
+        kb = KnowledgeBase()
+    else:
+        from dotenv import load_dotenv
+        from components.knowledge_base_supabase import KnowledgeBaseSupabase
+
+        load_dotenv(os.path.join(ROOT, ".env"))
+        kb = KnowledgeBaseSupabase()
+    kb.embeddings = HashingEmbeddings()
+    return kb
+
+
+def ingest(kb, materials):
+    started = time.perf_counter()
+    for i, material in enumerate(materials):
+        kb.add_document(
+            content=material["content"],
+            title=material["title"],
+            url=material["url"],
+            doc_type=material["doc_type"],
+            chapter=BENCH_CHAPTER,
+            lesson=material["title"],
+            lesson_order=i
+        )
+    return time.perf_counter() - started
+
+
+def evaluate(kb, queries, ks):
+    """質問ごとに検索し、正解教材の順位から recall@k と MRR、検索レイテンシを求める"""
+    max_k = max(ks)
+    latencies, ranks = [], []
+    for query, expected in queries:
+        started = time.perf_counter()
+        docs = kb.search(query, n_results=max_k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        titles = [doc["title"] for doc in docs]
+        ranks.append(titles.index(expected) if expected in titles else None)
+
+    report = {"queries": len(queries)}
+    for k in ks:
+        report[f"recall@{k}"] = round(sum(1 for r in ranks if r is not None and r < k) / len(ranks), 4)
+    report["mrr"] = round(sum(1 / (r + 1) for r in ranks if r is not None) / len(ranks), 4)
+    for p in (50, 95, 99):
+        report[f"latency_p{p}_ms"] = round(float(np.percentile(latencies, p)), 2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="検索品質・レイテンシ ベンチマーク")
+    parser.add_argument("--backend", default="chroma", choices=["chroma", "supabase"])
+    parser.add_argument("--synthetic-lessons", type=int, default=200, help="規模拡大用の合成教材数（0で無効）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-k", type=int, nargs="+", default=[1, 3, 5], help="recall@k の k")
+    parser.add_argument("--keep", action="store_true", help="Supabaseに登録した教材を削除しない")
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    kb = open_knowledge_base(args.backend)
+    synthetic, synthetic_queries = synthetic_materials(args.synthetic_lessons, args.seed)
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "backend": args.backend,
+        "embeddings": kb.embeddings.model,
+        "synthetic_lessons": args.synthetic_lessons,
+        "seed": args.seed,
+    }
+
+    try:
+        # サンプル教材だけの場合
+        report["sample_ingest_seconds"] = round(ingest(kb, SAMPLE_MATERIALS), 2)
+        report["sample"] = evaluate(kb, LABELED_QUERIES, args.k)
+
+        # 合成教材を加えて規模を拡大した場合（サンプルの質問も、紛らわしい教材が増えた状態で測り直す）
+        if synthetic:
+            report["synthetic_ingest_seconds"] = round(ingest(kb, synthetic), 2)
+            report["scaled_sample"] = evaluate(kb, LABELED_QUERIES, args.k)
+            report["scaled_synthetic"] = evaluate(kb, synthetic_queries, args.k)
+        report["peak_rss_mb"] = peak_rss_mb()
+    finally:
+        if args.backend == "supabase" and not args.keep:
+            for material in SAMPLE_MATERIALS + synthetic:
+                kb.delete_content(BENCH_CHAPTER, material["title"], material["title"])
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+複数クエリ一括検索（LocalVectorIndex.search_many）のベンチマーク
+合成コーパスのスナップショットをローカルベクトル索引の形式で書き出し、
+search を1件ずつ呼ぶループと search_many の1回呼び出しのスループットを比較します。
+--embed-latency-ms を指定すると、embedding API 1回あたりの待ち時間（search は質問ごと、
+search_many はまとめて1回）を加えたスループットも計算します。
+
+実行:
+    python benchmarks/bench_search_many.py --chunks 50000 --queries 500
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from components.vector_index import EMBEDDING_DIM, ROW_FORMAT, LocalVectorIndex
+
+
+def write_snapshot(path, vectors, chunks_per_content):
+    """LocalVectorIndex.refresh が書き出すのと同じ形式の世代ファイルを作る"""
+    n_contents = (len(vectors) + chunks_per_content - 1) // chunks_per_content
+    np.save(os.path.join(path, "vectors-1.npy"), vectors)
+    np.save(os.path.join(path, "rows-1.npy"), (np.arange(len(vectors)) // chunks_per_content).astype(np.int32))
+    meta = {
+        "rows": [[f"content-{i // chunks_per_content}", i % chunks_per_content, f"chunk {i}", None, []]
+                 for i in range(len(vectors))],
+        "contents": [{"id": f"content-{c}", "title": f"教材{c}", "chapter": f"第{c % 10}章",
+                      "lesson": f"レッスン{c}", "doc_type": "video" if c % 3 == 0 else "text"}
+                     for c in range(n_contents)]
+    }
+    with open(os.path.join(path, "meta-1.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    with open(os.path.join(path, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({"format": ROW_FORMAT, "generation": 1, "count": len(vectors), "synced_at": time.time(), "versions": {}}, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="複数クエリ一括検索 ベンチマーク")
+    parser.add_argument("--chunks", type=int, default=50_000)
+    parser.add_argument("--chunks-per-content", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--quantization", default="none", choices=["none", "float16", "int8"])
+    parser.add_argument("--embed-latency-ms", type=float, default=200.0,
+                        help="embedding API 1回あたりの想定レイテンシ（ミリ秒）")
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((args.chunks, EMBEDDING_DIM)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = vectors[rng.integers(0, args.chunks, args.queries)]
+    queries = queries + 0.5 * rng.standard_normal(queries.shape).astype(np.float32)
+
+    path = tempfile.mkdtemp()
+    write_snapshot(path, vectors, args.chunks_per_content)
+    # 同期はしない（スナップショットを読み込むだけ）
+    index = LocalVectorIndex(None, path, refresh_interval=float("inf"), quantization=args.quantization)
+    index.search(queries[0], args.k)
+
+    started = time.perf_counter()
+    looped = [index.search(query, args.k) for query in queries]
+    loop_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batched = index.search_many(queries, args.k)
+    batch_seconds = time.perf_counter() - started
+
+    embed_seconds = args.embed_latency_ms / 1000
+    report = {
+        "chunks": args.chunks,
+        "queries": args.queries,
+        "k": args.k,
+        "quantization": args.quantization,
+        "same_results": [[r["chunk_text"] for r in rs] for rs in looped]
+                        == [[r["chunk_text"] for r in rs] for rs in batched],
+        "search_loop_qps": round(args.queries / loop_seconds, 1),
+        "search_many_qps": round(args.queries / batch_seconds, 1),
+        "index_speedup": round(loop_seconds / batch_seconds, 1),
+        # embedding API呼び出しを含めた場合（search: 質問数回、search_many: 1回）
+        "end_to_end_loop_qps": round(args.queries / (loop_seconds + embed_seconds * args.queries), 1),
+        "end_to_end_many_qps": round(args.queries / (batch_seconds + embed_seconds), 1),
+    }
+    report["end_to_end_speedup"] = round(report["end_to_end_many_qps"] / report["end_to_end_loop_qps"], 1)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
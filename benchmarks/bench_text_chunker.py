@@ -0,0 +1,152 @@
+"""
+チャンク分割（components/text_chunker.TextChunker）のベンチマーク
+合成した日本語の記事（段落あり）と動画の文字起こし（句読点なし・空白区切りまたは区切りなし）を分割し、
+従来の RecursiveCharacterTextSplitter と処理速度・チャンクの大きさの分布・編集後に本文が変わらないチャンクの割合を比較します。
+
+実行:
+    python benchmarks/bench_text_chunker.py --documents 200 --edits 20
+"""
+import argparse
+import io
+import json
+import os
+import random
+import re
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from components.text_chunker import TextChunker
+from utils.tokens import count_tokens
+
+try:
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+except ImportError:
+    try:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+    except ImportError:
+        RecursiveCharacterTextSplitter = None
+
+# ひらがな・カタカナ・常用漢字の一部から語彙を作る
+CHAR_POOL = (
+    [chr(c) for c in range(0x3041, 0x3097)]
+    + [chr(c) for c in range(0x30A1, 0x30FB)]
+    + [chr(c) for c in range(0x4E00, 0x4E00 + 1500)]
+)
+ASCII_TERMS = ["SEO", "WordPress", "Google", "H2", "https://example.com/guide"]
+SENTENCE = re.compile(r"[^。！？\n]*(?:[。！？]+」?|\n+)")
+
+
+def make_corpus(rng: random.Random, documents: int):
+    words = ["".join(rng.choice(CHAR_POOL) for _ in range(rng.randint(1, 4))) for _ in range(5_000)]
+    words += ASCII_TERMS
+
+    def sentence():
+        text = "".join(rng.choice(words) for _ in range(rng.randint(5, 25)))
+        if rng.random() < 0.4:
+            text += "、" + "".join(rng.choice(words) for _ in range(rng.randint(3, 12)))
+        return text + rng.choice(["。", "。", "。", "！", "？"])
+
+    def article():
+        paragraphs = ["".join(sentence() for _ in range(rng.randint(2, 8))) for _ in range(rng.randint(5, 30))]
+        return "\n\n".join(paragraphs)
+
+    def transcript():
+        # 動画の文字起こしは句読点がなく、空白で区切られているか、区切りがまったくないことが多い
+        separator = rng.choice([" ", ""])
+        return separator.join(rng.choice(words) for _ in range(rng.randint(2_000, 8_000)))
+
+    return [article() if i % 4 else transcript() for i in range(documents)], sentence
+
+
+def distribution(values):
+    return {
+        "min": int(np.min(values)),
+        "p50": int(np.percentile(values, 50)),
+        "p95": int(np.percentile(values, 95)),
+        "max": int(np.max(values)),
+        "mean": round(float(np.mean(values)), 1)
+    }
+
+
+def run(name, split_text, documents, edit_rng, sentence, edits):
+    started = time.perf_counter()
+    chunked = [split_text(document) for document in documents]
+    seconds = time.perf_counter() - started
+    chunks = [chunk for document in chunked for chunk in document]
+
+    # 記事の途中に文を2つ挿入し、挿入前と本文が同じチャンク（embeddingを使い回せるもの）の割合を数える
+    kept, total = 0, 0
+    articles = [(document, set(original)) for document, original in zip(documents, chunked) if "\n\n" in document]
+    for document, original in edit_rng.sample(articles, min(edits, len(articles))):
+        sentences = SENTENCE.findall(document)
+        position = edit_rng.randrange(len(sentences))
+        sentences.insert(position, sentence() + sentence())
+        edited = split_text("".join(sentences))
+        kept += len(original.intersection(edited))
+        total += len(edited)
+
+    return {
+        "splitter": name,
+        "seconds": round(seconds, 3),
+        "chunks": len(chunks),
+        "chunks_per_sec": round(len(chunks) / seconds, 1),
+        "mb_per_sec": round(sum(len(document.encode("utf-8")) for document in documents) / seconds / 1024 / 1024, 2),
+        "tokens": distribution([count_tokens(chunk) for chunk in chunks]),
+        "chars": distribution([len(chunk) for chunk in chunks]),
+        "unchanged_after_edit": round(kept / total, 3) if total else None
+    }
+
+
+def peak_memory_mb(consume):
+    tracemalloc.start()
+    consume()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return round(peak / 1024 / 1024, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="チャンク分割 ベンチマーク")
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--edits", type=int, default=20, help="編集後の境界の安定性を確認する記事の数")
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    documents, sentence = make_corpus(random.Random(0), args.documents)
+    chunker = TextChunker()
+    results = [run("TextChunker", chunker.split_text, documents, random.Random(1), sentence, args.edits)]
+    if RecursiveCharacterTextSplitter is not None:
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=1000,
+            chunk_overlap=200,
+            separators=["\n\n", "\n", "。", "、", " ", ""]
+        )
+        results.append(run("RecursiveCharacterTextSplitter", splitter.split_text, documents, random.Random(1),
+                           sentence, args.edits))
+    else:
+        print("langchain がインストールされていないため、RecursiveCharacterTextSplitter との比較は省略します。")
+
+    # 長い文字起こしを行ごとに読みながら分割した場合と、全体を読み込んでリストにした場合のメモリ
+    transcript = "\n".join(" ".join(random.Random(2).choices(CHAR_POOL, k=60)) for _ in range(20_000))
+    lines = io.StringIO(transcript)
+    memory = {
+        "input_mb": round(len(transcript.encode("utf-8")) / 1024 / 1024, 2),
+        "iter_chunks_peak_mb": peak_memory_mb(lambda: sum(1 for _ in chunker.iter_chunks(lines))),
+        "split_text_peak_mb": peak_memory_mb(lambda: chunker.split_text(transcript))
+    }
+
+    report = {"results": results, "memory": memory}
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from utils.text import normalize_question
+
+
+class SemanticAnswerCache:
+    """
+    意味的に近い質問の回答を再利用するキャッシュ
+
+    質問のembeddingとのコサイン類似度が threshold 以上のエントリがあれば、その回答を返す。
+    回答の根拠となった教材（contents）の updated_at が変わっていればエントリを破棄する。
+    エントリ数が max_entries を超えたら最も使われていないものから追い出す（LRU）。
+    """
+
+    def __init__(self, get_versions: Callable[[List[str]], Dict[str, str]],
+                 threshold: float = 0.95, max_entries: int = 500):
+        self.get_versions = get_versions
+        self.threshold = threshold
+        self.max_entries = max_entries
+
+        self._entries: "OrderedDict[int, Dict]" = OrderedDict()
+        self._next_id = 0
+        self._matrix = None  # エントリのembedding行列（変更時に作り直す）
+        self._matrix_ids: List[int] = []
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0}
+
+    def _normalize(self, embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def _best_match(self, vector: np.ndarray):
+        if self._matrix is None:
+            self._matrix_ids = list(self._entries.keys())
+            self._matrix = (np.vstack([self._entries[i]["embedding"] for i in self._matrix_ids])
+                            if self._matrix_ids else np.zeros((0, vector.shape[0]), dtype=np.float32))
+        if not self._matrix_ids:
+            return None, 0.0
+        scores = self._matrix @ vector
+        best = int(np.argmax(scores))
+        return self._matrix_ids[best], float(scores[best])
+
+    def lookup(self, question_embedding: List[float]) -> Optional[Dict]:
+        """キャッシュ済みの回答を返す（ヒットしなければNone）"""
+        vector = self._normalize(question_embedding)
+
+        with self._lock:
+            entry_id, similarity = self._best_match(vector)
+            if entry_id is None or similarity < self.threshold:
+                self._stats["misses"] += 1
+                return None
+            entry = self._entries[entry_id]
+
+        # 根拠となった教材が更新・削除されていないか確認
+        versions = self.get_versions(list(entry["versions"].keys()))
+        if versions != entry["versions"]:
+            with self._lock:
+                if self._entries.pop(entry_id, None) is not None:
+                    self._matrix = None
+                self._stats["invalidations"] += 1
+                self._stats["misses"] += 1
+            return None
+
+        with self._lock:
+            if entry_id in self._entries:
+                self._entries.move_to_end(entry_id)
+            entry["hits"] += 1
+            self._stats["hits"] += 1
+
+        return {
+            "question": entry["question"],
+            "answer": entry["answer"],
+            "docs": entry["docs"],
+            "similarity": similarity
+        }
+
+    def put(self, question: str, question_embedding: List[float], docs: List[Dict], answer: str):
+        """回答を保存（根拠となる教材がない回答は無効化できないため保存しない）"""
+        content_ids = sorted({doc["content_id"] for doc in docs if doc.get("content_id")})
+        if not content_ids:
+            return
+
+        versions = self.get_versions(content_ids)
+        if len(versions) != len(content_ids):
+            return
+
+        with self._lock:
+            self._entries[self._next_id] = {
+                "question": question,
+                "embedding": self._normalize(question_embedding),
+                "docs": docs,
+                "answer": answer,
+                "versions": versions,
+                "created_at": time.time(),
+                "hits": 0
+            }
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+            self._matrix = None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        return stats
+
+
+class MemoryAnswerStore:
+    """ExactAnswerCache の保存先（プロセス内LRU）"""
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 86400):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry["created_at"] > self.ttl:
+                del self._entries[key]
+                self.evictions += 1
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: Dict):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SqliteAnswerStore:
+    """
+    ExactAnswerCache の保存先（SQLite）
+
+    同じファイルを指定した複数のワーカープロセスで共有できる。読み出すたびに last_used_at を更新し、
+    max_entries を超えたら使われていないものから1割削除する。
+    """
+
+    def __init__(self, path: str, max_entries: int = 10_000, ttl: float = 86400):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                key TEXT PRIMARY KEY,
+                entry TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_answers_last_used_at ON answers(last_used_at)")
+        self._db.commit()
+
+    def get(self, key: str) -> Optional[Dict]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT entry, created_at FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self._db.execute("DELETE FROM answers WHERE key = ?", (key,))
+                self._db.commit()
+                self.evictions += 1
+                return None
+            self._db.execute("UPDATE answers SET last_used_at = ? WHERE key = ?", (now, key))
+            self._db.commit()
+        return json.loads(row[0])
+
+    def set(self, key: str, entry: Dict):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO answers (key, entry, created_at, last_used_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(entry, ensure_ascii=False), entry["created_at"], now)
+            )
+            # 期限切れのものを削除し、上限を超えていれば使われていないものから1割削除
+            cursor = self._db.execute("DELETE FROM answers WHERE created_at < ?", (now - self.ttl,))
+            self.evictions += cursor.rowcount
+            count = self._db.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            if count > self.max_entries:
+                cursor = self._db.execute(
+                    "DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY last_used_at LIMIT ?)",
+                    (count - int(self.max_entries * 0.9),)
+                )
+                self.evictions += cursor.rowcount
+            self._db.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+
+class ExactAnswerCache:
+    """
+    同じ質問・同じ検索結果に対する回答を再利用するキャッシュ
+
+    キーは正規化した質問（NFKC・大文字小文字を揃え、空白を除く）、プロンプトに入れたチャンクの順序付きの一覧
+    （連結したチャンクは chunk_indices の全体）とその教材の updated_at、実際にプロンプトに入れた本文のハッシュ
+    （切り詰められた場合も区別する）、モデル名とプロンプトテンプレートの版から作る。
+    教材が更新されればキーが変わるため、明示的な無効化は不要（古いエントリはTTLと件数の上限で消える）。
+    """
+
+    def __init__(self, store, model: str, prompt_version: str):
+        self.store = store
+        self.model = model
+        self.prompt_version = prompt_version
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+
+    def key(self, question: str, docs: List[Dict], versions: Dict[str, str]) -> str:
+        """質問と検索結果の指紋（versions は教材IDごとの updated_at）"""
+        fingerprint = {
+            "question": normalize_question(question),
+            "chunks": [[doc.get("content_id"), self._chunk_indices(doc), versions.get(doc.get("content_id")),
+                        hashlib.sha256(doc.get("content", "").encode("utf-8")).hexdigest()]
+                       for doc in docs],
+            "model": self.model,
+            "prompt_version": self.prompt_version
+        }
+        return hashlib.sha256(
+            json.dumps(fingerprint, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    @staticmethod
+    def _chunk_indices(doc: Dict) -> List:
+        """連結したチャンクは chunk_indices の全体、単独のチャンクは chunk_index"""
+        if doc.get("chunk_indices"):
+            return list(doc["chunk_indices"])
+        return [doc.get("chunk_index")]
+
+    def get(self, key: str) -> Optional[str]:
+        """キャッシュ済みの回答（ヒットしなければNone）"""
+        entry = self.store.get(key)
+        with self._lock:
+            self._stats["hits" if entry else "misses"] += 1
+        return entry["answer"] if entry else None
+
+    def put(self, key: str, question: str, answer: str):
+        self.store.set(key, {"question": question, "answer": answer, "created_at": time.time()})
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["entries"] = len(self.store)
+        stats["evictions"] = self.store.evictions
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
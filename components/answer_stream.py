@@ -0,0 +1,90 @@
+import time
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional
+
+import openai
+
+from utils.tokens import CHAT_MODEL
+
+
+class StreamedAnswer:
+    """
+    ストリーミングで受け取るチャットの回答
+
+    イテレートすると（非同期のストリームは async for で）届いた順に回答の断片を返す。
+    受信し終わると text に回答全体、usage にトークン数、first_token_ms に最初の断片が届くまでの時間、
+    total_ms に最後の断片までの時間（どちらも started からのミリ秒）がそろう。
+    """
+
+    def __init__(self, stream: Iterable, started: Optional[float] = None):
+        self.stream = stream
+        self.started = time.perf_counter() if started is None else started
+        self.parts: List[str] = []
+        self.usage = None
+        self.first_token_ms: Optional[float] = None
+        self.total_ms: Optional[float] = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    def _receive(self, chunk) -> Optional[str]:
+        """チャンクから回答の断片を取り出す（断片がなければNone）"""
+        # stream_options の include_usage を指定すると、最後のチャンクは choices が空で usage だけを持つ
+        if getattr(chunk, 'usage', None):
+            self.usage = chunk.usage
+        if not chunk.choices:
+            return None
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            return None
+        if self.first_token_ms is None:
+            self.first_token_ms = (time.perf_counter() - self.started) * 1000
+        self.parts.append(delta)
+        return delta
+
+    def __iter__(self) -> Iterator[str]:
+        for chunk in self.stream:
+            delta = self._receive(chunk)
+            if delta:
+                yield delta
+        self.total_ms = (time.perf_counter() - self.started) * 1000
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        async for chunk in self.stream:
+            delta = self._receive(chunk)
+            if delta:
+                yield delta
+        self.total_ms = (time.perf_counter() - self.started) * 1000
+
+
+def stream_answer(messages: List[Dict], started: Optional[float] = None, model: str = CHAT_MODEL,
+                  temperature: float = 0.7, max_tokens: int = 1000, client=None) -> StreamedAnswer:
+    """
+    チャットAPIをストリーミングで呼び出す（started は計測の起点。省略すると呼び出した時刻）
+    client を省略すると openai モジュールの既定のクライアントを使う
+    """
+    started = time.perf_counter() if started is None else started
+    stream = (client or openai).chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+    return StreamedAnswer(stream, started)
+
+
+async def astream_answer(client, messages: List[Dict], started: Optional[float] = None, model: str = CHAT_MODEL,
+                         temperature: float = 0.7, max_tokens: int = 1000) -> StreamedAnswer:
+    """stream_answer の非同期版（client は openai.AsyncOpenAI）"""
+    started = time.perf_counter() if started is None else started
+    stream = await client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+    return StreamedAnswer(stream, started)
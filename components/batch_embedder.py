@@ -0,0 +1,122 @@
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+
+def _status_code(error: Exception):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+def is_retryable(error: Exception) -> bool:
+    """レート制限（429）・サーバーエラー（5xx）・タイムアウトなど、待てば成功する可能性のあるエラーか"""
+    status = _status_code(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    return type(error).__name__ in ("RateLimitError", "APITimeoutError", "APIConnectionError", "Timeout")
+
+
+def retry_after(error: Exception):
+    """Retry-After ヘッダーの秒数（なければNone）"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class BatchEmbedder:
+    """
+    embed_documents をバッチに分け、スレッドプールで並列にAPIへ送る
+
+    各バッチはレート制限などの一時的なエラーで失敗した場合、指数バックオフ（Retry-After があればその秒数）で
+    max_retries 回まで再試行する。OpenAIEmbeddings と同じインターフェースなので CachedEmbeddings の内側に置ける。
+    """
+
+    def __init__(self, embeddings, batch_size: int = 64, max_workers: int = 4,
+                 max_retries: int = 5, initial_backoff: float = 1.0, max_backoff: float = 60.0):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "retries": 0, "texts": 0}
+
+    @property
+    def model(self):
+        return getattr(self.embeddings, "model", "unknown")
+
+    def _call(self, func, *args):
+        backoff = self.initial_backoff
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self._lock:
+                    self._stats["requests"] += 1
+                return func(*args)
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                with self._lock:
+                    self._stats["retries"] += 1
+                # 同時に失敗したバッチが同じタイミングで再試行しないよう揺らぎを加える
+                wait = retry_after(e) or backoff * (0.5 + random.random())
+                time.sleep(min(wait, self.max_backoff))
+                backoff = min(backoff * 2, self.max_backoff)
+
+    def embed_query(self, text: str) -> List[float]:
+        with self._lock:
+            self._stats["texts"] += 1
+        return self._call(self.embeddings.embed_query, text)
+
+    async def _acall(self, func, *args):
+        """_call の非同期版（待機中もイベントループを止めない）"""
+        backoff = self.initial_backoff
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self._lock:
+                    self._stats["requests"] += 1
+                return await func(*args)
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                with self._lock:
+                    self._stats["retries"] += 1
+                wait = retry_after(e) or backoff * (0.5 + random.random())
+                await asyncio.sleep(min(wait, self.max_backoff))
+                backoff = min(backoff * 2, self.max_backoff)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """embed_query の非同期版（内側に aembed_query がなければ別スレッドで embed_query を呼ぶ）"""
+        with self._lock:
+            self._stats["texts"] += 1
+        func = getattr(self.embeddings, "aembed_query", None)
+        if func is None:
+            return await self._acall(asyncio.to_thread, self.embeddings.embed_query, text)
+        return await self._acall(func, text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        with self._lock:
+            self._stats["texts"] += len(texts)
+
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1 or self.max_workers <= 1:
+            results = [self._call(self.embeddings.embed_documents, batch) for batch in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as executor:
+                results = list(executor.map(lambda batch: self._call(self.embeddings.embed_documents, batch), batches))
+
+        return [embedding for batch in results for embedding in batch]
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
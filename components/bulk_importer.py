@@ -0,0 +1,432 @@
+import codecs
+import hashlib
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, TextIO
+
+from components.vector_index import iter_pages
+
+# 段階的インポートで新しい教材を組み立てるテーブル（supabase_content_functions.sql）
+STAGING_TABLES = ("contents_staging", "content_embeddings_staging")
+LIVE_TABLES = ("contents", "content_embeddings")
+
+JSON_WHITESPACE = " \t\n\r"
+INSERT_BATCH_ROWS = 500
+
+_END = object()
+
+
+def iter_json_array(stream: TextIO, read_size: int = 1 << 16) -> Iterator:
+    """
+    トップレベルがJSON配列のストリームから要素を1つずつ取り出す
+    ファイル全体を読み込まず、バッファには読みかけの要素1つ分だけを保持する
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = "", 0, False
+
+    def read_more():
+        nonlocal buffer, pos, eof
+        chunk = stream.read(read_size)
+        buffer, pos = buffer[pos:] + chunk, 0
+        eof = not chunk
+
+    def next_char() -> str:
+        """空白を読み飛ばした次の文字（ファイル末尾なら空文字）"""
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in JSON_WHITESPACE:
+                pos += 1
+            if pos < len(buffer) or eof:
+                return buffer[pos] if pos < len(buffer) else ""
+            read_more()
+
+    if next_char() != "[":
+        raise json.JSONDecodeError("JSON配列ではありません", buffer, pos)
+    pos += 1
+    if next_char() == "]":
+        return
+
+    while True:
+        next_char()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+                # 区切り文字が続いていない値（読み込みの境界で切れた数値など）は読み足して解析し直す
+                if eof or (end < len(buffer) and buffer[end] in JSON_WHITESPACE + ",]"):
+                    break
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            read_more()
+        pos = end
+        yield value
+
+        separator = next_char()
+        pos += 1
+        if separator == "]":
+            return
+        if separator != ",":
+            raise json.JSONDecodeError("配列の要素の区切りが不正です", buffer, pos - 1)
+
+
+def file_digest(fileobj: BinaryIO) -> str:
+    """アップロードされたファイルのSHA-256（チェックポイントの識別に使う）"""
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for block in iter(lambda: fileobj.read(1 << 20), b""):
+        digest.update(block)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def _missing_function(error: Exception) -> bool:
+    """supabase_content_functions.sql 未適用（または古い版）のためRPCが見つからないエラーか"""
+    return "PGRST202" in str(error) or "Could not find the function" in str(error)
+
+
+def content_key(item: Dict):
+    return (item.get("chapter") or "", item.get("lesson") or "", item["title"])
+
+
+def write_documents(kb, documents: List[Dict], staged: bool = False) -> int:
+    """
+    教材とチャンクをまとめて書き込み、書き込んだチャンク数を返す（既存の同じ教材は置き換える）
+    documents は {'content': contentsの列, 'chunks': [{'chunk_index', 'chunk_text', 'embedding', ...}]}
+
+    save_contents RPC があれば全体を1回のトランザクションで保存し、ない場合は contents の一括upsert →
+    既存チャンクの削除 → チャンクの一括挿入の順に書き込む。
+    """
+    if not documents:
+        return 0
+    chunk_count = sum(len(doc["chunks"]) for doc in documents)
+    saved = kb._save_contents([
+        {"content": doc["content"], "content_id": None, "chunks": doc["chunks"]} for doc in documents
+    ], staged=staged)
+    if saved is not None:
+        return chunk_count
+
+    # supabase_content_functions.sql 未適用の場合
+    contents_table, embeddings_table = STAGING_TABLES if staged else LIVE_TABLES
+    result = kb.supabase.table(contents_table).upsert(
+        [doc["content"] for doc in documents], on_conflict="chapter,lesson,title"
+    ).execute()
+    ids = {content_key(row): row["id"] for row in result.data}
+
+    content_ids = list(ids.values())
+    for i in range(0, len(content_ids), 100):
+        kb.supabase.table(embeddings_table).delete().in_("content_id", content_ids[i:i + 100]).execute()
+
+    rows = [dict(row, content_id=ids[content_key(doc["content"])]) for doc in documents for row in doc["chunks"]]
+    for i in range(0, len(rows), INSERT_BATCH_ROWS):
+        kb._insert_embeddings(rows[i:i + INSERT_BATCH_ROWS], table=embeddings_table)
+    return chunk_count
+
+
+class BulkImporter:
+    """
+    JSONファイル（教材の配列）をまとめてナレッジベースに取り込む
+
+    要素を少しずつ読み込み、batch_size 件ごとにチャンク分割 → embedding（BatchEmbedder で並列）→
+    contents / content_embeddings への一括書き込みを行う。書き込みは別スレッドで行い、次のバッチのembeddingと重ねる。
+    書き込みが終わったバッチまでをチェックポイントに保存し、途中で失敗しても同じファイルなら続きから再開できる。
+
+    staged=True の場合は *_staging テーブルに新しい教材を組み立て、最後に swap_staged_contents で1回のトランザクションで
+    入れ替える（組み立て中も検索は以前の教材で動き続ける）。*_staging は1組しかないため、インポートごとのidを
+    staging_import に記録し、再開時にはまだ自分のインポートのものかを、入れ替え時にはそれに加えて組み立てた教材数が
+    チェックポイントと一致するかを確認する（別のインポートに上書きされていたら再開せず最初から、入れ替えは行わない）。staged=False の場合は既存の教材に上書きし、最後に
+    ファイルにない教材を削除する。
+    """
+
+    def __init__(self, kb, checkpoint_dir: str = "./import_checkpoints", batch_size: int = 50,
+                 staged: bool = True):
+        self.kb = kb
+        self.checkpoint_dir = checkpoint_dir
+        self.batch_size = batch_size
+        self.staged = staged
+        self.contents_table, self.embeddings_table = STAGING_TABLES if staged else LIVE_TABLES
+
+    # ---- チェックポイント ----
+
+    def _checkpoint_path(self, digest: str) -> str:
+        mode = "staged" if self.staged else "replace"
+        return os.path.join(self.checkpoint_dir, f"{digest[:16]}-{mode}.json")
+
+    def load_checkpoint(self, fileobj: BinaryIO) -> Optional[Dict]:
+        """このファイルの中断したインポートの進捗（なければNone）"""
+        path = self._checkpoint_path(file_digest(fileobj))
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def discard_checkpoint(self, fileobj: BinaryIO):
+        """中断したインポートの進捗を破棄して、次回は最初から取り込む"""
+        path = self._checkpoint_path(file_digest(fileobj))
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _save_checkpoint(self, path: str, checkpoint: Dict):
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    # ---- 取り込み ----
+
+    def run(self, fileobj: BinaryIO, progress: Callable[[Dict], None] = None) -> Dict:
+        """
+        ファイルを取り込み、結果を返す
+
+        戻り値:
+            items: 取り込んだ教材数（再開時は前回までの分を含む）
+            resumed_from: 再開した位置（最初からの場合は0）
+            chunks: 今回embeddingを作って書き込んだチャンク数
+            errors: 取り込めなかった要素の [{'index', 'title', 'error'}]
+            stages: 工程ごとの {'seconds', 'items', 'chunks', 'items_per_sec', 'chunks_per_sec'}
+            deleted: ファイルになかったため削除した教材数（staged=False の場合）
+            seconds: 全体の所要時間
+        """
+        started = time.perf_counter()
+        digest = file_digest(fileobj)
+        checkpoint_path = self._checkpoint_path(digest)
+        checkpoint = None
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path, encoding="utf-8") as f:
+                checkpoint = json.load(f)
+        if checkpoint is not None and self.staged and not self._owns_staging(checkpoint):
+            # 中断している間に別のインポートが *_staging を使い始めたので、組み立て済みの教材は残っていない
+            checkpoint = None
+        if checkpoint is None:
+            checkpoint = {"file": digest, "staged": self.staged, "done": 0, "errors": [],
+                          "started_at": datetime.now(timezone.utc).isoformat()}
+            if self.staged:
+                checkpoint["import_id"] = uuid.uuid4().hex
+                self._begin_staging(checkpoint["import_id"])
+        resumed_from = checkpoint["done"]
+
+        stages = {name: {"seconds": 0.0, "items": 0, "chunks": 0} for name in ("parse", "chunk", "embed", "write")}
+        keys = set()
+        indexed_keys = []
+        chunk_count = 0
+
+        def batches():
+            stream = codecs.getreader("utf-8-sig")(fileobj)
+            items = iter_json_array(stream)
+            batch = []
+            index = 0
+            while True:
+                began = time.perf_counter()
+                item = next(items, _END)
+                stages["parse"]["seconds"] += time.perf_counter() - began
+                if item is _END:
+                    break
+                stages["parse"]["items"] += 1
+                if isinstance(item, dict) and item.get("title"):
+                    keys.add(content_key(item))
+                    indexed_keys.append((index, content_key(item)))
+                if index >= resumed_from:
+                    batch.append((index, item))
+                index += 1
+                if len(batch) >= self.batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        def wait(pending):
+            # 書き込みは前のバッチの完了を待ってから（チェックポイントは必ず順番に進める）
+            if pending is not None:
+                pending.result()
+                if progress:
+                    progress({"done": checkpoint["done"], "errors": len(checkpoint["errors"])})
+
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            pending = None
+            for batch in batches():
+                documents, errors = self._prepare(batch, stages)
+                chunk_count += sum(len(doc["chunks"]) for doc in documents)
+                wait(pending)
+                pending = writer.submit(self._write, documents, errors, batch[-1][0] + 1, checkpoint,
+                                        checkpoint_path, stages)
+            wait(pending)
+
+        deleted = 0
+        if self.staged:
+            # 取り込めなかった要素を除いた教材数（同じ章・レッスン・タイトルは1件に上書きされる）
+            failed = {error["index"] for error in checkpoint["errors"]}
+            expected = len({key for index, key in indexed_keys if index not in failed})
+            self._swap(checkpoint, checkpoint_path, expected)
+        else:
+            deleted = self._delete_missing(keys)
+
+        self.kb._content_changed()
+        if self.kb.lexical_index is not None:
+            self.kb.rebuild_lexical_index()
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+        for stage in stages.values():
+            seconds = stage["seconds"]
+            stage["seconds"] = round(seconds, 3)
+            stage["items_per_sec"] = round(stage["items"] / seconds, 1) if seconds else None
+            stage["chunks_per_sec"] = round(stage["chunks"] / seconds, 1) if seconds else None
+
+        return {
+            "items": checkpoint["done"] - len(checkpoint["errors"]),
+            "resumed_from": resumed_from,
+            "chunks": chunk_count,
+            "errors": checkpoint["errors"],
+            "stages": stages,
+            "deleted": deleted,
+            "seconds": round(time.perf_counter() - started, 3)
+        }
+
+    def _prepare(self, batch: List, stages: Dict):
+        """バッチの要素をチャンクに分割し、全チャンクのembeddingをまとめて作成する（戻り値は教材と取り込めない要素）"""
+        began = time.perf_counter()
+        documents, errors = {}, []
+        for index, item in batch:
+            try:
+                if not isinstance(item, dict) or not item.get("title") or not item.get("content"):
+                    raise ValueError("title と content は必須です")
+                # 同じ章・レッスン・タイトルの教材は後のものを使う
+                documents[content_key(item)] = {
+                    "item": item,
+                    "chunks": self.kb.text_splitter.split_text(item["content"])
+                }
+            except Exception as e:
+                title = item.get("title", "") if isinstance(item, dict) else ""
+                errors.append({"index": index, "title": title, "error": str(e)})
+        documents = list(documents.values())
+        texts = [chunk for doc in documents for chunk in doc["chunks"]]
+        stages["chunk"]["seconds"] += time.perf_counter() - began
+        stages["chunk"]["items"] += len(documents)
+        stages["chunk"]["chunks"] += len(texts)
+
+        began = time.perf_counter()
+        embeddings = iter(self.kb.embeddings.embed_documents(texts))
+        for doc in documents:
+            doc["embeddings"] = [next(embeddings) for _ in doc["chunks"]]
+        stages["embed"]["seconds"] += time.perf_counter() - began
+        stages["embed"]["items"] += len(documents)
+        stages["embed"]["chunks"] += len(texts)
+        return documents, errors
+
+    def _write(self, documents: List[Dict], errors: List[Dict], done: int, checkpoint: Dict, checkpoint_path: str,
+               stages: Dict):
+        """バッチの教材とチャンクを一括で書き込み、チェックポイントを進める"""
+        began = time.perf_counter()
+        chunk_count = write_documents(self.kb, [{
+            "content": {
+                "chapter": doc["item"].get("chapter") or "",
+                "chapter_order": doc["item"].get("chapter_order", 0),
+                "lesson": doc["item"].get("lesson") or "",
+                "lesson_order": doc["item"].get("lesson_order", 0),
+                "title": doc["item"]["title"],
+                "content": doc["item"]["content"],
+                "doc_type": doc["item"].get("doc_type") or "text",
+                "url": doc["item"].get("url") or None,
+                "youtube_url": doc["item"].get("youtube_url") or None
+            },
+            "chunks": [{
+                "chunk_index": i,
+                "chunk_text": chunk,
+                "embedding": embedding,
+                **self.kb._chunk_metadata(chunk)
+            } for i, (chunk, embedding) in enumerate(zip(doc["chunks"], doc["embeddings"]))]
+        } for doc in documents], staged=self.staged)
+
+        checkpoint["done"] = done
+        checkpoint["errors"].extend(errors)
+        self._save_checkpoint(checkpoint_path, checkpoint)
+        stages["write"]["seconds"] += time.perf_counter() - began
+        stages["write"]["items"] += len(documents)
+        stages["write"]["chunks"] += chunk_count
+
+    # ---- 仕上げ ----
+
+    def _clear_staging(self):
+        # content_embeddings_staging はカスケードで削除される
+        self.kb.supabase.table(STAGING_TABLES[0]).delete().neq(
+            "id", "00000000-0000-0000-0000-000000000000"
+        ).execute()
+
+    def _begin_staging(self, import_id: str):
+        """*_staging を空にして、このインポートが使うことを記録する"""
+        try:
+            self.kb.supabase.rpc("begin_staged_import", {"new_import": import_id}).execute()
+        except Exception as e:
+            if not _missing_function(e):
+                raise
+            # 記録できない場合は空にするだけ（入れ替え前の教材数の確認は行う）
+            self._clear_staging()
+
+    def _staging_status(self) -> Optional[Dict]:
+        """*_staging を使っているインポートのidと組み立て済みの教材数（記録できない場合はNone）"""
+        try:
+            result = self.kb.supabase.rpc("staged_import_status", {}).execute()
+        except Exception as e:
+            if not _missing_function(e):
+                raise
+            return None
+        return result.data[0] if result.data else None
+
+    def _owns_staging(self, checkpoint: Dict) -> bool:
+        """*_staging がまだこのチェックポイントのインポートのものか"""
+        status = self._staging_status()
+        if status is None:
+            return True
+        if checkpoint.get("swapping") and status["import_id"] is None:
+            # 入れ替え済み（_swap で何もせずに終わる）
+            return True
+        return status["import_id"] is not None and status["import_id"] == checkpoint.get("import_id")
+
+    def _staged_count(self) -> int:
+        result = self.kb.supabase.table(STAGING_TABLES[0]).select("id", count="exact").limit(1).execute()
+        return result.count or 0
+
+    def _swap(self, checkpoint: Dict, checkpoint_path: str, expected: int):
+        """
+        組み立てた教材を1回のトランザクションで公開中のテーブルと入れ替える
+        *_staging が別のインポートのものになっている、または教材数が expected と違う場合は入れ替えずに例外を送出する
+        """
+        if checkpoint.get("swapping"):
+            # 入れ替え後にチェックポイントを消す前に中断した場合は、入れ替え済みなので何もしない
+            staged = self.kb.supabase.table(STAGING_TABLES[0]).select("id").limit(1).execute()
+            if not staged.data:
+                return
+        checkpoint["swapping"] = True
+        self._save_checkpoint(checkpoint_path, checkpoint)
+        try:
+            self.kb.supabase.rpc("swap_staged_contents", {
+                "expected_import": checkpoint.get("import_id"),
+                "expected_contents": expected
+            }).execute()
+            return
+        except Exception as e:
+            if not _missing_function(e):
+                raise
+        # 確認の引数がない古い swap_staged_contents の場合は、教材数だけを先に確認する
+        staged = self._staged_count()
+        if staged != expected:
+            raise RuntimeError(
+                f"{STAGING_TABLES[0]} の教材数（{staged}件）が取り込んだ教材数（{expected}件）と一致しないため入れ替えません。"
+                "別のインポートと重なった可能性があります。中断したインポートを破棄して最初からやり直してください。"
+            )
+        self.kb.supabase.rpc("swap_staged_contents", {}).execute()
+
+    def _delete_missing(self, keys: set) -> int:
+        """ファイルに含まれていない教材を削除する（上書きインポート時）"""
+        stale = []
+        for page in iter_pages(lambda: self.kb.supabase.table("contents").select(
+            "id, chapter, lesson, title"
+        ).order("id")):
+            stale.extend(row["id"] for row in page if content_key(row) not in keys)
+        for i in range(0, len(stale), 100):
+            self.kb.supabase.table("contents").delete().in_("id", stale[i:i + 100]).execute()
+        return len(stale)
@@ -0,0 +1,104 @@
+from collections import Counter
+from typing import Dict, List, Optional
+
+
+def merge_overlap(first: str, second: str, min_overlap: int = 10) -> str:
+    """
+    first の末尾と second の先頭が重なっていれば、重なりを1回だけ含めて連結する
+    テキスト分割器の chunk_overlap で隣接チャンクに重複した部分を取り除くため
+    """
+    for size in range(min(len(first), len(second)), min_overlap - 1, -1):
+        if second.startswith(first[-size:]):
+            return first + second[size:]
+    return first + "\n" + second
+
+
+def _relevance(doc: Dict) -> Optional[float]:
+    """検索結果の関連度（ハイブリッド検索ならRRFスコア、それ以外はコサイン類似度）"""
+    if doc.get('rrf_score') is not None:
+        return doc['rrf_score']
+    if doc.get('score') is not None:
+        return 1 - doc['score']
+    return None
+
+
+def assemble_context(docs: List[Dict], max_chunks: int = 5, max_chunks_per_lesson: int = 2,
+                     min_similarity: float = None, diversity: float = 0.3,
+                     min_overlap: int = 10) -> List[Dict]:
+    """
+    kb.search の結果からプロンプトに入れるチャンクを選び、同じ教材の隣接チャンクを連結する
+
+    1. コサイン類似度が min_similarity 未満の結果を除く（BM25のみでヒットした結果は類似度がないため残す）
+    2. MMR風に選ぶ: 関連度から「同じ教材から既に選んだチャンク数 × diversity」を引いた値が
+       最も高いものを順に選び、1つの教材からは max_chunks_per_lesson 件までにする
+    3. 同じ content_id で chunk_index が連続するチャンクを、重複部分を除いて1つにまとめる
+
+    戻り値は検索結果と同じ形式（連結した場合は content が連結後の本文、chunk_indices に元のチャンク番号）で、
+    各教材の最も関連度の高いチャンクの順に並ぶ
+    """
+    candidates = []
+    for rank, doc in enumerate(docs):
+        is_lexical_only = doc.get('rrf_score') is not None and doc.get('score', 1) >= 1
+        if (min_similarity is not None and not is_lexical_only
+                and doc.get('score') is not None and 1 - doc['score'] < min_similarity):
+            continue
+        candidates.append((rank, doc))
+
+    if not candidates:
+        return []
+
+    # 関連度は最大値で正規化して diversity と同じ尺度にする
+    relevances = [_relevance(doc) for _, doc in candidates]
+    top = max((r for r in relevances if r is not None), default=0) or 1
+    normalized = [(r / top) if r is not None else 0.0 for r in relevances]
+
+    selected = []
+    per_lesson = Counter()
+    remaining = list(range(len(candidates)))
+    while remaining and len(selected) < max_chunks:
+        best, best_value = None, None
+        for i in remaining:
+            key = candidates[i][1].get('content_id') or candidates[i][1].get('title')
+            if per_lesson[key] >= max_chunks_per_lesson:
+                continue
+            value = normalized[i] - diversity * per_lesson[key]
+            if best_value is None or value > best_value:
+                best, best_value = i, value
+        if best is None:
+            break
+        remaining.remove(best)
+        selected.append(candidates[best])
+        per_lesson[candidates[best][1].get('content_id') or candidates[best][1].get('title')] += 1
+
+    # 同じ教材の連続するチャンクを連結（グループの位置は最も関連度の高いチャンクの順位）
+    groups: Dict = {}
+    for rank, doc in selected:
+        key = doc.get('content_id') or doc.get('title')
+        groups.setdefault(key, []).append((rank, doc))
+
+    assembled = []
+    for members in groups.values():
+        members.sort(key=lambda item: (item[1].get('chunk_index') is None, item[1].get('chunk_index') or 0))
+        run = None
+        for rank, doc in members:
+            index = doc.get('chunk_index')
+            if run is not None and index is not None and run['chunk_indices'] and run['chunk_indices'][-1] == index - 1:
+                run['content'] = merge_overlap(run['content'], doc['content'], min_overlap)
+                run['chunk_indices'].append(index)
+                run['token_count'] = None  # 連結後の本文は数え直す
+                if run.get('links') is not None and doc.get('links') is not None:
+                    run['links'] = run['links'] + [link for link in doc['links'] if link not in run['links']]
+                else:
+                    run['links'] = None  # 登録時のリンクがないチャンクを含む場合は本文から抽出し直す
+                run['score'] = min(run.get('score', 1), doc.get('score', 1))
+                run['_rank'] = min(run['_rank'], rank)
+                continue
+            if run is not None:
+                assembled.append(run)
+            run = dict(doc, chunk_indices=[index] if index is not None else [], _rank=rank)
+        assembled.append(run)
+
+    assembled.sort(key=lambda doc: doc['_rank'])
+    for doc in assembled:
+        del doc['_rank']
+    return assembled
@@ -0,0 +1,169 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from utils.text import normalize_text
+
+
+class CachedEmbeddings:
+    """
+    OpenAIEmbeddings の前段に置く2段キャッシュ（プロセス内LRU + SQLite）
+
+    キーは正規化したテキストとembeddingモデル名。embed_query / embed_documents の
+    インターフェースはそのままなので、OpenAIEmbeddings の代わりにそのまま使える。
+    """
+
+    def __init__(self, embeddings, model_name: str = None,
+                 db_path: Optional[str] = "./embedding_cache.sqlite3",
+                 max_memory_items: int = 2048, max_disk_items: int = 200_000):
+        self.embeddings = embeddings
+        self.model_name = model_name or getattr(embeddings, "model", "unknown")
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0,
+                       "memory_evictions": 0, "disk_evictions": 0}
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (model, key)
+                )
+            """)
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_created_at ON embeddings(created_at)")
+            self._db.commit()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+    # ---- キャッシュ操作 ----
+
+    def _get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT embedding FROM embeddings WHERE model = ? AND key = ?",
+                    (self.model_name, key)
+                ).fetchone()
+                if row:
+                    embedding = array("f", row[0]).tolist()
+                    self._remember(key, embedding)
+                    self._stats["disk_hits"] += 1
+                    return embedding
+
+            self._stats["misses"] += 1
+            return None
+
+    def _remember(self, key: str, embedding: List[float]):
+        self._memory[key] = embedding
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+            self._stats["memory_evictions"] += 1
+
+    def _put_many(self, items: Dict[str, List[float]]):
+        with self._lock:
+            for key, embedding in items.items():
+                self._remember(key, embedding)
+
+            if self._db is None or not items:
+                return
+
+            now = time.time()
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, key, embedding, created_at) VALUES (?, ?, ?, ?)",
+                [(self.model_name, key, array("f", embedding).tobytes(), now) for key, embedding in items.items()]
+            )
+
+            # 上限を超えたら古いものから1割削除（件数は他プロセスの書き込みも含めて、挿入と同じトランザクションで数える）
+            count = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if count > self.max_disk_items:
+                excess = count - int(self.max_disk_items * 0.9)
+                cursor = self._db.execute(
+                    "DELETE FROM embeddings WHERE rowid IN "
+                    "(SELECT rowid FROM embeddings ORDER BY created_at LIMIT ?)",
+                    (excess,)
+                )
+                self._stats["disk_evictions"] += cursor.rowcount
+
+            self._db.commit()
+
+    # ---- Embeddings インターフェース ----
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        embedding = self._get(key)
+        if embedding is None:
+            embedding = self.embeddings.embed_query(text)
+            self._put_many({key: embedding})
+        return embedding
+
+    async def aembed_query(self, text: str, limiter=None) -> List[float]:
+        """
+        embed_query の非同期版（キャッシュにない場合だけ内側の aembed_query を待つ）
+        limiter（async with で使えるもの、例: OpenAIScheduler.slot）を渡すと、API呼び出しをその中で行う
+        """
+        key = self._key(text)
+        embedding = self._get(key)
+        if embedding is None:
+            if limiter is None:
+                embedding = await self._aembed_uncached(text)
+            else:
+                async with limiter:
+                    embedding = await self._aembed_uncached(text)
+            self._put_many({key: embedding})
+        return embedding
+
+    async def _aembed_uncached(self, text: str) -> List[float]:
+        func = getattr(self.embeddings, "aembed_query", None)
+        if func is None:
+            return await asyncio.to_thread(self.embeddings.embed_query, text)
+        return await func(text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """キャッシュにないテキストだけをまとめてAPIに送る"""
+        keys = [self._key(text) for text in texts]
+        results: List[Optional[List[float]]] = [self._get(key) for key in keys]
+
+        missing = {}
+        for i, (key, embedding) in enumerate(zip(keys, results)):
+            if embedding is None and key not in missing:
+                missing[key] = texts[i]
+
+        if missing:
+            computed = dict(zip(missing.keys(), self.embeddings.embed_documents(list(missing.values()))))
+            self._put_many(computed)
+            results = [embedding if embedding is not None else computed[key]
+                       for key, embedding in zip(keys, results)]
+
+        return results
+
+    def stats(self) -> Dict:
+        """ヒット・ミス・追い出し件数"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_items"] = len(self._memory)
+            stats["disk_items"] = (self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                                   if self._db is not None else 0)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
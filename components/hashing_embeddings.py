@@ -0,0 +1,41 @@
+import zlib
+from typing import List, Tuple
+
+import numpy as np
+
+from utils.text import normalize_text
+
+
+class HashingEmbeddings:
+    """
+    ネットワークを使わない決定的なembedding（文字n-gramの特徴ハッシュによる射影）
+
+    ベンチマークやオフラインでの動作確認用。OpenAIEmbeddings と同じ embed_query / embed_documents を持つ。
+    同じテキストは常に同じベクトルになり、共通する文字n-gramが多いほどコサイン類似度が高くなる。
+    """
+
+    def __init__(self, dim: int = 1536, ngram_sizes: Tuple[int, ...] = (2, 3),
+                 model: str = "hashing-ngram"):
+        self.dim = dim
+        self.ngram_sizes = ngram_sizes
+        self.model = model
+
+    def _embed(self, text: str) -> List[float]:
+        # 空白は区切りとして意味を持たない日本語が多いため除いてからn-gramを取る
+        text = "".join(normalize_text(text, casefold=True).split())
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for n in self.ngram_sizes:
+            for i in range(len(text) - n + 1):
+                h = zlib.crc32(text[i:i + n].encode("utf-8"))
+                # 下位1bitを符号に使い、衝突による偏りを打ち消す
+                vector[(h >> 1) % self.dim] += 1.0 if h & 1 else -1.0
+        norm = float(np.linalg.norm(vector))
+        if norm:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
@@ -0,0 +1,330 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+# ジョブの状態
+QUEUED = "queued"          # 実行待ち（再試行待ちを含む）
+RUNNING = "running"        # 実行中
+SUCCEEDED = "succeeded"    # 完了
+DEAD = "dead"              # 再試行回数を使い切った（デッドレター）
+
+JOB_KINDS = ("add_document", "update_content")
+
+
+class JobLost(Exception):
+    """実行中のジョブが応答なしとみなされ、別のワーカーに引き継がれた"""
+
+
+class IngestQueue:
+    """
+    教材の登録・更新ジョブを保存するSQLiteのキュー
+
+    複数のプロセス・スレッドから同じファイルを開いて使える。ジョブは claim で1件ずつ取り出され、
+    失敗すると指数バックオフで max_attempts 回まで再試行し、それでも失敗したものは DEAD（デッドレター）になる。
+    claim のたびにジョブに新しい claim_token を記録し、set_progress / complete / fail はそのトークンを持つ RUNNING のジョブだけを
+    更新する（応答がないとみなされて別のワーカーに引き継がれたジョブに、元のワーカーが後から書き込んでも無視される）。
+    """
+
+    def __init__(self, db_path: str = "./ingest_queue.sqlite3", max_attempts: int = 3,
+                 retry_backoff: float = 10.0):
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS ingest_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                label TEXT,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                progress REAL NOT NULL DEFAULT 0,
+                message TEXT,
+                result TEXT,
+                error TEXT,
+                run_after REAL NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(ingest_jobs)")}
+        if "claim_token" not in columns:
+            self._db.execute("ALTER TABLE ingest_jobs ADD COLUMN claim_token TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_ingest_jobs_status ON ingest_jobs(status, run_after)")
+
+    def _row(self, row) -> Optional[Dict]:
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    # ---- 画面側 ----
+
+    def enqueue(self, kind: str, payload: Dict, label: str = None) -> int:
+        """ジョブを追加してIDを返す（label は一覧に表示する名前）"""
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO ingest_jobs (kind, payload, label, status, run_after, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (kind, json.dumps(payload, ensure_ascii=False), label, QUEUED, now, now, now)
+            )
+            return cursor.lastrowid
+
+    def get(self, job_id: int) -> Optional[Dict]:
+        with self._lock:
+            return self._row(self._db.execute("SELECT * FROM ingest_jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def list_jobs(self, limit: int = 20, statuses: List[str] = None) -> List[Dict]:
+        """新しい順のジョブ一覧"""
+        query, params = "SELECT * FROM ingest_jobs", []
+        if statuses:
+            query += f" WHERE status IN ({', '.join('?' for _ in statuses)})"
+            params.extend(statuses)
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            return [self._row(row) for row in self._db.execute(query, params).fetchall()]
+
+    def counts(self) -> Dict[str, int]:
+        """状態ごとのジョブ数"""
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM ingest_jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def retry(self, job_id: int) -> bool:
+        """デッドレターのジョブを再試行回数を戻して実行待ちに戻す"""
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE ingest_jobs SET status = ?, attempts = 0, progress = 0, error = NULL, "
+                "run_after = ?, updated_at = ? WHERE id = ? AND status = ?",
+                (QUEUED, now, now, job_id, DEAD)
+            )
+            return cursor.rowcount > 0
+
+    # ---- ワーカー側 ----
+
+    def claim(self) -> Optional[Dict]:
+        """実行できるジョブを1件取り出して RUNNING にする（なければNone、ジョブの claim_token で以降の更新を行う）"""
+        now = time.time()
+        token = uuid.uuid4().hex
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT * FROM ingest_jobs WHERE status = ? AND run_after <= ? ORDER BY id LIMIT 1",
+                    (QUEUED, now)
+                ).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE ingest_jobs SET status = ?, attempts = attempts + 1, progress = 0, "
+                        "message = NULL, claim_token = ?, updated_at = ? WHERE id = ?",
+                        (RUNNING, token, now, row["id"])
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        job = self._row(row)
+        job["attempts"] += 1
+        job["status"] = RUNNING
+        job["claim_token"] = token
+        return job
+
+    def set_progress(self, job_id: int, token: str, progress: float, message: str = None) -> bool:
+        """進捗（0〜1）を更新する（ワーカーの生存確認も兼ねる）。ジョブが別のワーカーに引き継がれていればFalse"""
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE ingest_jobs SET progress = ?, message = ?, updated_at = ? "
+                "WHERE id = ? AND status = ? AND claim_token = ?",
+                (progress, message, time.time(), job_id, RUNNING, token)
+            )
+            return cursor.rowcount > 0
+
+    def complete(self, job_id: int, token: str, result: Dict = None) -> bool:
+        """完了を記録する（ジョブが別のワーカーに引き継がれていれば何もせずFalse）"""
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE ingest_jobs SET status = ?, progress = 1, result = ?, error = NULL, updated_at = ? "
+                "WHERE id = ? AND status = ? AND claim_token = ?",
+                (SUCCEEDED, json.dumps(result, ensure_ascii=False) if result else None, time.time(),
+                 job_id, RUNNING, token)
+            )
+            return cursor.rowcount > 0
+
+    def fail(self, job_id: int, token: str, error: str) -> bool:
+        """
+        失敗を記録し、再試行回数が残っていればバックオフ後に再実行、なければデッドレターにする
+        ジョブが別のワーカーに引き継がれていれば何もせずFalse
+        """
+        return self._fail(job_id, error, "claim_token = ?", (token,))
+
+    def requeue_stale(self, timeout: float) -> int:
+        """timeout 秒以上進捗の更新がない RUNNING のジョブ（ワーカーが落ちたもの）を失敗として扱う"""
+        deadline = time.time() - timeout
+        with self._lock:
+            stale = [row[0] for row in self._db.execute(
+                "SELECT id FROM ingest_jobs WHERE status = ? AND updated_at < ?",
+                (RUNNING, deadline)
+            ).fetchall()]
+        # 一覧を取った後に進捗を更新したジョブは失敗にしない
+        return sum(self._fail(job_id, "ワーカーが応答しなくなりました", "updated_at < ?", (deadline,))
+                   for job_id in stale)
+
+    def _fail(self, job_id: int, error: str, condition: str, params: tuple) -> bool:
+        """RUNNING で condition に合うジョブを失敗として扱う（合わなければFalse）"""
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    f"SELECT attempts FROM ingest_jobs WHERE id = ? AND status = ? AND {condition}",
+                    (job_id, RUNNING, *params)
+                ).fetchone()
+                if row is not None:
+                    attempts = row[0]
+                    if attempts >= self.max_attempts:
+                        status, run_after = DEAD, now
+                    else:
+                        status, run_after = QUEUED, now + self.retry_backoff * 2 ** (attempts - 1)
+                    self._db.execute(
+                        "UPDATE ingest_jobs SET status = ?, error = ?, run_after = ?, updated_at = ? WHERE id = ?",
+                        (status, error, run_after, now, job_id)
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return row is not None
+
+
+class IngestWorker:
+    """
+    IngestQueue のジョブをスレッドプールで実行する
+
+    各スレッドは kb_factory で自分専用のナレッジベースを作り、add_document / update_content を呼ぶ
+    （BM25インデックスはプロセスで1つを共有し、更新はそのロックで順番に反映される）。
+    落ちたワーカーの RUNNING のジョブは、起動時と stale_check_interval 秒ごとに失敗として扱い再試行に回す。
+    Streamlitのサーバープロセス内で起動するほか、python -m components.ingest_queue で別プロセスとしても動かせる。
+    """
+
+    def __init__(self, queue: IngestQueue, kb_factory: Callable, workers: int = 2,
+                 poll_interval: float = 1.0, stale_timeout: float = 600.0, stale_check_interval: float = 60.0):
+        self.queue = queue
+        self.kb_factory = kb_factory
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stale_timeout = stale_timeout
+        self.stale_check_interval = stale_check_interval
+        self._threads = []
+        self._stop = threading.Event()
+        self._stale_lock = threading.Lock()
+        self._stale_checked_at = 0.0
+
+    def start(self):
+        if self._threads:
+            return self
+        self._requeue_stale()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._loop, name=f"ingest-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _requeue_stale(self):
+        """前回の確認から stale_check_interval 秒たっていれば、応答のないジョブを再試行に回す（スレッドのうち1つだけが行う）"""
+        if not self._stale_lock.acquire(blocking=False):
+            return
+        try:
+            now = time.monotonic()
+            if self._stale_checked_at and now - self._stale_checked_at < self.stale_check_interval:
+                return
+            self._stale_checked_at = now
+            self.queue.requeue_stale(self.stale_timeout)
+        finally:
+            self._stale_lock.release()
+
+    def _loop(self):
+        kb = None
+        while not self._stop.is_set():
+            try:
+                self._requeue_stale()
+            except Exception as e:
+                print(f"Error requeueing stale ingest jobs: {str(e)}")
+            job = self.queue.claim()
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            try:
+                if kb is None:
+                    kb = self.kb_factory()
+                result = self.run_job(kb, job)
+                done = self.queue.complete(job["id"], job["claim_token"], result)
+            except Exception as e:
+                done = self.queue.fail(job["id"], job["claim_token"], str(e))
+            if not done:
+                print(f"Ingest job {job['id']} was taken over by another worker; dropped the late result")
+
+    def run_job(self, kb, job: Dict) -> Dict:
+        """
+        ジョブを1件実行し、書き込み結果（使い回した・作り直したチャンク数）を返す
+        進捗の更新でジョブが別のワーカーに引き継がれたことが分かった場合は、その時点で例外を送出して書き込みをやめる
+        """
+        def progress(value: float, message: str = None):
+            if not self.queue.set_progress(job["id"], job["claim_token"], value, message):
+                raise JobLost(f"ジョブ {job['id']} は別のワーカーに引き継がれました")
+
+        method = getattr(kb, job["kind"])
+        if not method(**job["payload"], progress=progress):
+            raise RuntimeError(getattr(kb, "last_error", None) or f"{job['kind']} に失敗しました")
+        return dict(getattr(kb, "last_write_stats", {}))
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    import sys
+
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    from dotenv import load_dotenv
+
+    from components.knowledge_base_supabase import KnowledgeBaseSupabase
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="教材登録ジョブのワーカー")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("INGEST_WORKERS", "2")))
+    args = parser.parse_args()
+
+    worker = IngestWorker(
+        IngestQueue(os.getenv("INGEST_QUEUE_PATH", "./ingest_queue.sqlite3"),
+                    max_attempts=int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))),
+        KnowledgeBaseSupabase,
+        workers=args.workers
+    ).start()
+    print(f"Ingest worker started ({args.workers} threads)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        worker.stop()
@@ -2,9 +2,9 @@ import chromadb
 import os
 from typing import List, Dict
 import hashlib
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
 import json
+from components.text_chunker import TextChunker
 
 class KnowledgeBase:
     def __init__(self):
@@ -22,11 +22,7 @@ class KnowledgeBase:
                 metadata={"hnsw:space": "cosine"}
             )
         
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            separators=["\n\n", "\n", "。", "、", " ", ""]
-        )
+        self.text_splitter = TextChunker()
     
     def add_document(self, content: str, title: str, url: str = None, doc_type: str = "text", 
                     chapter: str = None, lesson: str = None, chapter_order: int = 0, 
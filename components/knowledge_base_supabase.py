@@ -1,9 +1,44 @@
+import asyncio
+import hashlib
+import inspect
 import os
-from typing import List, Dict, Optional
-from supabase import create_client, Client
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import threading
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, List, Dict, Optional, Union
+from supabase import acreate_client, create_client, AsyncClient, Client
+from postgrest.exceptions import APIError
 from langchain_openai import OpenAIEmbeddings
 import json
+from components.vector_index import LocalVectorIndex, iter_pages, scan_top_k_many
+from components.embedding_cache import CachedEmbeddings
+from components.batch_embedder import BatchEmbedder
+from components.lexical_index import LexicalIndex
+from components.text_chunker import TextChunker
+from utils.links import extract_links
+from utils.tokens import count_tokens
+
+# 登録時に計算して content_embeddings に保存する任意の列（supabase_vector_index.sql で追加）
+OPTIONAL_CHUNK_COLUMNS = ("token_count", "links", "chunk_hash")
+
+# 全件走査で取得する content_embeddings の列（OPTIONAL_CHUNK_COLUMNS の token_count / links はデータベースにあれば加える）
+EXACT_SCAN_COLUMNS = ("content_id", "chunk_index", "chunk_text", "embedding")
+
+# LEXICAL_INDEX_PATH ごとにプロセスで1つだけ読み込むBM25インデックス
+# 登録ワーカーのスレッドごとにナレッジベースを作っても、索引全体をスレッドの数だけメモリに持たない
+# （LexicalIndex の更新はインスタンスのロックと操作ログのファイルロックで順番に反映される）
+_lexical_indexes: Dict[str, LexicalIndex] = {}
+_lexical_indexes_lock = threading.Lock()
+
+
+def _missing_function(error: APIError) -> bool:
+    """SQLファイルが未適用（または古い版）のためRPC関数が見つからないエラーか"""
+    return "PGRST202" in str(error) or "Could not find the function" in str(error)
+
+
+def chunk_hash(text: str) -> str:
+    """チャンク本文のハッシュ（本文が同じチャンクはembeddingを作り直さずに使い回す）"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
 
 class KnowledgeBaseSupabase:
     def __init__(self):
@@ -16,24 +51,73 @@ class KnowledgeBaseSupabase:
         
         self.supabase: Client = create_client(url, key)
         
-        # OpenAI Embeddingsの初期化
-        self.embeddings = OpenAIEmbeddings(
-            openai_api_key=os.getenv("OPENAI_API_KEY")
-        )
+        # 非同期クライアント（asearch で初めて使うときに、呼び出し元のイベントループで作成する）
+        self._supabase_credentials = (url, key)
+        self._async_supabase: Optional[AsyncClient] = None
         
-        # テキスト分割器の初期化
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            separators=["\n\n", "\n", "。", "、", " ", ""]
+        # OpenAI Embeddingsの初期化（同じテキストは再計算しないようキャッシュ経由で使う）
+        # キャッシュにないチャンクはバッチに分けて並列にAPIへ送り、レート制限時は待って再試行する
+        batch_size = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+        max_workers = int(os.getenv("EMBEDDING_MAX_WORKERS", "4"))
+        self.embeddings = CachedEmbeddings(
+            BatchEmbedder(
+                OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY")),
+                batch_size=batch_size,
+                max_workers=max_workers,
+                max_retries=int(os.getenv("EMBEDDING_MAX_RETRIES", "5"))
+            ),
+            db_path=os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache.sqlite3") or None
         )
+        # add_document / update_content がembeddingの進捗を報告する単位（並列に送る1回分のチャンク数）
+        # 登録ジョブでは進捗の報告がワーカーの生存確認を兼ねるため、長い教材でも一定の間隔で報告する
+        self._embedding_step = batch_size * max_workers
+        
+        # テキスト分割器の初期化（文の区切りとトークン数で分割し、編集した箇所から離れたチャンクの境界は変わらない）
+        self.text_splitter = TextChunker()
+        
+        # HNSWインデックス探索時の候補数（supabase_vector_index.sql）
+        self.ef_search = int(os.getenv("HNSW_EF_SEARCH", "40"))
+        
+        # 登録時に計算して content_embeddings に保存する列（supabase_vector_index.sql 未適用の列は最初の挿入で除かれる）
+        self._chunk_columns = set(OPTIONAL_CHUNK_COLUMNS)
+        
+        # 直近の add_document / update_content で使い回した・作り直したチャンク数と、失敗した場合のエラー
+        self.last_write_stats = {"reused": 0, "embedded": 0, "deleted": 0}
+        self.last_error = None
+        
+        # 教材とチャンクを1回のトランザクションで保存するRPC（supabase_content_functions.sql 未適用の場合は使わない）
+        self._save_rpc = True
+        
+        # ローカルのmmapベクトル索引（LOCAL_VECTOR_INDEX_PATH を設定した場合のみ有効）
+        self.local_index = None
+        index_path = os.getenv("LOCAL_VECTOR_INDEX_PATH")
+        if index_path:
+            self.local_index = LocalVectorIndex(
+                self.supabase,
+                path=index_path,
+                refresh_interval=float(os.getenv("LOCAL_VECTOR_INDEX_REFRESH", "60")),
+                quantization=os.getenv("LOCAL_VECTOR_INDEX_QUANTIZATION", "none"),
+                rescore_factor=int(os.getenv("LOCAL_VECTOR_INDEX_RESCORE_FACTOR", "10"))
+            )
+        
+        # BM25転置インデックス（LEXICAL_INDEX_PATH を設定した場合のみハイブリッド検索）
+        self.lexical_index = None
+        lexical_path = os.getenv("LEXICAL_INDEX_PATH")
+        if lexical_path:
+            with _lexical_indexes_lock:
+                self.lexical_index = _lexical_indexes.get(lexical_path)
+                if self.lexical_index is None:
+                    self.lexical_index = _lexical_indexes[lexical_path] = LexicalIndex(lexical_path)
+                    if not os.path.exists(lexical_path):
+                        self.rebuild_lexical_index()
     
     def add_document(self, content: str, title: str, url: str = None, doc_type: str = "text",
                     chapter: str = None, lesson: str = None, chapter_order: int = 0,
-                    lesson_order: int = 0, youtube_url: str = None):
-        """教材を追加"""
+                    lesson_order: int = 0, youtube_url: str = None,
+                    progress: Callable[[float, str], None] = None):
+        """教材を追加（progress を渡すと処理の段階ごとに (進捗0〜1, 説明) で呼ばれる）"""
+        self.last_error = None
         try:
-            # 1. contentsテーブルに保存
             content_data = {
                 "chapter": chapter or "",
                 "chapter_order": chapter_order,
@@ -46,117 +130,603 @@ class KnowledgeBaseSupabase:
                 "youtube_url": youtube_url or None
             }
             
-            # Upsert（存在する場合は更新、しない場合は新規作成）
+            # 1. 同じ章・レッスン・タイトルの教材があれば、そのチャンクを差分の比較に使う
+            existing = self.supabase.table("contents").select("id").eq(
+                "chapter", content_data["chapter"]
+            ).eq("lesson", content_data["lesson"]).eq("title", title).execute()
+            existing_chunks = self._existing_chunks(existing.data[0]["id"]) if existing.data else []
+            
+            # 2. テキストをチャンクに分割し、本文が変わったチャンクだけembeddingを作り直す
+            chunks = self.text_splitter.split_text(content)
+            plan = self._plan_chunks(existing_chunks, chunks, progress)
+            
+            # 3. contents と content_embeddings を1回のトランザクションで保存（存在する場合は更新）
+            content_id = self._save_content(content_data, None, plan)
+            self.last_write_stats = plan["stats"]
+            
+            if self.lexical_index is not None:
+                self.lexical_index.replace_content(content_id, chunks, self._content_metadata(content_data))
+            
+            self._content_changed()
+            return True
+            
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"Error adding document: {str(e)}")
+            return False
+    
+    def _plan_chunks(self, existing_chunks: List[Dict], chunks: List[str],
+                     progress: Callable[[float, str], None] = None) -> Dict:
+        """
+        教材のチャンクを chunks に置き換えるための変更を求め、新しい・変わったチャンクのembeddingを作成する
+
+        保存済みのチャンク（_existing_chunks）と本文のハッシュで突き合わせ、同じ本文の行はembeddingごと残して
+        chunk_index だけ振り直す。使われなくなった行は削除する。
+        戻り値:
+            chunks: save_contents RPC に渡す chunk_index 順のチャンク（残す行は {'id', 'chunk_index'}、新しい行は全列）
+            moved: chunk_index が変わる残す行の {'id', 'chunk_index', 'chunk_text'}
+            stale: 削除する行のid
+            stats: reused: 使い回した数、embedded: 作り直した数、deleted: 削除した数
+        """
+        if progress:
+            progress(0.1, f"{len(chunks)}チャンクを保存済みのチャンクと照合中")
+        existing = {}
+        for row in existing_chunks:
+            existing.setdefault(row["chunk_hash"], []).append(row)
+        
+        planned, moved, new_chunks = [], [], []
+        for i, chunk in enumerate(chunks):
+            rows = existing.get(chunk_hash(chunk))
+            if rows:
+                row = rows.pop(0)
+                planned.append({"id": row["id"], "chunk_index": i})
+                if row["chunk_index"] != i:
+                    moved.append({"id": row["id"], "chunk_index": i, "chunk_text": chunk})
+            else:
+                planned.append(None)
+                new_chunks.append((i, chunk))
+        stale = [row["id"] for rows in existing.values() for row in rows]
+        
+        if progress:
+            progress(0.2, f"{len(new_chunks)}チャンクのembeddingを作成中（{len(chunks) - len(new_chunks)}チャンクは再利用）")
+        texts = [chunk for _, chunk in new_chunks]
+        embeddings = []
+        for start in range(0, len(texts), self._embedding_step):
+            embeddings.extend(self.embeddings.embed_documents(texts[start:start + self._embedding_step]))
+            if progress:
+                progress(0.2 + 0.7 * len(embeddings) / len(texts), f"{len(embeddings)}/{len(texts)}チャンクのembeddingを作成済み")
+        for (i, chunk), embedding in zip(new_chunks, embeddings):
+            planned[i] = {"chunk_index": i, "chunk_text": chunk, "embedding": embedding, **self._chunk_metadata(chunk)}
+        
+        return {
+            "chunks": planned,
+            "moved": moved,
+            "stale": stale,
+            "stats": {"reused": len(chunks) - len(new_chunks), "embedded": len(new_chunks), "deleted": len(stale)}
+        }
+    
+    def _save_contents(self, documents: List[Dict], staged: bool = False) -> Optional[List[str]]:
+        """
+        教材とチャンクを save_contents RPC の1回のトランザクションで保存し、教材のidを返す
+        documents は {'content': contentsの列, 'content_id': 更新する教材のid（新規・キーで上書きはNone）, 'chunks': [...]}
+        supabase_content_functions.sql 未適用の場合はNone
+        """
+        if not self._save_rpc:
+            return None
+        try:
+            result = self.supabase.rpc("save_contents", {"documents": documents, "staged": staged}).execute()
+            return [row["content_id"] for row in result.data]
+        except APIError as e:
+            if not _missing_function(e):
+                raise
+            self._save_rpc = False
+            return None
+    
+    def _save_content(self, content_data: Dict, content_id: Optional[str], plan: Dict) -> str:
+        """1つの教材を保存して id を返す（RPC未適用の場合は contents と content_embeddings を順に書き込む）"""
+        saved = self._save_contents([{"content": content_data, "content_id": content_id, "chunks": plan["chunks"]}])
+        if saved:
+            return saved[0]
+        
+        if content_id is None:
             result = self.supabase.table("contents").upsert(
                 content_data,
                 on_conflict="chapter,lesson,title"
             ).execute()
-            
             if not result.data:
                 raise Exception("Failed to insert content")
-            
             content_id = result.data[0]["id"]
+        else:
+            self.supabase.table("contents").update(content_data).eq("id", content_id).execute()
+        
+        for i in range(0, len(plan["stale"]), 100):
+            self.supabase.table("content_embeddings").delete().in_("id", plan["stale"][i:i + 100]).execute()
+        moved = [dict(row, content_id=content_id) for row in plan["moved"]]
+        if moved:
+            # (content_id, chunk_index) は一意なので、いったん負の番号に退避してから振り直す
+            self.supabase.table("content_embeddings").upsert([
+                dict(row, chunk_index=-1 - n) for n, row in enumerate(moved)
+            ]).execute()
+            self.supabase.table("content_embeddings").upsert(moved).execute()
+        self._insert_embeddings([dict(row, content_id=content_id) for row in plan["chunks"] if "id" not in row])
+        return content_id
+    
+    def _existing_chunks(self, content_id: str) -> List[Dict]:
+        """教材の保存済みチャンクの id, chunk_index, chunk_hash（ハッシュ未保存の行は本文から計算する）"""
+        if "chunk_hash" in self._chunk_columns:
+            try:
+                rows = []
+                for page in iter_pages(lambda: self.supabase.table("content_embeddings").select(
+                    "id, chunk_index, chunk_hash"
+                ).eq("content_id", content_id).order("chunk_index")):
+                    rows.extend(page)
+                if all(row.get("chunk_hash") for row in rows):
+                    return rows
+            except Exception as e:
+                if "chunk_hash" not in str(e):
+                    raise
+                self._chunk_columns.discard("chunk_hash")
+        
+        rows = []
+        for page in iter_pages(lambda: self.supabase.table("content_embeddings").select(
+            "id, chunk_index, chunk_text"
+        ).eq("content_id", content_id).order("chunk_index")):
+            rows.extend(page)
+        return [{"id": row["id"], "chunk_index": row["chunk_index"], "chunk_hash": chunk_hash(row["chunk_text"])}
+                for row in rows]
+    
+    def _chunk_metadata(self, chunk: str) -> Dict:
+        """チャンクごとに登録時に計算しておく値（プロンプトのトークン数・本文中のリンク・本文のハッシュ）"""
+        return {"token_count": count_tokens(chunk), "links": extract_links(chunk), "chunk_hash": chunk_hash(chunk)}
+    
+    def _insert_embeddings(self, embeddings_data: List[Dict], table: str = "content_embeddings"):
+        """チャンクを一括挿入（データベースにない列は除いて挿入し直す）"""
+        if not embeddings_data:
+            return
+        while True:
+            try:
+                self.supabase.table(table).insert([
+                    {key: value for key, value in row.items()
+                     if key not in OPTIONAL_CHUNK_COLUMNS or key in self._chunk_columns}
+                    for row in embeddings_data
+                ]).execute()
+                return
+            except Exception as e:
+                missing = {column for column in self._chunk_columns if column in str(e)}
+                if not missing:
+                    raise
+                self._chunk_columns -= missing
+    
+    def search(self, query: str, n_results: int = 5, chapter: str = None,
+               lesson: str = None, doc_type: str = None,
+               min_similarity: float = None) -> List[Dict]:
+        """質問に対して関連する教材を検索（章・レッスン・種別で絞り込み可能）"""
+        try:
+            # クエリのembeddingを生成
+            query_embedding = self.embeddings.embed_query(query)
             
-            # 2. テキストをチャンクに分割
-            chunks = self.text_splitter.split_text(content)
+            if self.lexical_index is None:
+                return self._vector_search(
+                    query_embedding, n_results, chapter, lesson, doc_type, min_similarity
+                )
             
-            # 3. 既存のembeddingsを削除
-            self.supabase.table("content_embeddings").delete().eq(
-                "content_id", content_id
-            ).execute()
+            # ハイブリッド検索: ベクトル検索とBM25の候補を多めに取り、RRFで統合
+            candidates = n_results * 4
+            vector_docs = self._vector_search(
+                query_embedding, candidates, chapter, lesson, doc_type, min_similarity
+            )
+            lexical_docs = [
+                self._to_doc(item)
+                for item in self.lexical_index.search(query, candidates, chapter, lesson, doc_type)
+            ]
+            return self._reciprocal_rank_fusion([vector_docs, lexical_docs])[:n_results]
             
-            # 4. 各チャンクのembeddingを作成して保存
-            embeddings_data = []
-            for i, chunk in enumerate(chunks):
-                embedding = self.embeddings.embed_query(chunk)
-                
-                embeddings_data.append({
-                    "content_id": content_id,
-                    "chunk_index": i,
-                    "chunk_text": chunk,
-                    "embedding": embedding
-                })
-            
-            # バッチ挿入
-            if embeddings_data:
-                self.supabase.table("content_embeddings").insert(
-                    embeddings_data
-                ).execute()
+        except Exception as e:
+            print(f"Error searching: {str(e)}")
+            # エラー時は空のリストを返す
+            return []
+    
+    async def asearch(self, query: str, n_results: int = 5, chapter: str = None,
+                      lesson: str = None, doc_type: str = None, min_similarity: float = None,
+                      query_embedding: Union[List[float], Awaitable[List[float]], None] = None) -> List[Dict]:
+        """
+        search の非同期版（質問パイプライン用）
+        query_embedding には作成済みのembeddingか、作成中のタスクを渡せる。BM25検索はembeddingの完成を待たずに始め、
+        ベクトル検索はローカル索引がなければ非同期クライアントでRPCを呼ぶ
+        """
+        try:
+            candidates = n_results if self.lexical_index is None else n_results * 4
+            lexical = None
+            if self.lexical_index is not None:
+                lexical = asyncio.ensure_future(asyncio.to_thread(
+                    self.lexical_index.search, query, candidates, chapter, lesson, doc_type
+                ))
             
-            return True
+            if query_embedding is None:
+                query_embedding = await self.embeddings.aembed_query(query)
+            elif inspect.isawaitable(query_embedding):
+                query_embedding = await query_embedding
+            
+            vector_docs = await self._avector_search(
+                query_embedding, candidates, chapter, lesson, doc_type, min_similarity
+            )
+            if lexical is None:
+                return vector_docs
+            
+            lexical_docs = [self._to_doc(item) for item in await lexical]
+            return self._reciprocal_rank_fusion([vector_docs, lexical_docs])[:n_results]
             
         except Exception as e:
-            print(f"Error adding document: {str(e)}")
-            return False
+            print(f"Error searching: {str(e)}")
+            return []
     
-    def search(self, query: str, n_results: int = 5) -> List[Dict]:
-        """質問に対して関連する教材を検索"""
+    def search_many(self, queries: List[str], n_results: int = 5, chapter: str = None,
+                    lesson: str = None, doc_type: str = None,
+                    min_similarity: float = None) -> List[List[Dict]]:
+        """
+        複数の質問をまとめて検索し、質問の順に結果を返す（評価・FAQの事前計算・分析用）
+        embeddingは1回のバッチ呼び出し、ベクトル検索は1回の行列積またはRPCで行う
+        """
+        if not queries:
+            return []
         try:
-            # クエリのembeddingを生成
-            query_embedding = self.embeddings.embed_query(query)
+            query_embeddings = self.embeddings.embed_documents(list(queries))
+            
+            if self.lexical_index is None:
+                return self._vector_search_many(
+                    query_embeddings, n_results, chapter, lesson, doc_type, min_similarity
+                )
+            
+            candidates = n_results * 4
+            vector_results = self._vector_search_many(
+                query_embeddings, candidates, chapter, lesson, doc_type, min_similarity
+            )
+            results = []
+            for query, vector_docs in zip(queries, vector_results):
+                lexical_docs = [
+                    self._to_doc(item)
+                    for item in self.lexical_index.search(query, candidates, chapter, lesson, doc_type)
+                ]
+                results.append(self._reciprocal_rank_fusion([vector_docs, lexical_docs])[:n_results])
+            return results
+            
+        except Exception as e:
+            print(f"Error searching: {str(e)}")
+            return [[] for _ in queries]
+    
+    def _vector_search(self, query_embedding: List[float], n_results: int,
+                       chapter: str = None, lesson: str = None, doc_type: str = None,
+                       min_similarity: float = None) -> List[Dict]:
+        """embeddingのコサイン類似度で検索"""
+        try:
+            # ローカル索引があればネットワークを介さずに検索
+            if self.local_index:
+                try:
+                    items = self.local_index.search(
+                        query_embedding, n_results, chapter, lesson, doc_type, min_similarity
+                    )
+                    return [self._to_doc(item) for item in items]
+                except Exception as e:
+                    print(f"Error searching local index: {str(e)}")
             
             # まずRPC関数を試す
             try:
-                results = self.supabase.rpc(
-                    "match_documents",
+                results = self._match_documents(
+                    query_embedding, n_results, chapter, lesson, doc_type, min_similarity
+                )
+                
+                # RPC関数の結果を正しい形式に変換
+                return [self._to_doc(item) for item in results.data or []]
+            except APIError as e:
+                # RPC関数がない場合は次の方法を試す（タイムアウトなどで全件走査に切り替えると、かえって負荷が増える）
+                if not _missing_function(e):
+                    raise
+            
+            # RPC関数がない場合は全embeddingsをページ単位で走査して類似度計算
+            return self._exact_search(
+                query_embedding, n_results, chapter, lesson, doc_type, min_similarity
+            )
+            
+        except Exception as e:
+            print(f"Error in vector search: {str(e)}")
+            return []
+    
+    async def _avector_search(self, query_embedding: List[float], n_results: int,
+                              chapter: str = None, lesson: str = None, doc_type: str = None,
+                              min_similarity: float = None) -> List[Dict]:
+        """_vector_search の非同期版（ローカル索引や、RPCが使えない場合の全件走査は別スレッドで行う）"""
+        if self.local_index is None:
+            try:
+                if self._async_supabase is None:
+                    self._async_supabase = await acreate_client(*self._supabase_credentials)
+                results = await self._async_supabase.rpc(
+                    "match_documents_filtered",
                     {
                         "query_embedding": query_embedding,
-                        "match_count": n_results
+                        "match_count": n_results,
+                        "filter_chapter": chapter,
+                        "filter_lesson": lesson,
+                        "filter_doc_type": doc_type,
+                        "min_similarity": min_similarity,
+                        "ef_search": self.ef_search
                     }
                 ).execute()
-                
-                if results.data:
-                    # RPC関数の結果を正しい形式に変換
-                    docs = []
-                    for item in results.data:
-                        docs.append({
-                            'content': item.get('chunk_text', ''),
-                            'title': item.get('title', ''),
-                            'url': item.get('url', ''),
-                            'youtube_url': item.get('youtube_url', ''),
-                            'score': 1 - item.get('similarity', 0)
-                        })
-                    return docs
-            except:
-                pass  # RPC関数がない場合は次の方法を試す
-            
-            # RPC関数がない場合は全embeddings取得して手動で類似度計算
-            embeddings_result = self.supabase.table("content_embeddings").select(
-                "*, contents!inner(*)"
-            ).limit(100).execute()
-            
-            if embeddings_result.data:
-                import numpy as np
-                
-                docs = []
-                for item in embeddings_result.data:
-                    if item.get('embedding') and item.get('contents'):
-                        # コサイン類似度を計算
-                        try:
-                            similarity = np.dot(query_embedding, item['embedding']) / (
-                                np.linalg.norm(query_embedding) * np.linalg.norm(item['embedding'])
-                            )
-                        except:
-                            similarity = 0
-                        
-                        docs.append({
-                            'content': item.get('chunk_text', ''),
-                            'title': item['contents'].get('title', ''),
-                            'url': item['contents'].get('url', ''),
-                            'youtube_url': item['contents'].get('youtube_url', ''),
-                            'score': 1 - similarity  # 距離に変換
-                        })
-                
-                # スコアでソート
-                docs.sort(key=lambda x: x['score'])
-                return docs[:n_results]
+                return [self._to_doc(item) for item in results.data or []]
+            except APIError as e:
+                # supabase_vector_index.sql 未適用の場合は同期版の代替手段を使う
+                if not _missing_function(e):
+                    raise
+        
+        return await asyncio.to_thread(
+            self._vector_search, query_embedding, n_results, chapter, lesson, doc_type, min_similarity
+        )
+    
+    def _vector_search_many(self, query_embeddings: List[List[float]], n_results: int,
+                            chapter: str = None, lesson: str = None, doc_type: str = None,
+                            min_similarity: float = None) -> List[List[Dict]]:
+        """_vector_search の複数クエリ版"""
+        try:
+            if self.local_index:
+                try:
+                    return [
+                        [self._to_doc(item) for item in items]
+                        for items in self.local_index.search_many(
+                            query_embeddings, n_results, chapter, lesson, doc_type, min_similarity
+                        )
+                    ]
+                except Exception as e:
+                    print(f"Error searching local index: {str(e)}")
             
-            return []
+            # 1回のRPCで全クエリを検索
+            try:
+                results = self.supabase.rpc(
+                    "match_documents_batch",
+                    {
+                        "query_embeddings": query_embeddings,
+                        "match_count": n_results,
+                        "filter_chapter": chapter,
+                        "filter_lesson": lesson,
+                        "filter_doc_type": doc_type,
+                        "min_similarity": min_similarity,
+                        "ef_search": self.ef_search
+                    }
+                ).execute()
+                grouped = [[] for _ in query_embeddings]
+                for item in results.data or []:
+                    grouped[item["query_index"]].append(self._to_doc(item))
+                return grouped
+            except APIError as e:
+                # supabase_vector_index.sql 未適用の場合
+                if not _missing_function(e):
+                    raise
+            
+            try:
+                return [
+                    [self._to_doc(item) for item in self._match_documents(
+                        query_embedding, n_results, chapter, lesson, doc_type, min_similarity
+                    ).data or []]
+                    for query_embedding in query_embeddings
+                ]
+            except APIError as e:
+                if not _missing_function(e):
+                    raise
+            
+            return self._exact_search_many(
+                query_embeddings, n_results, chapter, lesson, doc_type, min_similarity
+            )
             
         except Exception as e:
-            print(f"Error searching: {str(e)}")
-            # エラー時は空のリストを返す
-            return []
+            print(f"Error in vector search: {str(e)}")
+            return [[] for _ in query_embeddings]
+    
+    def _exact_search(self, query_embedding: List[float], n_results: int,
+                      chapter: str = None, lesson: str = None, doc_type: str = None,
+                      min_similarity: float = None) -> List[Dict]:
+        """全チャンクを必要な列だけページングで取得し、ブロック単位の行列積で完全一致の上位k件を求める"""
+        return self._exact_search_many(
+            [query_embedding], n_results, chapter, lesson, doc_type, min_similarity
+        )[0]
+    
+    def _exact_search_many(self, query_embeddings: List[List[float]], n_results: int,
+                           chapter: str = None, lesson: str = None, doc_type: str = None,
+                           min_similarity: float = None) -> List[List[Dict]]:
+        """_exact_search の複数クエリ版（全チャンクの取得は1回だけ）"""
+        content_ids = None
+        if chapter or lesson or doc_type:
+            query = self.supabase.table("contents").select("id")
+            if chapter:
+                query = query.eq("chapter", chapter)
+            if lesson:
+                query = query.eq("lesson", lesson)
+            if doc_type:
+                query = query.eq("doc_type", doc_type)
+            content_ids = [row["id"] for row in query.execute().data]
+            if not content_ids:
+                return [[] for _ in query_embeddings]
+        
+        def blocks(columns: str):
+            if content_ids is None:
+                yield from iter_pages(lambda: self.supabase.table("content_embeddings").select(
+                    columns
+                ).order("id"))
+                return
+            for i in range(0, len(content_ids), 100):
+                batch = content_ids[i:i + 100]
+                yield from iter_pages(lambda: self.supabase.table("content_embeddings").select(
+                    columns
+                ).in_("content_id", batch).order("id"))
+        
+        while True:
+            optional = [column for column in ("token_count", "links") if column in self._chunk_columns]
+            columns = ", ".join(EXACT_SCAN_COLUMNS + tuple(optional))
+            try:
+                tops = scan_top_k_many(query_embeddings, blocks(columns), n_results, min_similarity)
+                break
+            except APIError as e:
+                # supabase_vector_index.sql 未適用で列がない場合は除いて取得し直す
+                missing = {column for column in optional if column in str(e)}
+                if not missing:
+                    raise
+                self._chunk_columns -= missing
+        winners = list({row["content_id"] for top in tops for _, row in top})
+        if not winners:
+            return [[] for _ in query_embeddings]
+        
+        # 上位k件の教材情報だけを取得
+        contents = self.supabase.table("contents").select(
+            "id, title, url, youtube_url, chapter, lesson, doc_type"
+        ).in_("id", winners).execute()
+        metadata = {row["id"]: row for row in contents.data}
+        
+        return [
+            [
+                self._to_doc(dict(
+                    self._content_metadata(metadata.get(row["content_id"], {})),
+                    content_id=row["content_id"],
+                    chunk_index=row["chunk_index"],
+                    chunk_text=row["chunk_text"],
+                    token_count=row.get("token_count"),
+                    links=row.get("links"),
+                    similarity=similarity
+                ))
+                for similarity, row in top
+            ]
+            for top in tops
+        ]
+    
+    def _reciprocal_rank_fusion(self, ranked_lists: List[List[Dict]], k: int = 60) -> List[Dict]:
+        """複数の検索結果を順位の逆数の和（RRF）で統合"""
+        fused = {}
+        for docs in ranked_lists:
+            for rank, doc in enumerate(docs):
+                chunk_index = doc.get('chunk_index')
+                key = (doc.get('content_id'), chunk_index if chunk_index is not None else doc['content'])
+                if key not in fused:
+                    fused[key] = dict(doc, rrf_score=0.0)
+                fused[key]['rrf_score'] += 1 / (k + rank + 1)
+        
+        return sorted(fused.values(), key=lambda doc: -doc['rrf_score'])
+    
+    def _match_documents(self, query_embedding: List[float], n_results: int,
+                         chapter: str = None, lesson: str = None,
+                         doc_type: str = None, min_similarity: float = None):
+        """ベクトル検索RPCを呼び出す（フィルタ付き関数がなければ従来の関数を使用）"""
+        try:
+            return self.supabase.rpc(
+                "match_documents_filtered",
+                {
+                    "query_embedding": query_embedding,
+                    "match_count": n_results,
+                    "filter_chapter": chapter,
+                    "filter_lesson": lesson,
+                    "filter_doc_type": doc_type,
+                    "min_similarity": min_similarity,
+                    "ef_search": self.ef_search
+                }
+            ).execute()
+        except APIError as e:
+            # supabase_vector_index.sql 未適用の場合（フィルタは適用できない）
+            if not _missing_function(e) or chapter or lesson or doc_type or min_similarity is not None:
+                raise
+            return self.supabase.rpc(
+                "match_documents",
+                {
+                    "query_embedding": query_embedding,
+                    "match_count": n_results
+                }
+            ).execute()
+    
+    def _content_metadata(self, row: Dict) -> Dict:
+        """contentsの行から検索結果に載せるメタデータを取り出す"""
+        return {key: row.get(key) for key in ("title", "url", "youtube_url", "chapter", "lesson", "doc_type")}
+    
+    def rebuild_lexical_index(self):
+        """content_embeddings の全チャンクからBM25インデックスを作り直す"""
+        try:
+            contents = {}
+            for page in iter_pages(lambda: self.supabase.table("contents").select(
+                "id, title, url, youtube_url, chapter, lesson, doc_type"
+            ).order("id")):
+                for row in page:
+                    contents[row["id"]] = row
+            
+            chunks = {}
+            for page in iter_pages(lambda: self.supabase.table("content_embeddings").select(
+                "id, content_id, chunk_index, chunk_text"
+            ).order("id")):
+                for row in page:
+                    chunks.setdefault(row["content_id"], []).append((row["chunk_index"], row["chunk_text"]))
+            
+            self.lexical_index.rebuild(
+                (content_id, [text for _, text in sorted(rows)], self._content_metadata(contents[content_id]))
+                for content_id, rows in chunks.items() if content_id in contents
+            )
+            return True
+        except Exception as e:
+            print(f"Error rebuilding lexical index: {str(e)}")
+            return False
+    
+    def backfill_chunk_metadata(self) -> int:
+        """
+        token_count / links / chunk_hash が未計算のチャンク（マイグレーション適用前に登録した教材）を計算して保存する
+        戻り値は更新したチャンク数
+        """
+        rows = []
+        for page in iter_pages(lambda: self.supabase.table("content_embeddings").select(
+            "id, content_id, chunk_index, chunk_text"
+        ).or_("token_count.is.null,links.is.null,chunk_hash.is.null").order("id")):
+            rows.extend(page)
+        
+        for i in range(0, len(rows), 500):
+            self.supabase.table("content_embeddings").upsert([
+                dict(row, **self._chunk_metadata(row["chunk_text"])) for row in rows[i:i + 500]
+            ]).execute()
+        
+        # updated_at を更新してローカル索引に取り直させる（値はトリガーが現在時刻に置き換える）
+        content_ids = list({row["content_id"] for row in rows})
+        now = datetime.now(timezone.utc).isoformat()
+        for i in range(0, len(content_ids), 100):
+            self.supabase.table("contents").update(
+                {"updated_at": now}
+            ).in_("id", content_ids[i:i + 100]).execute()
+        
+        self._content_changed()
+        return len(rows)
+    
+    def _content_changed(self):
+        """教材の書き込み後に呼ばれ、ローカルの索引を古いものとして扱う"""
+        if self.local_index:
+            self.local_index.mark_stale()
+    
+    def _to_doc(self, item: Dict) -> Dict:
+        """RPC関数の結果行を検索結果の形式に変換"""
+        return {
+            'content': item.get('chunk_text', ''),
+            'title': item.get('title', ''),
+            'url': item.get('url', ''),
+            'youtube_url': item.get('youtube_url', ''),
+            'content_id': item.get('content_id'),
+            'chunk_index': item.get('chunk_index'),
+            'chapter': item.get('chapter', ''),
+            'lesson': item.get('lesson', ''),
+            'doc_type': item.get('doc_type', ''),
+            'token_count': item.get('token_count'),
+            'links': item.get('links'),
+            'score': 1 - item.get('similarity', 0)
+        }
+    
+    def get_content_versions(self, content_ids: List[str]) -> Dict[str, str]:
+        """教材IDごとの updated_at を取得（回答キャッシュの無効化判定用）"""
+        if not content_ids:
+            return {}
+        try:
+            result = self.supabase.table("contents").select("id, updated_at").in_(
+                "id", list(set(content_ids))
+            ).execute()
+            return {row["id"]: row["updated_at"] for row in result.data}
+        except Exception as e:
+            print(f"Error getting content versions: {str(e)}")
+            return {}
     
     def get_chapters_and_lessons(self):
         """章とレッスンの一覧を取得"""
@@ -215,7 +785,13 @@ class KnowledgeBaseSupabase:
                 "chapter", chapter
             ).eq("lesson", lesson).eq("title", title).execute()
             
-            return True if result.data else False
+            if result.data:
+                if self.lexical_index is not None:
+                    for row in result.data:
+                        self.lexical_index.remove_content(row["id"])
+                self._content_changed()
+                return True
+            return False
             
         except Exception as e:
             print(f"Error deleting content: {str(e)}")
@@ -226,8 +802,10 @@ class KnowledgeBaseSupabase:
                       new_url: str = None, new_doc_type: str = None,
                       new_chapter: str = None, new_lesson: str = None,
                       new_chapter_order: int = None, new_lesson_order: int = None,
-                      new_youtube_url: str = None):
-        """コンテンツを更新"""
+                      new_youtube_url: str = None,
+                      progress: Callable[[float, str], None] = None):
+        """コンテンツを更新（progress は add_document と同じ）"""
+        self.last_error = None
         try:
             # 既存のコンテンツを取得
             existing = self.supabase.table("contents").select("*").eq(
@@ -235,6 +813,7 @@ class KnowledgeBaseSupabase:
             ).eq("lesson", old_lesson).eq("title", old_title).execute()
             
             if not existing.data:
+                self.last_error = f"更新する教材が見つかりません: {old_chapter} / {old_lesson} / {old_title}"
                 return False
             
             content_id = existing.data[0]["id"]
@@ -260,47 +839,82 @@ class KnowledgeBaseSupabase:
             if new_youtube_url is not None:
                 update_data["youtube_url"] = new_youtube_url
             
-            # コンテンツを更新
-            self.supabase.table("contents").update(update_data).eq(
-                "id", content_id
-            ).execute()
-            
-            # コンテンツが更新された場合は埋め込みも更新
+            # コンテンツが更新された場合は、本文が変わったチャンクだけ埋め込みを作り直し、
+            # contents と content_embeddings を1回のトランザクションで保存
+            self.last_write_stats = {"reused": 0, "embedded": 0, "deleted": 0}
             if new_content:
-                # 既存のembeddingsを削除
-                self.supabase.table("content_embeddings").delete().eq(
-                    "content_id", content_id
-                ).execute()
-                
-                # 新しいembeddingsを作成
                 chunks = self.text_splitter.split_text(new_content)
-                embeddings_data = []
-                
-                for i, chunk in enumerate(chunks):
-                    embedding = self.embeddings.embed_query(chunk)
-                    embeddings_data.append({
-                        "content_id": content_id,
-                        "chunk_index": i,
-                        "chunk_text": chunk,
-                        "embedding": embedding
-                    })
-                
-                if embeddings_data:
-                    self.supabase.table("content_embeddings").insert(
-                        embeddings_data
-                    ).execute()
+                plan = self._plan_chunks(self._existing_chunks(content_id), chunks, progress)
+                self._save_content(update_data, content_id, plan)
+                self.last_write_stats = plan["stats"]
+            else:
+                self.supabase.table("contents").update(update_data).eq(
+                    "id", content_id
+                ).execute()
             
+            if self.lexical_index is not None:
+                metadata = self._content_metadata(dict(existing.data[0], **update_data))
+                if new_content:
+                    self.lexical_index.replace_content(content_id, chunks, metadata)
+                else:
+                    self.lexical_index.update_metadata(content_id, metadata)
+            
+            self._content_changed()
             return True
             
         except Exception as e:
+            self.last_error = str(e)
             print(f"Error updating content: {str(e)}")
             return False
     
+    def reorder_chapters(self, orders: Dict[str, int]) -> bool:
+        """
+        章の表示順を一括で変更する（{章の名前: 順番}）
+        contents の chapter_order だけを1回のSQL（reorder_chapters RPC）で更新し、embeddingsには触れない
+        """
+        try:
+            orders = {chapter: int(order) for chapter, order in orders.items()}
+            try:
+                self.supabase.rpc("reorder_chapters", {"orders": orders}).execute()
+            except Exception:
+                # supabase_content_functions.sql 未適用の場合は章ごとに更新する
+                for chapter, order in orders.items():
+                    self.supabase.table("contents").update(
+                        {"chapter_order": order}
+                    ).eq("chapter", chapter).execute()
+            return True
+        except Exception as e:
+            print(f"Error reordering chapters: {str(e)}")
+            return False
+    
+    def reorder_lessons(self, chapter: str, orders: Dict[str, int]) -> bool:
+        """
+        章の中のレッスンの表示順を一括で変更する（{レッスンの名前: 順番}）
+        contents の lesson_order だけを1回のSQL（reorder_lessons RPC）で更新し、embeddingsには触れない
+        """
+        try:
+            orders = {lesson: int(order) for lesson, order in orders.items()}
+            try:
+                self.supabase.rpc("reorder_lessons", {"target_chapter": chapter, "orders": orders}).execute()
+            except Exception:
+                # supabase_content_functions.sql 未適用の場合はレッスンごとに更新する
+                for lesson, order in orders.items():
+                    self.supabase.table("contents").update(
+                        {"lesson_order": order}
+                    ).eq("chapter", chapter).eq("lesson", lesson).execute()
+            return True
+        except Exception as e:
+            print(f"Error reordering lessons: {str(e)}")
+            return False
+    
     def clear_all(self):
         """全データを削除"""
         try:
             # contentsを削除（カスケードでembeddingsも削除される）
             self.supabase.table("contents").delete().neq("id", "00000000-0000-0000-0000-000000000000").execute()
+            if self.lexical_index is not None:
+                self.lexical_index.clear()
+            self._content_changed()
             return True
         except Exception as e:
             print(f"Error clearing all: {str(e)}")
@@ -315,7 +929,8 @@ class KnowledgeBaseSupabase:
             return {
                 "total_contents": contents_result.count if contents_result else 0,
                 "total_chunks": embeddings_result.count if embeddings_result else 0,
-                "collection_name": "Supabase Database"
+                "collection_name": "Supabase Database",
+                "embedding_cache": self.embeddings.stats()
             }
         except Exception as e:
             print(f"Error getting stats: {str(e)}")
@@ -0,0 +1,662 @@
+import json
+import math
+import os
+import re
+import threading
+import zlib
+from array import array
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows ではプロセス内の排他のみ
+    fcntl = None
+
+from utils.text import normalize_text
+
+# n-gramはハッシュでバケットに割り当てる（語彙辞書を持たないのでメモリが一定）
+NUM_BUCKETS = 1 << 20
+
+_ASCII_WORD = re.compile(r"[a-z0-9]+(?:[._/:-][a-z0-9]+)*")
+_ASCII_PART = re.compile(r"[a-z0-9]+")
+_JAPANESE_RUN = re.compile(r"[぀-ヿ㐀-鿿ｦ-ﾟ々〆ー]+")
+
+
+def tokenize(text: str, ngram_sizes: Tuple[int, ...] = (2, 3)) -> List[str]:
+    """
+    日本語は文字bi-gram/tri-gram、英数字は単語単位でトークン化
+    「SEO」「H2」「wp-admin」のような英数字の語は分割せずに1トークンとして扱う
+    """
+    text = normalize_text(text, casefold=True)
+    tokens = []
+    for word in _ASCII_WORD.findall(text):
+        tokens.append(word)
+        parts = _ASCII_PART.findall(word)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    for run in _JAPANESE_RUN.findall(text):
+        if len(run) < min(ngram_sizes):
+            tokens.append(run)
+        for n in ngram_sizes:
+            tokens.extend(run[i:i + n] for i in range(len(run) - n + 1))
+    return tokens
+
+
+def _bucket(token: str) -> int:
+    return zlib.crc32(token.encode("utf-8")) & (NUM_BUCKETS - 1)
+
+
+_process_locks: Dict[str, threading.Lock] = {}
+
+
+@contextmanager
+def _file_lock(path: str, blocking: bool = True):
+    """プロセス間の排他ロック（blocking=False で取れなければ False を返す）"""
+    if fcntl is None:
+        lock = _process_locks.setdefault(path, threading.Lock())
+        acquired = lock.acquire(blocking)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                lock.release()
+        return
+
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            acquired = True
+        except BlockingIOError:
+            acquired = False
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _log_header(generation: int) -> bytes:
+    return (json.dumps({"generation": generation}) + "\n").encode("utf-8")
+
+
+def _read_header(f) -> Optional[int]:
+    """操作ログの先頭行の世代（書きかけならNone）"""
+    line = f.readline()
+    if not line.endswith(b"\n"):
+        return None
+    return json.loads(line)["generation"]
+
+
+def _varint_encode(values: np.ndarray) -> np.ndarray:
+    """非負整数の配列を可変長バイト列（LEB128）に変換（小さい値ほど短くなる）"""
+    values = values.astype(np.uint64)
+    nbytes = np.ones(len(values), dtype=np.int64)
+    for shift in (7, 14, 21, 28):
+        nbytes += values >= (1 << shift)
+    starts = np.cumsum(nbytes) - nbytes
+    out = np.empty(int(nbytes.sum()), dtype=np.uint8)
+    for i in range(5):
+        mask = nbytes > i
+        if not mask.any():
+            break
+        byte = (values[mask] >> np.uint64(7 * i)) & np.uint64(0x7F)
+        more = (nbytes[mask] > i + 1).astype(np.uint64) << np.uint64(7)
+        out[starts[mask] + i] = (byte | more).astype(np.uint8)
+    return out
+
+
+def _varint_decode(data: np.ndarray) -> np.ndarray:
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate([[0], ends[:-1] + 1]).astype(np.int64)
+    nbytes = ends - starts + 1
+    values = np.zeros(len(ends), dtype=np.uint64)
+    for i in range(int(nbytes.max()) if len(nbytes) else 0):
+        mask = nbytes > i
+        values[mask] |= (data[starts[mask] + i] & 0x7F).astype(np.uint64) << np.uint64(7 * i)
+    return values
+
+
+class LexicalIndex:
+    """
+    chunk_text に対するBM25転置インデックス
+
+    確定済みのポスティングはCSR形式（バケットごとのオフセット + 文書ID + 出現回数）で持ち、
+    追加された文書は追記用のバッファ、削除された文書は墓標マスクで管理する。
+
+    ディスク上は、確定済みのポスティングを書き出した不変のベース（path の .npz）と、その後の変更を1行ずつ追記する
+    操作ログ（path + ".log"、JSON Lines）に分ける。変更（replace_content / remove_content / update_metadata / clear）は
+    ファイルロックを取って操作ログに1行追記するだけで、どのプロセスも操作ログを読み進めて自分のインデックスに反映する
+    （複数のプロセスが書き込んでも変更が失われず、変更のたびにインデックス全体を書き出さない）。
+    操作ログが compact_bytes を超えると、バックグラウンドでベースに統合し、文書IDの差分と出現回数を可変長整数で
+    符号化した次の世代のベースを書き出す。他のプロセスは新しい世代をバックグラウンドで読み込み、その間は今の内容で検索する。
+    すべての教材から作り直す場合は rebuild で操作ログを経由せずにベースを書き出す。
+    """
+
+    # 世代を読み込み直すときに入れ替える属性
+    _STATE = (
+        "_docs", "_lengths", "_live", "_contents", "_by_content", "_live_count", "_total_length",
+        "_offsets", "_post_docs", "_post_tfs", "_pending_buckets", "_pending_docs", "_pending_tfs",
+        "_generation", "_log_offset", "_log_stat"
+    )
+
+    def __init__(self, path: Optional[str] = "./lexical_index.npz", k1: float = 1.2, b: float = 0.75,
+                 compact_bytes: int = 8 * 1024 * 1024):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.compact_bytes = compact_bytes
+
+        self._lock = threading.RLock()
+        # 読み込んだベースの世代と、操作ログの反映済みのバイト数
+        self._generation = 0
+        self._log_offset = 0
+        self._log_stat = None
+        self._reloading = False
+        self._compacting = False
+        self._reset()
+        if self.path:
+            self._log_path = f"{self.path}.log"
+            self._lock_path = f"{self.path}.lock"
+            self._compact_lock_path = f"{self.path}.compact.lock"
+            self.load()
+
+    def _reset(self):
+        # 文書ごとの情報（文書ID = リストの添字）
+        self._docs: List[List] = []               # [content_id, chunk_index, chunk_text]
+        self._lengths = array("I")
+        self._live = bytearray()
+        self._contents: Dict[str, Dict] = {}      # content_id -> 教材メタデータ
+        self._by_content: Dict[str, List[int]] = {}
+        self._live_count = 0
+        self._total_length = 0
+
+        # 確定済みポスティング（CSR）
+        self._offsets = np.zeros(NUM_BUCKETS + 1, dtype=np.int64)
+        self._post_docs = np.zeros(0, dtype=np.int32)
+        self._post_tfs = np.zeros(0, dtype=np.uint16)
+
+        # 追記バッファ（バケット, 文書ID, 出現回数 のフラットな配列）
+        self._pending_buckets = array("i")
+        self._pending_docs = array("i")
+        self._pending_tfs = array("H")
+
+    # ---- 更新 ----
+
+    def replace_content(self, content_id: str, chunks: List[str], metadata: Dict = None):
+        """教材のチャンクを丸ごと置き換える（add_document / update_content から呼ぶ）"""
+        self._write({"op": "replace", "content_id": content_id, "chunks": list(chunks), "metadata": metadata})
+
+    def update_metadata(self, content_id: str, metadata: Dict):
+        self._write({"op": "metadata", "content_id": content_id, "metadata": metadata})
+
+    def remove_content(self, content_id: str):
+        self._write({"op": "remove", "content_id": content_id})
+
+    def clear(self):
+        self._write({"op": "clear"})
+
+    def _write(self, op: Dict):
+        """変更を操作ログに追記し、自分のインデックスに反映する（path がなければメモリ上だけで反映する）"""
+        if not self.path:
+            with self._lock:
+                self._apply(op)
+            return
+
+        line = (json.dumps(op, ensure_ascii=False) + "\n").encode("utf-8")
+        with _file_lock(self._lock_path):
+            self._prepare_log()
+            with open(self._log_path, "ab") as f:
+                f.write(line)
+                size = f.tell()
+        self._sync()
+        if size > self.compact_bytes:
+            self._compact_in_background()
+
+    def _apply(self, op: Dict):
+        kind = op["op"]
+        content_id = op.get("content_id")
+        if kind == "replace":
+            self._remove(content_id)
+            if op.get("metadata") is not None:
+                self._contents[content_id] = op["metadata"]
+            for chunk_index, chunk in enumerate(op["chunks"]):
+                self._add(content_id, chunk_index, chunk)
+        elif kind == "metadata":
+            if content_id in self._contents:
+                self._contents[content_id].update(op["metadata"])
+        elif kind == "remove":
+            self._remove(content_id)
+            self._contents.pop(content_id, None)
+        elif kind == "clear":
+            self._reset()
+
+    def _apply_lines(self, data: bytes) -> int:
+        """操作ログの行を反映し、反映したバイト数を返す（書きかけの最後の行は残す）"""
+        complete = data[:data.rfind(b"\n") + 1]
+        for line in complete.splitlines():
+            if line:
+                self._apply(json.loads(line))
+        return len(complete)
+
+    def _add(self, content_id: str, chunk_index: int, text: str):
+        doc_id = len(self._docs)
+        counts = Counter(_bucket(token) for token in tokenize(text))
+        for bucket, tf in counts.items():
+            self._pending_buckets.append(bucket)
+            self._pending_docs.append(doc_id)
+            self._pending_tfs.append(min(tf, 65535))
+
+        length = sum(counts.values())
+        self._docs.append([content_id, chunk_index, text])
+        self._lengths.append(length)
+        self._live.append(1)
+        self._by_content.setdefault(content_id, []).append(doc_id)
+        self._live_count += 1
+        self._total_length += length
+
+    def _remove(self, content_id: str):
+        for doc_id in self._by_content.pop(content_id, []):
+            if self._live[doc_id]:
+                self._live[doc_id] = 0
+                self._live_count -= 1
+                self._total_length -= self._lengths[doc_id]
+
+    # ---- 検索 ----
+
+    def _postings(self, bucket: int, pending_buckets: np.ndarray, selected: np.ndarray):
+        start, end = self._offsets[bucket], self._offsets[bucket + 1]
+        docs, tfs = self._post_docs[start:end], self._post_tfs[start:end]
+        if len(selected):
+            extra = selected[pending_buckets[selected] == bucket]
+            if len(extra):
+                docs = np.concatenate([docs, np.frombuffer(self._pending_docs, dtype=np.int32)[extra]])
+                tfs = np.concatenate([tfs, np.frombuffer(self._pending_tfs, dtype=np.uint16)[extra]])
+        return docs, tfs
+
+    def search(self, query: str, n_results: int = 20, chapter: str = None,
+               lesson: str = None, doc_type: str = None) -> List[Dict]:
+        """BM25スコア順に match_documents と同じ形式の行を返す"""
+        self._sync()
+
+        with self._lock:
+            n_docs = len(self._docs)
+            if not self._live_count:
+                return []
+
+            buckets = set(_bucket(token) for token in tokenize(query))
+            avg_length = self._total_length / self._live_count
+            lengths = np.frombuffer(self._lengths, dtype=np.uint32)
+            # 追記バッファからはクエリのバケットの位置だけを1度で取り出しておく
+            pending_buckets = np.frombuffer(self._pending_buckets, dtype=np.int32)
+            selected = np.flatnonzero(np.isin(pending_buckets, list(buckets))) if len(pending_buckets) else pending_buckets
+
+            postings = [self._postings(bucket, pending_buckets, selected) for bucket in buckets]
+            postings = [(docs, tfs) for docs, tfs in postings if len(docs)]
+            # 半数以上の文書に出るn-gram（「ます」「の書」など）はスコアへの寄与が小さいので、他に語があれば除外
+            rare = [(docs, tfs) for docs, tfs in postings if len(docs) <= self._live_count * 0.5]
+            if rare:
+                postings = rare
+
+            all_docs, all_weights = [], []
+            for docs, tfs in postings:
+                df = len(docs)
+                idf = math.log(1 + (self._live_count - df + 0.5) / (df + 0.5))
+                tfs = tfs.astype(np.float32)
+                norm = self.k1 * (1 - self.b + self.b * lengths[docs] / avg_length)
+                all_docs.append(docs)
+                all_weights.append(idf * tfs * (self.k1 + 1) / (tfs + norm))
+
+            if not all_docs:
+                return []
+
+            scores = np.bincount(np.concatenate(all_docs), weights=np.concatenate(all_weights),
+                                 minlength=n_docs)
+            scores[np.frombuffer(self._live, dtype=np.uint8) == 0] = 0
+
+            if chapter or lesson or doc_type:
+                for content_id, doc_ids in self._by_content.items():
+                    content = self._contents.get(content_id, {})
+                    if ((chapter and content.get("chapter") != chapter)
+                            or (lesson and content.get("lesson") != lesson)
+                            or (doc_type and content.get("doc_type") != doc_type)):
+                        scores[doc_ids] = 0
+
+            k = min(n_results, int(np.count_nonzero(scores)))
+            if k <= 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+
+            results = []
+            for doc_id in top:
+                content_id, chunk_index, chunk_text = self._docs[doc_id]
+                content = self._contents.get(content_id, {})
+                results.append({
+                    "content_id": content_id,
+                    "chunk_index": chunk_index,
+                    "chunk_text": chunk_text,
+                    "title": content.get("title", ""),
+                    "url": content.get("url", ""),
+                    "youtube_url": content.get("youtube_url", ""),
+                    "chapter": content.get("chapter", ""),
+                    "lesson": content.get("lesson", ""),
+                    "doc_type": content.get("doc_type", ""),
+                    "bm25": float(scores[doc_id])
+                })
+            return results
+
+    # ---- 保存・読み込み ----
+
+    def _compact(self):
+        """追記バッファと墓標をCSRに統合し、文書IDを詰め直す"""
+        live = np.frombuffer(self._live, dtype=np.uint8).astype(bool)
+
+        counts = np.diff(self._offsets)
+        buckets = np.concatenate([
+            np.repeat(np.arange(NUM_BUCKETS, dtype=np.int32), counts),
+            np.frombuffer(self._pending_buckets, dtype=np.int32)
+        ])
+        docs = np.concatenate([self._post_docs, np.frombuffer(self._pending_docs, dtype=np.int32)])
+        tfs = np.concatenate([self._post_tfs, np.frombuffer(self._pending_tfs, dtype=np.uint16)])
+
+        keep = live[docs] if len(docs) else np.zeros(0, dtype=bool)
+        remap = np.cumsum(live, dtype=np.int64) - 1
+        buckets, docs, tfs = buckets[keep], remap[docs[keep]].astype(np.int32), tfs[keep]
+
+        # 確定済み→追記の順に文書IDは昇順なので、バケットで安定ソートすればバケット内も昇順になる
+        order = np.argsort(buckets, kind="stable")
+        self._post_docs, self._post_tfs = docs[order], tfs[order]
+        self._offsets = np.concatenate([[0], np.cumsum(np.bincount(buckets, minlength=NUM_BUCKETS))])
+        self._pending_buckets = array("i")
+        self._pending_docs = array("i")
+        self._pending_tfs = array("H")
+
+        self._docs = [doc for doc, alive in zip(self._docs, live) if alive]
+        self._lengths = array("I", (length for length, alive in zip(self._lengths, live) if alive))
+        self._live = bytearray([1]) * len(self._docs)
+        self._by_content = {}
+        for doc_id, (content_id, _, _) in enumerate(self._docs):
+            self._by_content.setdefault(content_id, []).append(doc_id)
+        self._contents = {cid: meta for cid, meta in self._contents.items() if cid in self._by_content}
+
+    def save(self) -> bool:
+        """操作ログをベースに統合する（変更は追記した時点で保存済みのため、統合を待つ必要がある場合だけ呼ぶ）"""
+        if not self.path:
+            return False
+        return self.compact()
+
+    def compact(self, blocking: bool = True) -> bool:
+        """今のベースと操作ログから次の世代のベースを書き出す（blocking=False の場合、他で統合中ならFalse）"""
+        return self._publish(self._snapshot, blocking)
+
+    def rebuild(self, contents: Iterable[Tuple[str, List[str], Dict]]) -> bool:
+        """
+        (content_id, チャンク, メタデータ) のすべての教材でインデックスを作り直す
+        操作ログを経由せずに次の世代のベースを書き出し、作り直している間に追記された変更はその後に反映する
+        """
+        def build():
+            fresh = LexicalIndex(path=None, k1=self.k1, b=self.b)
+            if self.path:
+                with _file_lock(self._lock_path):
+                    self._prepare_log()
+                    with open(self._log_path, "rb") as f:
+                        fresh._generation = _read_header(f)
+                        fresh._log_offset = os.fstat(f.fileno()).st_size
+            for content_id, chunks, metadata in contents:
+                fresh._apply({"op": "replace", "content_id": content_id, "chunks": chunks, "metadata": metadata})
+            return fresh
+
+        if not self.path:
+            fresh = build()
+            with self._lock:
+                for name in self._STATE:
+                    setattr(self, name, getattr(fresh, name))
+            return True
+        return self._publish(build, blocking=True)
+
+    def _snapshot(self) -> "LexicalIndex":
+        """今の内容の複製（操作ログを読み直して分割し直さずに済む。次の世代を読み込み中ならファイルから読む）"""
+        self._sync()
+        with self._lock:
+            if self._reloading:
+                return self._read_files()
+            fresh = LexicalIndex(path=None, k1=self.k1, b=self.b)
+            fresh._docs = list(self._docs)
+            fresh._lengths = array("I", self._lengths)
+            fresh._live = bytearray(self._live)
+            fresh._contents = {content_id: dict(meta) for content_id, meta in self._contents.items()}
+            fresh._by_content = {content_id: list(doc_ids) for content_id, doc_ids in self._by_content.items()}
+            fresh._live_count = self._live_count
+            fresh._total_length = self._total_length
+            # 確定済みのポスティングは置き換えるだけで書き換えないため共有する
+            fresh._offsets, fresh._post_docs, fresh._post_tfs = self._offsets, self._post_docs, self._post_tfs
+            fresh._pending_buckets = array("i", self._pending_buckets)
+            fresh._pending_docs = array("i", self._pending_docs)
+            fresh._pending_tfs = array("H", self._pending_tfs)
+            fresh._generation = self._generation
+            fresh._log_offset = self._log_offset
+            return fresh
+
+    def _publish(self, build, blocking: bool) -> bool:
+        """
+        build() の内容（ベースの世代と操作ログの位置を持つ）を次の世代のベースとして書き出し、操作ログをその後の変更だけにする
+        書き出している間も他のプロセスは操作ログに追記でき、ロックを持つのはファイルを入れ替える間だけ
+        """
+        with _file_lock(self._compact_lock_path, blocking=blocking) as acquired:
+            if not acquired:
+                return False
+
+            fresh = build()
+            generation, offset = fresh._generation, fresh._log_offset
+            fresh._compact()
+            tmp = f"{self.path}.tmp.npz"
+            fresh._write_base(tmp, generation + 1, generation, offset)
+
+            header = _log_header(generation + 1)
+            with _file_lock(self._lock_path):
+                tail = b""
+                if os.path.exists(self._log_path):
+                    with open(self._log_path, "rb") as f:
+                        if _read_header(f) != generation:
+                            os.remove(tmp)
+                            return False
+                        f.seek(max(offset, f.tell()))
+                        tail = f.read()
+                # 統合している間に追記された変更は次の世代の操作ログに引き継ぐ
+                with open(f"{self._log_path}.tmp", "wb") as f:
+                    f.write(header + tail)
+                    f.flush()
+                    os.fsync(f.fileno())
+                fresh._generation = generation + 1
+                fresh._log_offset = len(header) + fresh._apply_lines(tail)
+                # 入れ替えた直後の検索で次の世代を読み込み直さないよう、入れ替えと同時に自分の内容も替える
+                with self._lock:
+                    os.replace(tmp, self.path)
+                    os.replace(f"{self._log_path}.tmp", self._log_path)
+                    self._adopt(fresh)
+            return True
+
+    def _compact_in_background(self):
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+
+        def run():
+            try:
+                self.compact(blocking=False)
+            except Exception as e:
+                print(f"Error compacting lexical index: {str(e)}")
+            finally:
+                self._compacting = False
+
+        threading.Thread(target=run, name="lexical-index-compact", daemon=True).start()
+
+    def _write_base(self, path: str, generation: int, log_generation: int, log_offset: int):
+        # 文書IDはバケット内で昇順なので差分にすると小さな値になり、可変長符号で1〜2バイトに収まる
+        deltas = np.diff(self._post_docs, prepend=0).astype(np.int64)
+        starts = self._offsets[:-1][np.diff(self._offsets) > 0]
+        deltas[starts] = self._post_docs[starts]
+
+        side_table = json.dumps({"docs": self._docs, "contents": self._contents}, ensure_ascii=False)
+        # np.savez は拡張子 .npz を付け足すため、開いたファイルに書く
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                counts=_varint_encode(np.diff(self._offsets)),
+                doc_deltas=_varint_encode(deltas),
+                tfs=_varint_encode(self._post_tfs),
+                lengths=np.frombuffer(self._lengths, dtype=np.uint32),
+                side_table=np.frombuffer(side_table.encode("utf-8"), dtype=np.uint8),
+                # このベースに含まれる操作ログの世代と位置（ログの入れ替え前に止まった場合の復旧用）
+                generation=np.array(generation),
+                log_generation=np.array(log_generation),
+                log_offset=np.array(log_offset)
+            )
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _load_base(self, path: str):
+        with np.load(path) as data:
+            offsets = np.concatenate([[0], np.cumsum(_varint_decode(data["counts"]).astype(np.int64))])
+            deltas = _varint_decode(data["doc_deltas"]).astype(np.int64)
+            tfs = _varint_decode(data["tfs"]).astype(np.uint16)
+            lengths = data["lengths"]
+            side_table = json.loads(data["side_table"].tobytes().decode("utf-8"))
+            generation = int(data["generation"]) if "generation" in data.files else 0
+
+        # バケットの先頭以外は差分なので、バケット内で累積和を取って文書IDに戻す
+        counts = np.diff(offsets)
+        starts = offsets[:-1][counts > 0]
+        cumulative = np.cumsum(deltas)
+        base = np.zeros(len(deltas), dtype=np.int64)
+        base[starts] = cumulative[starts] - deltas[starts]
+        base = np.maximum.accumulate(base) if len(base) else base
+        docs = cumulative - base
+
+        self._reset()
+        self._offsets = offsets
+        self._post_docs = docs.astype(np.int32)
+        self._post_tfs = tfs
+        self._docs = side_table["docs"]
+        self._contents = side_table["contents"]
+        self._lengths = array("I", lengths.tolist())
+        self._live = bytearray([1]) * len(self._docs)
+        for doc_id, (content_id, _, _) in enumerate(self._docs):
+            self._by_content.setdefault(content_id, []).append(doc_id)
+        self._live_count = len(self._docs)
+        self._total_length = int(lengths.sum())
+        self._generation = generation
+
+    def _read_base_info(self) -> Tuple[int, int, int]:
+        """ベースの (世代, 含まれる操作ログの世代, その位置)"""
+        if not os.path.exists(self.path):
+            return 0, 0, 0
+        with np.load(self.path) as data:
+            if "generation" not in data.files:
+                return 0, 0, 0
+            return int(data["generation"]), int(data["log_generation"]), int(data["log_offset"])
+
+    def _prepare_log(self):
+        """
+        操作ログをベースと同じ世代にする（ファイルロックを持って呼ぶ）
+        ない場合は作り、ベースを書き出した後・操作ログを入れ替える前に止まっていた場合は、ベースに含まれない続きだけを残す
+        """
+        generation, log_generation, log_offset = self._read_base_info()
+        tail = b""
+        if os.path.exists(self._log_path):
+            with open(self._log_path, "rb") as f:
+                header = _read_header(f)
+                if header is not None and header >= generation:
+                    return
+                if header == log_generation:
+                    f.seek(max(log_offset, f.tell()))
+                    tail = f.read()
+        with open(f"{self._log_path}.tmp", "wb") as f:
+            f.write(_log_header(generation) + tail)
+        os.replace(f"{self._log_path}.tmp", self._log_path)
+
+    def _read_files(self) -> "LexicalIndex":
+        """ベースと操作ログを新しいインスタンスに読み込む（ベースと操作ログの世代がそろうまで読み直す）"""
+        for _ in range(10):
+            fresh = LexicalIndex(path=None, k1=self.k1, b=self.b)
+            if os.path.exists(self.path):
+                fresh._load_base(self.path)
+            if not os.path.exists(self._log_path):
+                return fresh
+            with open(self._log_path, "rb") as f:
+                stat = os.fstat(f.fileno())
+                header = _read_header(f)
+                if header == fresh._generation:
+                    fresh._log_offset = f.tell() + fresh._apply_lines(f.read())
+                    fresh._log_stat = (stat.st_ino, stat.st_size)
+                    return fresh
+            if header is None or header < fresh._generation:
+                with _file_lock(self._lock_path):
+                    self._prepare_log()
+            # header が新しい場合は、ベースを読んだ後に次の世代に入れ替わったので読み直す
+        raise RuntimeError("BM25インデックスのベースと操作ログの世代がそろいません")
+
+    def _adopt(self, fresh: "LexicalIndex"):
+        """読み込んだ（統合した）内容に入れ替える（今より古い場合は入れ替えない）"""
+        with self._lock:
+            if (fresh._generation, fresh._log_offset) < (self._generation, self._log_offset):
+                return
+            for name in self._STATE:
+                setattr(self, name, getattr(fresh, name))
+
+    def load(self):
+        """ベースと操作ログを読み込む"""
+        fresh = self._read_files()
+        with self._lock:
+            for name in self._STATE:
+                setattr(self, name, getattr(fresh, name))
+
+    def _sync(self):
+        """他のプロセス（と自分）が操作ログに追記した変更を反映する"""
+        if not self.path:
+            return
+        try:
+            stat = os.stat(self._log_path)
+        except FileNotFoundError:
+            return
+        if (stat.st_ino, stat.st_size) == self._log_stat:
+            return
+
+        with self._lock:
+            with open(self._log_path, "rb") as f:
+                stat = os.fstat(f.fileno())
+                header = _read_header(f)
+                if header != self._generation:
+                    # 次の世代のベースはバックグラウンドで読み込み、その間は今の内容で検索する
+                    if header is not None and header > self._generation:
+                        self._reload_in_background()
+                    return
+                position = max(self._log_offset, f.tell())
+                f.seek(position)
+                data = f.read()
+            applied = self._apply_lines(data)
+            self._log_offset = position + applied
+            self._log_stat = (stat.st_ino, stat.st_size) if applied == len(data) else None
+
+    def _reload_in_background(self):
+        if self._reloading:
+            return
+        self._reloading = True
+
+        def run():
+            try:
+                self._adopt(self._read_files())
+            except Exception as e:
+                print(f"Error reloading lexical index: {str(e)}")
+            finally:
+                self._reloading = False
+
+        threading.Thread(target=run, name="lexical-index-reload", daemon=True).start()
+
+    def __len__(self):
+        return self._live_count
@@ -0,0 +1,183 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+
+class TokenBucket:
+    """1分あたり per_minute まで使えるトークンバケット（空になっても per_minute / 60 ずつ毎秒補充される）"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60
+        self.available = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """amount を使えるようになるまでの秒数（上限を超える量は上限まで使えれば良いものとする）"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.available >= amount else (amount - self.available) / self.rate
+
+    def take(self, amount: float):
+        self._refill()
+        self.available -= min(amount, self.capacity)
+
+
+class Ticket:
+    """順番待ちの1件（position は自分より先に処理される件数 + 1。処理が始まると0）"""
+
+    def __init__(self, session: str, tokens: int, future: asyncio.Future):
+        self.session = session
+        self.tokens = tokens
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+        self.position = 0
+        self.wait_ms: Optional[float] = None
+
+
+class _Lane:
+    """API呼び出しの種類ごとの同時実行数・レート・セッションごとの待ち行列"""
+
+    def __init__(self, max_concurrent: int, requests_per_minute: float, tokens_per_minute: float):
+        self.max_concurrent = max_concurrent
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.running = 0
+        # セッションごとの待ち行列（先頭のセッションから1件ずつ処理し、処理したセッションは末尾に回す）
+        self.queues: "OrderedDict[str, deque]" = OrderedDict()
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.waits = deque(maxlen=1000)
+        self.granted = 0
+
+
+class OpenAIScheduler:
+    """
+    OpenAI API の呼び出しを種類（completion / embedding）ごとに制限するスケジューラ（1プロセスで共有する）
+
+    同時実行数を max_concurrent までに抑え、1分あたりのリクエスト数・トークン数をトークンバケットで
+    利用プランのレート制限以内に保つ。待っている呼び出しはセッションごとの待ち行列に入れ、セッションを順番に
+    1件ずつ進める（1人が多数の質問を送っても他の人の順番が後回しにならない）。
+    イベントループのスレッドから呼び出す。stats() と Ticket.position は他のスレッドから読んでよい。
+    """
+
+    def __init__(self, limits: Dict[str, Dict[str, float]]):
+        """limits: 種類ごとの {"max_concurrent", "requests_per_minute", "tokens_per_minute"}"""
+        self._lanes = {kind: _Lane(**limit) for kind, limit in limits.items()}
+        self._lock = threading.Lock()
+
+    @asynccontextmanager
+    async def slot(self, kind: str, session: str, tokens: int = 1,
+                   on_queued: Callable[[Ticket], None] = None):
+        """
+        順番が来るまで待ってから API を呼び出す区間（async with で使う）
+        すぐに処理できない場合は on_queued に Ticket を渡す（position で順番を表示できる）
+        """
+        lane = self._lanes[kind]
+        ticket = Ticket(session, tokens, asyncio.get_running_loop().create_future())
+        with self._lock:
+            lane.queues.setdefault(session, deque()).append(ticket)
+        self._dispatch(lane)
+        if on_queued is not None and not ticket.future.done():
+            on_queued(ticket)
+
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            with self._lock:
+                queue = lane.queues.get(session)
+                if queue is not None and ticket in queue:
+                    queue.remove(ticket)
+                    if not queue:
+                        del lane.queues[session]
+            if ticket.wait_ms is not None:
+                # 順番が来た直後に取り消された場合は枠を返す
+                self._release(lane)
+            else:
+                self._dispatch(lane)
+            raise
+
+        try:
+            yield ticket
+        finally:
+            self._release(lane)
+
+    def _release(self, lane: _Lane):
+        with self._lock:
+            lane.running -= 1
+        self._dispatch(lane)
+
+    def _on_timer(self, lane: _Lane):
+        lane.timer = None
+        self._dispatch(lane)
+
+    def _dispatch(self, lane: _Lane):
+        """枠とレートに空きがある限り、順番の来た呼び出しを進める"""
+        with self._lock:
+            while lane.running < lane.max_concurrent and lane.queues:
+                session, queue = next(iter(lane.queues.items()))
+                ticket = queue[0]
+                if ticket.future.done():
+                    queue.popleft()
+                    if not queue:
+                        del lane.queues[session]
+                    continue
+
+                wait = max(lane.requests.wait_time(1), lane.tokens.wait_time(ticket.tokens))
+                if wait > 0:
+                    if lane.timer is None:
+                        lane.timer = asyncio.get_running_loop().call_later(wait, self._on_timer, lane)
+                    break
+
+                queue.popleft()
+                if queue:
+                    lane.queues.move_to_end(session)
+                else:
+                    del lane.queues[session]
+                lane.requests.take(1)
+                lane.tokens.take(ticket.tokens)
+                lane.running += 1
+                lane.granted += 1
+                ticket.position = 0
+                ticket.wait_ms = (time.perf_counter() - ticket.enqueued_at) * 1000
+                lane.waits.append(ticket.wait_ms)
+                ticket.future.set_result(None)
+
+            self._update_positions(lane)
+
+    def _update_positions(self, lane: _Lane):
+        """セッションを順番に1件ずつ進めた場合の、待っている各呼び出しの順番"""
+        queues = [list(queue) for queue in lane.queues.values()]
+        position = 1
+        for i in range(max((len(queue) for queue in queues), default=0)):
+            for queue in queues:
+                if i < len(queue):
+                    queue[i].position = position
+                    position += 1
+
+    def stats(self) -> Dict[str, Dict]:
+        """種類ごとの実行中・順番待ちの件数と、順番待ちの時間（直近1000件）"""
+        stats = {}
+        with self._lock:
+            for kind, lane in self._lanes.items():
+                waits = np.array(lane.waits) if lane.waits else np.zeros(1)
+                stats[kind] = {
+                    "running": lane.running,
+                    "max_concurrent": lane.max_concurrent,
+                    "queued": sum(len(queue) for queue in lane.queues.values()),
+                    "sessions_waiting": len(lane.queues),
+                    "granted": lane.granted,
+                    "wait_ms_p50": round(float(np.percentile(waits, 50)), 1),
+                    "wait_ms_p95": round(float(np.percentile(waits, 95)), 1),
+                    "wait_ms_max": round(float(waits.max()), 1)
+                }
+        return stats
@@ -0,0 +1,108 @@
+import hashlib
+from typing import Callable, Dict, List
+
+from utils.tokens import CHAT_MODEL, count_tokens, truncate_tokens
+
+# インデントや空行もトークンになるため、テンプレートは行頭の空白を入れずに書く
+SYSTEM_PROMPT_TEMPLATE = """あなたはブログスクールの講師アシスタントです。
+以下の教材内容を【厳密に】参考にして、生徒の質問に答えてください。
+
+【重要な指示】
+1. 教材の内容を正確に理解し、その通りに伝える
+2. 教材の意図や文脈を正しく把握する
+3. 教材に書かれていることと逆の内容を言わない
+4. 勝手な解釈や創作をしない
+5. 教材の例示は、その意図（良い例/悪い例）を正確に理解して使用する
+6. 関連するURLがある場合は、説明の該当箇所に自然に埋め込んで紹介する
+
+【教材内容】
+{context}{links_context}
+
+【回答ルール】
+- 教材の内容を忠実に反映する
+- 「〜というタイトルのように」などの具体例は、教材に明記されているもののみ使用
+- 「驚きの事実」「知られざるエピソード」などのフレーズについて、教材で推奨/非推奨が明記されている場合はその通りに説明
+- 教材にない情報は「教材には記載がありません」と明確に伝える
+- 教材の文章をそのまま引用する場合は「教材では『〜』と説明されています」と明記
+- 参考リンクがある場合は、関連する説明の箇所で「詳しくは[こちらの動画]({{url}})をご覧ください」のように自然に紹介"""
+
+# テンプレートの版（回答キャッシュのキーに含め、指示を変えたら以前の回答を使わないようにする）
+PROMPT_VERSION = hashlib.sha256(SYSTEM_PROMPT_TEMPLATE.encode("utf-8")).hexdigest()[:12]
+
+LINKS_HEADER = "\n\n【参考リンク】\n"
+LINK_LABELS = {
+    'youtube': "YouTube動画",
+    'resource': "参考資料",
+    'utage': "Utageリンク"
+}
+
+# チャットAPIがメッセージごとに加える書式トークンの概算（system + user の2メッセージ分）
+MESSAGE_OVERHEAD_TOKENS = 11
+
+
+def format_links(title: str, links: List[Dict]) -> str:
+    """1つの教材の参考リンクをプロンプト用の文字列にする"""
+    text = f"\n教材「{title}」の関連リンク:\n"
+    for link in links:
+        label = LINK_LABELS.get(link['type'])
+        if label:
+            text += f"- {label}: {link['url']}\n"
+    return text
+
+
+def pack_prompt(docs: List[Dict], question: str, max_input_tokens: int = 4000,
+                get_links: Callable[[Dict], List[Dict]] = None, model: str = CHAT_MODEL) -> Dict:
+    """
+    検索結果を順位の順に、入力トークン数が max_input_tokens に収まるだけシステムプロンプトに詰める
+
+    各チャンクのトークン数は登録時に保存した token_count を使い、ない場合だけここで数える。
+    収まらないチャンクは飛ばして次の順位を試す。1件も収まらない場合は最上位のチャンクを切り詰めて入れる。
+    get_links を渡すと、採用した教材の参考リンク（{'type', 'url'} のリスト）もプロンプトに含める。
+
+    戻り値:
+        system_prompt: システムプロンプト
+        docs: プロンプトに入れた検索結果
+        reference_links: 採用した教材ごとの {'title', 'links'}
+        prompt_tokens: システムプロンプトと質問を合わせた入力トークン数
+        context_tokens: 教材内容と参考リンクのトークン数
+        dropped: 予算に収まらず除いた検索結果の数
+    """
+    base_tokens = (count_tokens(SYSTEM_PROMPT_TEMPLATE.format(context="", links_context=""), model)
+                   + count_tokens(question, model) + MESSAGE_OVERHEAD_TOKENS)
+    header_tokens = count_tokens(LINKS_HEADER, model)
+
+    used = base_tokens
+    packed, reference_links = [], []
+    for doc in docs:
+        # チャンク同士は空行で区切る（区切りの分として1トークン加える）
+        cost = (doc.get('token_count') or count_tokens(doc['content'], model)) + 1
+        links = get_links(doc) if get_links else []
+        if links:
+            cost += count_tokens(format_links(doc.get('title', '無題'), links), model)
+            if not reference_links:
+                cost += header_tokens
+        if used + cost > max_input_tokens:
+            continue
+        used += cost
+        packed.append(doc)
+        if links:
+            reference_links.append({'title': doc.get('title', '無題'), 'links': links})
+
+    if not packed and docs:
+        doc = docs[0]
+        packed.append(dict(doc, content=truncate_tokens(doc['content'], max_input_tokens - base_tokens, model)))
+
+    context = "\n\n".join(doc['content'] for doc in packed)
+    links_context = ""
+    if reference_links:
+        links_context = LINKS_HEADER + "".join(format_links(ref['title'], ref['links']) for ref in reference_links)
+    system_prompt = SYSTEM_PROMPT_TEMPLATE.format(context=context, links_context=links_context)
+
+    return {
+        'system_prompt': system_prompt,
+        'docs': packed,
+        'reference_links': reference_links,
+        'prompt_tokens': count_tokens(system_prompt, model) + count_tokens(question, model) + MESSAGE_OVERHEAD_TOKENS,
+        'context_tokens': count_tokens(context + links_context, model),
+        'dropped': len(docs) - len(packed)
+    }
@@ -1,5 +1,6 @@
 import json
 import os
+import threading
 from datetime import datetime
 from typing import List, Dict
 from collections import Counter
@@ -9,6 +10,8 @@ class QuestionLogger:
     def __init__(self, log_file: str = "question_logs.json"):
         self.log_file = log_file
         self.logs = self._load_logs()
+        # 質問パイプラインは回答後に別スレッドで記録するため、追記とファイルの書き込みを直列にする
+        self._lock = threading.Lock()
     
     def _load_logs(self) -> List[Dict]:
         if os.path.exists(self.log_file):
@@ -23,17 +26,21 @@ class QuestionLogger:
         with open(self.log_file, 'w', encoding='utf-8') as f:
             json.dump(self.logs, f, ensure_ascii=False, indent=2)
     
-    def log_question(self, question: str, answer: str, urls: List[str] = None):
-        log_entry = {
-            "timestamp": datetime.now().isoformat(),
-            "question": question,
-            "answer": answer,
-            "urls": urls or [],
-            "id": len(self.logs) + 1
-        }
-        
-        self.logs.append(log_entry)
-        self._save_logs()
+    def log_question(self, question: str, answer: str, urls: List[str] = None, metrics: Dict = None):
+        with self._lock:
+            log_entry = {
+                "timestamp": datetime.now().isoformat(),
+                "question": question,
+                "answer": answer,
+                "urls": urls or [],
+                "id": len(self.logs) + 1
+            }
+            if metrics:
+                # プロンプトのトークン数など、リクエストごとの計測値
+                log_entry["metrics"] = metrics
+            
+            self.logs.append(log_entry)
+            self._save_logs()
         
         return log_entry
     
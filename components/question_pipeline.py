@@ -0,0 +1,388 @@
+import asyncio
+import random
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+
+import openai
+
+from components.answer_stream import astream_answer
+from components.batch_embedder import is_retryable, retry_after
+from components.context_builder import assemble_context
+from components.prompt_builder import pack_prompt
+from components.single_flight import Flight
+from utils.text import normalize_question
+from utils.tokens import CHAT_MODEL, count_tokens
+
+
+class QuestionRun:
+    """
+    QuestionPipeline.start で始めた1つの質問の処理
+
+    wait_context() で検索の完了を待つと docs（参照した教材）と cached がそろう。
+    cached は回答キャッシュを使った場合に "semantic"（類似の質問）または "exact"（同じ質問・同じ検索結果）、使わなければ False。
+    イテレートすると回答の断片を届いた順に返し、answer にそれまでの回答がたまる。
+    同じ質問を処理中だった場合（coalesced）は、その処理の結果を共有する。
+    混み合って回答の生成を待っている間は queue_position に順番が入る。
+    """
+
+    def __init__(self, question: str, flight: Flight, coalesced: bool = False):
+        self.question = question
+        self.flight = flight
+        self.coalesced = coalesced
+        self.started = time.perf_counter()
+        self.parts: List[str] = []
+        self._logged = threading.Event()
+
+    @property
+    def docs(self) -> List[Dict]:
+        return self.flight.docs
+
+    @property
+    def cached(self):
+        return self.flight.cached
+
+    @property
+    def error(self) -> Optional[Exception]:
+        return self.flight.error
+
+    @property
+    def answer(self) -> str:
+        return "".join(self.parts)
+
+    @property
+    def queue_position(self) -> Optional[int]:
+        """回答の生成の順番待ち中なら自分の順番（1始まり）、待っていなければNone"""
+        return self.flight.queue_position
+
+    def wait_context(self, timeout: float = None) -> List[Dict]:
+        """検索が終わるまで待ち、参照した教材を返す（処理が失敗した場合はその例外を送出する）"""
+        if not self.flight.wait_context(timeout):
+            raise TimeoutError("教材の検索がタイムアウトしました")
+        if self.error:
+            raise self.error
+        return self.docs
+
+    def __iter__(self) -> Iterator[str]:
+        for delta in self.updates(None):
+            yield delta
+
+    def updates(self, interval: float = 0.5) -> Iterator[Optional[str]]:
+        """
+        __iter__ と同じく回答の断片を返すが、interval 秒の間に断片が届かなければ None を返す
+        （順番待ちの表示など、待っている間に画面を更新するため）
+        """
+        for delta in self.flight.iter_tokens(interval):
+            if delta is not None:
+                self.parts.append(delta)
+            yield delta
+        if self.error:
+            raise self.error
+
+    def wait_logged(self, timeout: float = None) -> bool:
+        """質問ログの保存まで待つ（ベンチマーク・終了処理用）"""
+        return self._logged.wait(timeout)
+
+
+class QuestionPipeline:
+    """
+    質問から回答までを専用スレッドのイベントループで非同期に処理するパイプライン
+
+    start() はすぐに QuestionRun を返し、呼び出し元（Streamlitのスクリプト）がサイドバーや履歴を描画している間に
+    検索を進める。質問のembeddingとBM25検索、回答キャッシュの照合とベクトル検索は並行して行い、
+    検索が終わるとすぐに回答の生成を始める（参照した教材の表示は生成と並行して行える）。
+    exact_cache（ExactAnswerCache）を渡すと、プロンプトを組み立てた後、回答を生成する前に同じ質問・同じ検索結果の回答を探す。
+    回答キャッシュへの保存と質問ログの書き込みは、回答を返し終えてから行う。
+
+    正規化すると同じになる質問が処理中なら、新たに処理せずその結果（回答の断片を含む）を共有する（single-flight）。
+    質問ログはそれぞれの質問ごとに記録する。flight_store（SqliteFlightStore）を渡すと、同じマシンの他のプロセスで
+    処理中の質問も共有する。
+
+    scheduler（OpenAIScheduler）を渡すと、質問のembeddingと回答の生成をその枠の中で行う（質問したセッションごとに
+    順番に進める）。回答の生成がレート制限などで失敗した場合は、最初の断片を返す前であれば max_retries 回までやり直す。
+    """
+
+    def __init__(self, kb, answer_cache, logger, client=None, exact_cache=None, flight_store=None, scheduler=None,
+                 get_links: Callable[[Dict], List[Dict]] = None,
+                 n_candidates: int = 10, max_chunks: int = 5, max_chunks_per_lesson: int = 2,
+                 min_similarity: float = None, token_budget: int = 4000, model: str = CHAT_MODEL,
+                 temperature: float = 0.7, max_tokens: int = 1000,
+                 flight_poll_interval: float = 0.05, max_retries: int = 2,
+                 initial_backoff: float = 1.0, max_backoff: float = 20.0):
+        self.kb = kb
+        self.answer_cache = answer_cache
+        self.logger = logger
+        self.client = client
+        self.exact_cache = exact_cache
+        self.flight_store = flight_store
+        self.scheduler = scheduler
+        self.get_links = get_links
+        self.n_candidates = n_candidates
+        self.max_chunks = max_chunks
+        self.max_chunks_per_lesson = max_chunks_per_lesson
+        self.min_similarity = min_similarity
+        self.token_budget = token_budget
+        self.model = model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        # 他のプロセスの処理を読み出す間隔と、このプロセスの処理の断片を書き込む間隔（秒）
+        self.flight_poll_interval = flight_poll_interval
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+
+        self._flights: Dict[str, Flight] = {}
+        self._flights_lock = threading.Lock()
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name="question-pipeline", daemon=True).start()
+
+    def start(self, question: str, session_id: str = None) -> QuestionRun:
+        """
+        質問の処理を始める（完了を待たずに返る。同じ質問を処理中ならその結果を共有する）
+        session_id は scheduler で順番を決めるための、質問したセッションの識別子
+        """
+        key = normalize_question(question)
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            coalesced = flight is not None
+            if not coalesced:
+                flight = Flight(key, question, session=session_id or "")
+                self._flights[key] = flight
+                flight.future = asyncio.run_coroutine_threadsafe(self._drive(flight), self._loop)
+            run = QuestionRun(question, flight, coalesced=coalesced)
+        asyncio.run_coroutine_threadsafe(self._follow(run), self._loop)
+        return run
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    async def _drive(self, flight: Flight):
+        """質問を処理する（他のプロセスが処理中ならその結果を読み出す）"""
+        heartbeat = None
+        try:
+            if self.flight_store is not None:
+                flight.owner = await asyncio.to_thread(self.flight_store.acquire, flight.key)
+                if not flight.owner:
+                    await self._relay(flight)
+                    return
+                # 検索中や最初の断片を待つ間など、書き込むものがない間も処理中であることを他のプロセスに知らせる
+                heartbeat = asyncio.ensure_future(self._heartbeat(flight))
+
+            retrieved = await self._retrieve(flight)
+            self._publish(flight, 'publish_context', flight.docs, flight.cached)
+
+            if flight.cached:
+                self._push(flight, retrieved['answer'])
+            else:
+                await self._generate(flight, retrieved)
+            self._finish(flight)
+        except Exception as e:
+            self._finish(flight, e)
+            return
+        finally:
+            if heartbeat is not None:
+                heartbeat.cancel()
+
+        # 回答を返し終えてから保存する
+        if flight.cached:
+            return
+        try:
+            await asyncio.to_thread(self.answer_cache.put, flight.question, retrieved['query_embedding'],
+                                    flight.docs, flight.text)
+            if retrieved.get('exact_key'):
+                await asyncio.to_thread(self.exact_cache.put, retrieved['exact_key'], flight.question, flight.text)
+        except Exception as e:
+            print(f"Error saving answer: {str(e)}")
+
+    async def _follow(self, run: QuestionRun):
+        """処理が終わった後、質問ごとにログを記録する"""
+        try:
+            await asyncio.wrap_future(run.flight.future)
+        except Exception:
+            pass
+
+        flight = run.flight
+        try:
+            if flight.error:
+                return
+            metrics = dict(flight.metrics, **flight.timings(run.started))
+            if run.coalesced:
+                metrics['coalesced'] = True
+            urls = [doc.get('url', '') for doc in flight.docs if doc.get('url')]
+            await asyncio.to_thread(self.logger.log_question, run.question, flight.text, urls, metrics)
+        except Exception as e:
+            print(f"Error logging question: {str(e)}")
+        finally:
+            run._logged.set()
+
+    async def _relay(self, flight: Flight):
+        """他のプロセスが処理中の質問の結果を読み出して flight に渡す"""
+        while True:
+            state = await asyncio.to_thread(self.flight_store.read, flight.key, len(flight.tokens))
+            if state is None:
+                self._finish(flight, RuntimeError("処理中の質問が見つかりません"))
+                return
+            if state['context'] is not None and flight.context_at is None:
+                flight.set_context(state['context']['docs'], state['context']['cached'])
+            flight.remote_position = state.get('queue_position')
+            for token in state['tokens']:
+                flight.push(token)
+            if state['finished']:
+                flight.metrics = dict(state['metrics'], coalesced=True)
+                self._finish(flight, RuntimeError(state['error']) if state['error'] else None)
+                return
+            if state['stale']:
+                self._finish(flight, RuntimeError("回答を生成していたプロセスが応答しません"))
+                return
+            await asyncio.sleep(self.flight_poll_interval)
+
+    async def _heartbeat(self, flight: Flight):
+        """
+        処理が終わるまで定期的に処理中であることを書き込む（scheduler の順番待ちやリトライの待ち時間も含む）
+        順番待ち中はその順番も書き込み、他のプロセスの QuestionRun にも表示する
+        """
+        interval = min(self.flight_store.stale_after / 3, 1.0)
+        while True:
+            await asyncio.sleep(interval)
+            if flight.finished or not flight.owner:
+                return
+            await asyncio.to_thread(self._publish, flight, 'heartbeat', flight.queue_position)
+
+    def _publish(self, flight: Flight, method: str, *args):
+        """flight_store に書き込む（他のプロセスに処理を引き継がれていた場合は、以降は書き込まない）"""
+        owner = flight.owner
+        if owner and not getattr(self.flight_store, method)(flight.key, owner, *args) and not flight.finished:
+            print(f"In-flight question was taken over by another process: {flight.question}")
+            flight.owner = None
+
+    def _push(self, flight: Flight, token: str):
+        flight.push(token)
+        if flight.owner and time.perf_counter() - flight.published_at >= self.flight_poll_interval:
+            self._publish_tokens(flight)
+
+    def _publish_tokens(self, flight: Flight):
+        tokens = flight.tokens[flight.published:]
+        if tokens:
+            self._publish(flight, 'publish_tokens', flight.published, tokens)
+            flight.published += len(tokens)
+        flight.published_at = time.perf_counter()
+
+    def _finish(self, flight: Flight, error: Exception = None):
+        """処理を終え、以降の同じ質問は新たに処理する"""
+        try:
+            if flight.owner:
+                self._publish_tokens(flight)
+                self._publish(flight, 'finish', error, flight.metrics)
+        except Exception as e:
+            print(f"Error publishing answer: {str(e)}")
+        finally:
+            flight.finish(error)
+            with self._flights_lock:
+                if self._flights.get(flight.key) is flight:
+                    del self._flights[flight.key]
+
+    async def _retrieve(self, flight: Flight) -> Dict:
+        """回答キャッシュを照合し（当たればそのエントリを返す）、なければ教材を検索してプロンプトを組み立てる"""
+        question = flight.question
+        if self.scheduler is None:
+            embedding = asyncio.ensure_future(self.kb.embeddings.aembed_query(question))
+        else:
+            limiter = self.scheduler.slot('embedding', flight.session, count_tokens(question))
+            embedding = asyncio.ensure_future(self.kb.embeddings.aembed_query(question, limiter=limiter))
+        # 回答キャッシュに当たらなかった場合に備えて、照合と並行して検索を進める
+        search = asyncio.ensure_future(self.kb.asearch(
+            question, n_results=self.n_candidates, query_embedding=embedding
+        ))
+        query_embedding = await embedding
+        cached = await asyncio.to_thread(self.answer_cache.lookup, query_embedding)
+
+        if cached:
+            search.cancel()
+            flight.metrics = {'cached': 'semantic'}
+            flight.set_context(cached['docs'], 'semantic')
+            return cached
+
+        # 多めに検索し、教材の偏りを抑えて隣接チャンクの重複を除いた上でプロンプトに入れる
+        candidate_docs = assemble_context(
+            await search,
+            max_chunks=self.max_chunks,
+            max_chunks_per_lesson=self.max_chunks_per_lesson,
+            min_similarity=self.min_similarity
+        )
+        # 入力トークンの予算に収まるだけ、順位の高い教材からプロンプトに詰める
+        packed = pack_prompt(candidate_docs, question, max_input_tokens=self.token_budget,
+                             get_links=self.get_links)
+        packed['query_embedding'] = query_embedding
+
+        # 同じ質問・同じ検索結果（教材の更新日時を含む）の回答があれば生成しない
+        if self.exact_cache is not None and packed['docs']:
+            versions = await asyncio.to_thread(
+                self.kb.get_content_versions, [doc['content_id'] for doc in packed['docs'] if doc.get('content_id')]
+            )
+            packed['exact_key'] = self.exact_cache.key(question, packed['docs'], versions)
+            answer = await asyncio.to_thread(self.exact_cache.get, packed['exact_key'])
+            if answer is not None:
+                flight.metrics = {'cached': 'exact'}
+                flight.set_context(packed['docs'], 'exact')
+                return {'answer': answer}
+
+        flight.metrics = {'cached': False}
+        flight.set_context(packed['docs'], False)
+        return packed
+
+    async def _generate(self, flight: Flight, packed: Dict):
+        """回答をストリーミングで生成し、断片を届いた順に flight へ渡す（最初の断片の前に失敗した場合はやり直す）"""
+        if self.client is None:
+            self.client = openai.AsyncOpenAI(api_key=openai.api_key)
+
+        backoff = self.initial_backoff
+        queue_wait_ms = 0.0
+        for attempt in range(self.max_retries + 1):
+            try:
+                if self.scheduler is None:
+                    streamed = await self._stream(flight, packed)
+                else:
+                    tokens = packed['prompt_tokens'] + self.max_tokens
+                    async with self.scheduler.slot('completion', flight.session, tokens,
+                                                   on_queued=lambda ticket: setattr(flight, 'ticket', ticket)) as ticket:
+                        flight.ticket = None
+                        queue_wait_ms += ticket.wait_ms
+                        streamed = await self._stream(flight, packed)
+                break
+            except Exception as e:
+                flight.ticket = None
+                # 回答の一部を返した後は、やり直すと回答が重複するため諦める
+                if attempt == self.max_retries or flight.tokens or not is_retryable(e):
+                    raise
+                wait = retry_after(e) or backoff * (0.5 + random.random())
+                print(f"Retrying answer generation ({attempt + 1}/{self.max_retries}) after {wait:.1f}s: {str(e)}")
+                await asyncio.sleep(min(wait, self.max_backoff))
+                backoff = min(backoff * 2, self.max_backoff)
+
+        # 質問分析ダッシュボードで確認できるよう、実際のプロンプトサイズを記録（応答時間は質問ごとに Flight.timings で計算）
+        usage = streamed.usage
+        flight.metrics.update({
+            'prompt_tokens': usage.prompt_tokens if usage else packed['prompt_tokens'],
+            'completion_tokens': usage.completion_tokens if usage else None,
+            'context_tokens': packed['context_tokens'],
+            'context_chunks': len(packed['docs']),
+            'dropped_chunks': packed['dropped'],
+            'token_budget': self.token_budget
+        })
+        if self.scheduler is not None:
+            flight.metrics['queue_wait_ms'] = round(queue_wait_ms, 1)
+
+    async def _stream(self, flight: Flight, packed: Dict):
+        streamed = await astream_answer(
+            self.client,
+            [
+                {"role": "system", "content": packed['system_prompt']},
+                {"role": "user", "content": flight.question}
+            ],
+            model=self.model,
+            temperature=self.temperature,
+            max_tokens=self.max_tokens
+        )
+        async for delta in streamed:
+            self._push(flight, delta)
+        return streamed
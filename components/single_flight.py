@@ -0,0 +1,253 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, Iterator, List, Optional
+
+
+class Flight:
+    """
+    同じ質問に対する1回分の処理（検索と回答の生成）の結果を、その質問を待っているすべての QuestionRun に配る
+
+    検索結果（docs・cached）と回答の断片を受け取った順に保持するため、後から参加した QuestionRun にもはじめから渡せる。
+    *_at はそれぞれの段階が終わった時刻（time.perf_counter）。
+    """
+
+    def __init__(self, key: str, question: str, session: str = None):
+        self.key = key
+        self.question = question
+        # 処理を始めた質問のセッション（OpenAIScheduler の順番待ちに使う）と、順番待ち中の Ticket
+        self.session = session
+        self.ticket = None
+        # 他のプロセスが処理中の場合の、そのプロセスでの順番待ちの順番
+        self.remote_position: Optional[int] = None
+        self.docs: List[Dict] = []
+        self.cached = False
+        self.metrics: Dict = {}
+        self.error: Optional[Exception] = None
+        self.tokens: List[str] = []
+        self.finished = False
+        self.context_at: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+        self.done_at: Optional[float] = None
+
+        # 処理を進めるコルーチンの concurrent.futures.Future（QuestionPipeline が設定する）
+        self.future = None
+        # SqliteFlightStore に書き込む場合（このプロセスが処理を担当する場合）の所有者トークンと、書き込み済みの断片数と時刻
+        # （他のプロセスに処理を引き継がれた場合は None に戻し、以降は書き込まない）
+        self.owner: Optional[str] = None
+        self.published = 0
+        self.published_at = 0.0
+
+        self._cond = threading.Condition()
+
+    @property
+    def text(self) -> str:
+        return "".join(self.tokens)
+
+    @property
+    def queue_position(self) -> Optional[int]:
+        """回答の生成の順番待ち中なら順番（1始まり）、待っていなければNone"""
+        ticket = self.ticket
+        if ticket is not None and ticket.position:
+            return ticket.position
+        return self.remote_position or None
+
+    def set_context(self, docs: List[Dict], cached):
+        with self._cond:
+            self.docs = docs
+            self.cached = cached
+            self.context_at = time.perf_counter()
+            self._cond.notify_all()
+
+    def push(self, token: str):
+        with self._cond:
+            if self.first_token_at is None:
+                self.first_token_at = time.perf_counter()
+            self.tokens.append(token)
+            self._cond.notify_all()
+
+    def finish(self, error: Exception = None):
+        with self._cond:
+            self.error = error
+            self.finished = True
+            self.done_at = time.perf_counter()
+            if self.context_at is None:
+                self.context_at = self.done_at
+            self._cond.notify_all()
+
+    def wait_context(self, timeout: float = None) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: self.context_at is not None, timeout)
+
+    def iter_tokens(self, timeout: float = None) -> Iterator[Optional[str]]:
+        """
+        回答の断片をはじめから返し、処理が終わるまで続きを待つ
+        timeout を指定すると、その秒数の間に新しい断片が届かなければ None を返す（待っている間の表示の更新用）
+        """
+        position = 0
+        while True:
+            with self._cond:
+                ready = self._cond.wait_for(lambda: len(self.tokens) > position or self.finished, timeout)
+                tokens = self.tokens[position:]
+                finished = self.finished
+            if not ready:
+                yield None
+                continue
+            yield from tokens
+            position += len(tokens)
+            if finished:
+                return
+
+    def timings(self, started: float) -> Dict:
+        """started（質問を受け付けた時刻）から各段階までのミリ秒（後から参加した場合、待たずに済んだ段階は0）"""
+        def elapsed(at):
+            return round(max(at - started, 0) * 1000, 1)
+
+        timings = {'retrieval_ms': elapsed(self.context_at), 'total_ms': elapsed(self.done_at)}
+        if not self.cached and self.first_token_at is not None:
+            timings['first_token_ms'] = elapsed(self.first_token_at)
+        return timings
+
+
+class SqliteFlightStore:
+    """
+    同じマシンの複数のワーカープロセスで、同じ質問の処理をまとめるための共有ストア（SQLite）
+
+    acquire に成功したプロセスが処理を担当し、返された所有者トークンを付けて検索結果と回答の断片を書き込む。
+    他のプロセスは read で読み出して自分のプロセスの QuestionRun に配る。担当のプロセスが stale_after 秒書き込まなければ
+    （heartbeat を含む）止まったものとみなし、次に acquire したプロセスが引き継ぐ。引き継がれた後の元の担当の書き込みは
+    所有者トークンが一致しないため反映されない。終わった処理は retention 秒後に削除する。
+    """
+
+    def __init__(self, path: str, stale_after: float = 30.0, retention: float = 60.0):
+        self.stale_after = stale_after
+        self.retention = retention
+        self._lock = threading.Lock()
+        # トランザクションは明示的に開始する（acquire の確認と登録を1つのトランザクションで行うため）
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS flights (
+                key TEXT PRIMARY KEY,
+                heartbeat REAL NOT NULL,
+                context TEXT,
+                finished INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                metrics TEXT,
+                owner TEXT,
+                queue_position INTEGER
+            )
+        """)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(flights)")}
+        for column, column_type in (("owner", "TEXT"), ("queue_position", "INTEGER")):
+            if column not in columns:
+                self._db.execute(f"ALTER TABLE flights ADD COLUMN {column} {column_type}")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS flight_tokens (
+                key TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                PRIMARY KEY (key, seq)
+            )
+        """)
+
+    def acquire(self, key: str) -> Optional[str]:
+        """処理を担当し、所有者トークンを返す（他のプロセスが処理中ならNone）"""
+        now = time.time()
+        owner = uuid.uuid4().hex
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "DELETE FROM flight_tokens WHERE key IN "
+                    "(SELECT key FROM flights WHERE finished = 1 AND heartbeat < ?)",
+                    (now - self.retention,)
+                )
+                self._db.execute("DELETE FROM flights WHERE finished = 1 AND heartbeat < ?", (now - self.retention,))
+
+                row = self._db.execute("SELECT heartbeat, finished FROM flights WHERE key = ?", (key,)).fetchone()
+                if row and not row[1] and now - row[0] <= self.stale_after:
+                    self._db.execute("COMMIT")
+                    return None
+
+                self._db.execute("DELETE FROM flight_tokens WHERE key = ?", (key,))
+                self._db.execute(
+                    "INSERT OR REPLACE INTO flights (key, heartbeat, owner) VALUES (?, ?, ?)", (key, now, owner)
+                )
+                self._db.execute("COMMIT")
+                return owner
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    # 以下の書き込みは owner が acquire で受け取った所有者トークンと一致する場合だけ行い、行ったかどうかを返す
+
+    def heartbeat(self, key: str, owner: str, queue_position: int = None) -> bool:
+        """
+        処理中であることを知らせる（検索中や回答の順番待ち中など、書き込むものがない間も定期的に呼ぶ）
+        queue_position は回答の生成の順番待ち中の順番（他のプロセスの QuestionRun にも表示する）
+        """
+        with self._lock:
+            return self._db.execute(
+                "UPDATE flights SET heartbeat = ?, queue_position = ? WHERE key = ? AND owner = ? AND finished = 0",
+                (time.time(), queue_position, key, owner)
+            ).rowcount > 0
+
+    def publish_context(self, key: str, owner: str, docs: List[Dict], cached) -> bool:
+        with self._lock:
+            return self._db.execute(
+                "UPDATE flights SET context = ?, heartbeat = ? WHERE key = ? AND owner = ?",
+                (json.dumps({"docs": docs, "cached": cached}, ensure_ascii=False), time.time(), key, owner)
+            ).rowcount > 0
+
+    def publish_tokens(self, key: str, owner: str, start: int, tokens: List[str]) -> bool:
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                owned = self._db.execute(
+                    "UPDATE flights SET heartbeat = ? WHERE key = ? AND owner = ?", (time.time(), key, owner)
+                ).rowcount > 0
+                if owned:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO flight_tokens (key, seq, text) VALUES (?, ?, ?)",
+                        [(key, start + i, token) for i, token in enumerate(tokens)]
+                    )
+                self._db.execute("COMMIT")
+                return owned
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def finish(self, key: str, owner: str, error: Exception = None, metrics: Dict = None) -> bool:
+        with self._lock:
+            return self._db.execute(
+                "UPDATE flights SET finished = 1, error = ?, metrics = ?, heartbeat = ? WHERE key = ? AND owner = ?",
+                (str(error) if error else None, json.dumps(metrics or {}, ensure_ascii=False), time.time(),
+                 key, owner)
+            ).rowcount > 0
+
+    def read(self, key: str, start: int) -> Optional[Dict]:
+        """start 番目以降の回答の断片と処理の状態（処理が見つからなければNone）"""
+        with self._lock:
+            # 状態を先に読む（完了していれば、その前に書き込まれた断片はすべて読める）
+            row = self._db.execute(
+                "SELECT heartbeat, context, finished, error, metrics, queue_position FROM flights WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            tokens = [token for (token,) in self._db.execute(
+                "SELECT text FROM flight_tokens WHERE key = ? AND seq >= ? ORDER BY seq", (key, start)
+            )]
+        heartbeat, context, finished, error, metrics, queue_position = row
+        return {
+            "context": json.loads(context) if context else None,
+            "tokens": tokens,
+            "finished": bool(finished),
+            "error": error,
+            "metrics": json.loads(metrics) if metrics else {},
+            "queue_position": queue_position,
+            "stale": not finished and time.time() - heartbeat > self.stale_after
+        }
@@ -0,0 +1,197 @@
+import re
+import zlib
+from typing import Iterable, Iterator, List, Tuple, Union
+
+from utils.tokens import CHAT_MODEL, count_tokens
+
+# 文の区切り（句点・感嘆符・疑問符と閉じ括弧、または改行）。ここまでを1文とする
+_TERMINATOR = re.compile(r"[。．！？!?]+[」』）)\]]*[ \t　]*\n*|\n+")
+# 長すぎる文を分ける位置（読点・空白）
+_CLAUSE_BREAK = re.compile(r"[、，,　 \t]+")
+
+# 区切りの強さ（チャンクの境界には強い区切りを優先して使う）
+PARAGRAPH, SENTENCE, CLAUSE, NONE = 3, 2, 1, 0
+
+# (本文, トークン数, 直後の区切りの強さ)
+Unit = Tuple[str, int, int]
+
+
+class TextChunker:
+    """
+    日本語の文・読点の区切りでテキストをトークン数の上限以内のチャンクに分割する
+
+    文ごとに本文のハッシュでチャンクの境界にするかを決める（content-defined chunking）ため、境界は
+    先頭からの文字数ではなく周りの文の内容で決まる。教材の一部を書き換えても、離れた位置のチャンクは
+    同じ本文のまま残り、embeddingを使い回せる（knowledge_base_supabase の chunk_hash）。
+
+    チャンクは min_tokens 以上になってから境界の候補になり、平均で target_tokens 前後、最大 max_tokens になる。
+    各チャンクの先頭には前のチャンクの末尾の文を overlap_tokens まで重ねる（context_builder.merge_overlap で除ける）。
+    """
+
+    def __init__(self, max_tokens: int = 600, target_tokens: int = 400, min_tokens: int = 200,
+                 overlap_tokens: int = 80, model: str = CHAT_MODEL):
+        if not 0 <= overlap_tokens < min_tokens < target_tokens <= max_tokens:
+            raise ValueError("0 <= overlap_tokens < min_tokens < target_tokens <= max_tokens が必要です")
+        self.max_tokens = max_tokens
+        self.target_tokens = target_tokens
+        self.min_tokens = min_tokens
+        self.overlap_tokens = overlap_tokens
+        self.model = model
+
+    def split_text(self, text: str) -> List[str]:
+        """RecursiveCharacterTextSplitter.split_text と同じ形（チャンクのリスト）で返す"""
+        return list(self.iter_chunks(text))
+
+    def iter_chunks(self, text: Union[str, Iterable[str]]) -> Iterator[str]:
+        """
+        チャンクを先頭から順に返す
+        text は文字列のほか、ファイルの行など文字列の断片のイテレータでもよい（全体を読み込まずに分割する）
+        """
+        current: List[Unit] = []   # 今のチャンクの単位（先頭の overlap 個は前のチャンクと重なる部分）
+        overlap = 0
+        total = 0
+
+        for unit in self._iter_units(text):
+            # 入りきらない場合は区切りの強い位置で切る
+            while total + unit[1] > self.max_tokens and len(current) > overlap:
+                cut = self._forced_cut(current, overlap)
+                chunk = self._join(current[:cut])
+                if chunk:
+                    yield chunk
+                carried = self._carry(current[:cut])
+                current, overlap = carried + current[cut:], len(carried)
+                total = sum(tokens for _, tokens, _ in current)
+            # 重ねた部分だけでも入りきらない場合は重ねる量を減らす
+            while total + unit[1] > self.max_tokens and current:
+                total -= current.pop(0)[1]
+                overlap = max(overlap - 1, 0)
+
+            current.append(unit)
+            total += unit[1]
+            if total >= self.min_tokens and self._is_boundary(unit):
+                chunk = self._join(current)
+                if chunk:
+                    yield chunk
+                current = self._carry(current)
+                overlap = len(current)
+                total = sum(tokens for _, tokens, _ in current)
+
+        if len(current) > overlap:
+            chunk = self._join(current)
+            if chunk:
+                yield chunk
+
+    def _iter_units(self, text: Union[str, Iterable[str]]) -> Iterator[Unit]:
+        """文ごとの単位（長すぎる文は読点・空白や文字数で分ける）"""
+        pieces = [text] if isinstance(text, str) else text
+        max_unit = self.max_tokens - self.overlap_tokens
+        # 1トークンが4文字を超えることはほぼないため、区切りのないままこれより長い部分はどのみち分けることになる
+        max_run = max_unit * 4
+
+        # buffer[start:] がまだ返していない部分、scan は次に文の区切りを探し始める位置
+        buffer, start, scan = "", 0, 0
+        for piece in pieces:
+            buffer = buffer[start:] + piece
+            scan, start = scan - start, 0
+            start, scan = yield from self._scan(buffer, start, scan, max_run, max_unit, final=False)
+
+        start, _ = yield from self._scan(buffer, start, scan, max_run, max_unit, final=True)
+        if start < len(buffer):
+            yield from self._split_long(buffer[start:], max_unit)
+
+    def _scan(self, buffer: str, start: int, scan: int, max_run: int, max_unit: int, final: bool):
+        """
+        buffer を先頭から1度だけ走査して文ごとの単位を返し、次の (start, scan) を返す
+        区切りのないまま max_run 文字を超えた部分は、文の終わりを待たずに読点・空白（なければ文字数）で切り出す
+        """
+        while True:
+            match = _TERMINATOR.search(buffer, scan)
+            end = match.start() if match else len(buffer)
+            while end - start > max_run:
+                cut, level = self._run_cut(buffer, start, start + max_run)
+                yield from self._split_long(buffer[start:cut], max_unit, level)
+                start = cut
+            # 最後の文は続きの断片で延びる可能性があるため、次の断片を読むまで残す
+            if match is None or (match.end() == len(buffer) and not final):
+                return start, end
+            yield from self._split_long(buffer[start:match.end()], max_unit)
+            start = scan = match.end()
+
+    def _run_cut(self, buffer: str, start: int, limit: int) -> Tuple[int, int]:
+        """buffer[start:limit] を切る位置（最も後ろの読点・空白の後ろ。なければ limit）と区切りの強さ"""
+        cut = None
+        for match in _CLAUSE_BREAK.finditer(buffer, start, limit):
+            cut = match.end()
+        return (cut, CLAUSE) if cut else (limit, NONE)
+
+    def _split_long(self, sentence: str, max_unit: int, level: int = None) -> Iterator[Unit]:
+        """1文を上限に収まる単位に分ける（最後の単位が文の区切りの強さを持つ）"""
+        if level is None:
+            level = PARAGRAPH if "\n\n" in sentence else SENTENCE
+        tokens = count_tokens(sentence, self.model)
+        if tokens <= max_unit:
+            yield sentence, tokens, level
+            return
+
+        clauses, begin = [], 0
+        for match in _CLAUSE_BREAK.finditer(sentence):
+            clauses.append(sentence[begin:match.end()])
+            begin = match.end()
+        clauses.append(sentence[begin:])
+        parts = []
+        for clause in filter(None, clauses):
+            clause_tokens = count_tokens(clause, self.model)
+            if clause_tokens <= max_unit:
+                parts.append((clause, clause_tokens, CLAUSE))
+                continue
+            # 区切りのない長い文字列はトークン数に比例した文字数で切る
+            while clause:
+                size = max(1, len(clause) * max_unit // max(clause_tokens, 1))
+                head, clause = clause[:size], clause[size:]
+                head_tokens = count_tokens(head, self.model)
+                while head_tokens > max_unit and len(head) > 1:
+                    clause = head[len(head) // 2:] + clause
+                    head = head[:len(head) // 2]
+                    head_tokens = count_tokens(head, self.model)
+                parts.append((head, head_tokens, NONE))
+                clause_tokens = count_tokens(clause, self.model) if clause else 0
+        text, tokens, _ = parts[-1]
+        parts[-1] = (text, tokens, level)
+        yield from parts
+
+    def _is_boundary(self, unit: Unit) -> bool:
+        """
+        文の後ろをチャンクの境界にするか（本文のハッシュで決めるため、同じ文はどの位置でも同じ結果になる）
+        境界になる確率を文のトークン数に比例させ、min_tokens を超えてから平均 target_tokens - min_tokens で切れるようにする
+        段落の区切りは文の区切りの2倍切れやすくする
+        """
+        text, tokens, level = unit
+        if level < SENTENCE:
+            return False
+        probability = tokens * (level - 1) / (self.target_tokens - self.min_tokens)
+        return zlib.crc32(text.encode("utf-8")) < probability * 0xFFFFFFFF
+
+    def _forced_cut(self, current: List[Unit], overlap: int) -> int:
+        """
+        上限に達したチャンクの切る位置（current の何個目の後ろで切るか）
+        min_tokens 以上になる位置のうち区切りの最も強い、最も後ろの位置を選ぶ
+        """
+        best, best_level, total = len(current), -1, 0
+        for i, (_, tokens, level) in enumerate(current):
+            total += tokens
+            if i >= overlap and total >= self.min_tokens and level >= best_level:
+                best, best_level = i + 1, level
+        return best
+
+    def _carry(self, units: List[Unit]) -> List[Unit]:
+        """次のチャンクの先頭に重ねる末尾の文（overlap_tokens 以内）"""
+        carried, total = [], 0
+        for unit in reversed(units):
+            if total + unit[1] > self.overlap_tokens:
+                break
+            carried.insert(0, unit)
+            total += unit[1]
+        return carried
+
+    def _join(self, units: List[Unit]) -> str:
+        return "".join(text for text, _, _ in units).strip()
@@ -0,0 +1,518 @@
+import heapq
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows（ローカル開発時）はプロセス間ロックなし
+    fcntl = None
+
+EMBEDDING_DIM = 1536
+PAGE_SIZE = 1000
+
+# contents.updated_at がこの秒数以内の教材は、embeddingsの書き込み途中の可能性があるため次回も再取得する
+SETTLE_SECONDS = 120
+
+CONTENT_COLUMNS = "id, updated_at, title, url, youtube_url, chapter, lesson, doc_type"
+
+# meta-{gen}.json の rows の形式（変わったら次の同期で全件を取り直す）
+# [content_id, chunk_index, chunk_text, token_count, links]
+ROW_FORMAT = 2
+
+
+def parse_embeddings(values: List) -> np.ndarray:
+    """embeddingのリストを (n, dim) のfloat32行列に変換（文字列は連結して一度にパースする）"""
+    if values and isinstance(values[0], str):
+        # loadtxt はCで実装されたパーサーを使うため、要素ごとのfloat変換より高速
+        return np.loadtxt((value.strip("[]") for value in values), delimiter=",",
+                          dtype=np.float32, ndmin=2)
+    return np.asarray(values, dtype=np.float32)
+
+
+def scan_top_k(query_embedding: List[float], blocks: Iterable[List[Dict]], n_results: int,
+               min_similarity: float = None) -> List[Tuple[float, Dict]]:
+    """
+    行ブロックを順に読み、ブロックごとに1回の行列積でコサイン類似度を計算して上位k件を保持する
+    メモリ使用量はブロック1つ分 + k件のみ。戻り値は (類似度, 行) の類似度降順リスト
+    """
+    return scan_top_k_many([query_embedding], blocks, n_results, min_similarity)[0]
+
+
+def scan_top_k_many(query_embeddings: List[List[float]], blocks: Iterable[List[Dict]], n_results: int,
+                    min_similarity: float = None) -> List[List[Tuple[float, Dict]]]:
+    """scan_top_k の複数クエリ版。各ブロックは1回だけパースし、全クエリとの類似度を1回の行列積で求める"""
+    if n_results <= 0 or not len(query_embeddings):
+        return [[] for _ in query_embeddings]
+    queries = np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+    queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+    heaps: List[List[Tuple[float, int, Dict]]] = [[] for _ in range(len(queries))]
+    seen = 0
+    for rows in blocks:
+        rows = [row for row in rows if row.get("embedding")]
+        if not rows:
+            continue
+        matrix = parse_embeddings([row["embedding"] for row in rows])
+        norms = np.maximum(np.linalg.norm(matrix, axis=1), 1e-12)
+        scores = (queries @ matrix.T) / norms
+
+        # ブロック内の上位k件だけをヒープと比較する
+        k = min(n_results, len(rows))
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        for heap, query_scores, query_candidates in zip(heaps, scores, candidates):
+            for i in query_candidates:
+                score = float(query_scores[i])
+                if min_similarity is not None and score < min_similarity:
+                    continue
+                item = (score, seen + int(i), rows[i])
+                if len(heap) < n_results:
+                    heapq.heappush(heap, item)
+                elif score > heap[0][0]:
+                    heapq.heapreplace(heap, item)
+        seen += len(rows)
+
+    return [
+        [(score, row) for score, _, row in sorted(heap, key=lambda item: (-item[0], item[1]))]
+        for heap in heaps
+    ]
+
+
+QUANTIZATION_MODES = ("none", "float16", "int8")
+
+# 量子化行列を float32 に戻して内積を取るブロックの行数（一時バッファをCPUキャッシュに収める）
+SCORE_BLOCK_ROWS = 1024
+
+# search_many で一度に行列積を取るクエリ数（スコア行列 (クエリ数, N) のメモリを抑える）
+QUERY_BLOCK_ROWS = 256
+
+
+def quantize(matrix: np.ndarray, mode: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    ベクトル行列を省メモリ形式に変換し、(量子化行列, 次元ごとのスケール) を返す
+    int8 は次元ごとの最大絶対値を127に対応させる対称スカラー量子化（float32の1/4）、float16 は1/2
+    """
+    if mode == "float16":
+        return matrix.astype(np.float16), None
+    if mode == "int8":
+        scale = np.zeros(matrix.shape[1], dtype=np.float32)
+        for start in range(0, len(matrix), SCORE_BLOCK_ROWS * 16):
+            block = np.abs(matrix[start:start + SCORE_BLOCK_ROWS * 16]).max(axis=0)
+            scale = np.maximum(scale, block)
+        scale = np.maximum(scale, 1e-12) / 127
+        compact = np.empty(matrix.shape, dtype=np.int8)
+        for start in range(0, len(matrix), SCORE_BLOCK_ROWS * 16):
+            block = matrix[start:start + SCORE_BLOCK_ROWS * 16] / scale
+            compact[start:start + len(block)] = np.clip(np.rint(block), -127, 127)
+        return compact, scale
+    raise ValueError(f"Unknown quantization mode: {mode}")
+
+
+def approximate_scores(compact: np.ndarray, scale: Optional[np.ndarray], query: np.ndarray) -> np.ndarray:
+    """
+    量子化行列とクエリの内積をブロック単位で計算（行列全体のfloat32コピーを作らない）
+    query が (dim,) なら (N,)、(Q, dim) なら (Q, N) を返す
+    """
+    # int8: (q * scale) @ query == q @ (scale * query)
+    query = (query * scale).astype(np.float32) if scale is not None else query
+    scores = np.empty(query.shape[:-1] + (len(compact),), dtype=np.float32)
+    for start in range(0, len(compact), SCORE_BLOCK_ROWS):
+        block = compact[start:start + SCORE_BLOCK_ROWS]
+        scores[..., start:start + len(block)] = query @ block.astype(np.float32).T
+    return scores
+
+
+def iter_pages(build_query, page_size: int = PAGE_SIZE) -> Iterator[List[Dict]]:
+    """PostgRESTの行数上限を超えて全件取得するためにrangeでページングする"""
+    start = 0
+    while True:
+        rows = build_query().range(start, start + page_size - 1).execute().data or []
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            break
+        start += page_size
+
+
+class LocalVectorIndex:
+    """
+    content_embeddings をローカルにスナップショットしたベクトル索引
+
+    ベクトルは正規化済みfloat32行列として .npy に保存し、np.load(mmap_mode='r') で読み込むため、
+    同じマシン上の複数のStreamlitプロセスがOSのページキャッシュを共有する。
+    更新は contents.updated_at を比較して変更された教材だけを取り直す（差分同期）。
+
+    quantization に "int8" / "float16" を指定すると、検索は量子化した行列で候補を絞り込み、
+    上位 n_results * rescore_factor 件だけをfloat32の行列で再計算する。
+    全件を走査するのは量子化行列（float32の1/4（int8）または1/2（float16））だけになる。
+    ただしfloat32の vectors-{世代}.npy は再計算用にディスクへ残ってmmapされるため、ディスク使用量は量子化行列の分だけ増え、
+    候補行の読み込みもOSのページ単位（先読み・fault-around）で行われるので常駐メモリは1/4にはならない
+    （実測は benchmarks/bench_quantization.py の resident_mb）。
+    """
+
+    def __init__(self, supabase, path: str = "./vector_index", refresh_interval: float = 60,
+                 quantization: str = "none", rescore_factor: int = 10):
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"quantization must be one of {QUANTIZATION_MODES}")
+
+        self.supabase = supabase
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+
+        self._lock = threading.Lock()
+        self._syncing = False
+        self._generation = None
+        self._matrix = None        # (N, dim) float32 memmap
+        self._compact = None       # (N, dim) int8 / float16 memmap（量子化モードのみ）
+        self._scale = None         # (dim,) int8 のスケール
+        self._row_content = None   # (N,) int32 memmap（contents_list へのインデックス）
+        self._rows = []            # [[content_id, chunk_index, chunk_text], ...]
+        self._contents = []        # [{id, title, url, ...}, ...]
+        self._last_sync = 0.0
+
+        os.makedirs(self.path, exist_ok=True)
+
+    # ---- ファイル配置 ----
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _read_manifest(self) -> Optional[Dict]:
+        try:
+            with open(self._file("manifest.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_json(self, name: str, data):
+        tmp = self._file(f".{name}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, self._file(name))
+
+    def _load_generation(self, manifest: Dict):
+        """マニフェストが指す世代のファイルをmmapで開く"""
+        generation = manifest["generation"]
+        if generation == self._generation:
+            return
+
+        with open(self._file(f"meta-{generation}.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+
+        if manifest["count"]:
+            matrix = np.load(self._file(f"vectors-{generation}.npy"), mmap_mode="r")
+            row_content = np.load(self._file(f"rows-{generation}.npy"), mmap_mode="r")
+        else:
+            matrix = np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+            row_content = np.zeros(0, dtype=np.int32)
+
+        compact, scale = None, None
+        if self.quantization != "none" and manifest["count"]:
+            compact, scale = self._load_quantized(generation, matrix)
+
+        self._matrix = matrix
+        self._compact = compact
+        self._scale = scale
+        self._row_content = row_content
+        self._rows = meta["rows"]
+        self._contents = meta["contents"]
+        self._generation = generation
+
+    def _load_quantized(self, generation: int, matrix: np.ndarray):
+        """量子化行列を読み込む（この世代のファイルがなければ作成して他プロセスと共有する）"""
+        compact_file = self._file(f"{self.quantization}-{generation}.npy")
+        scale_file = self._file(f"{self.quantization}scale-{generation}.npy")
+        if not os.path.exists(compact_file):
+            # refresh() はファイルロックを持ったままここを呼ぶため、ロックは取らずに
+            # プロセスごとに異なる一時ファイルへ書いてから置き換える（同時に作っても中身は同じ）
+            compact, scale = quantize(matrix, self.quantization)
+            suffix = f"{os.getpid()}-{uuid.uuid4().hex}"
+            if scale is not None:
+                tmp = self._file(f".{self.quantization}scale-{generation}-{suffix}.npy")
+                np.save(tmp, scale)
+                os.replace(tmp, scale_file)
+            tmp = self._file(f".{self.quantization}-{generation}-{suffix}.npy")
+            np.save(tmp, compact)
+            os.replace(tmp, compact_file)
+
+        compact = np.load(compact_file, mmap_mode="r")
+        scale = np.load(scale_file) if self.quantization == "int8" else None
+        return compact, scale
+
+    # ---- 同期 ----
+
+    def _file_lock(self):
+        lock_file = open(self._file(".lock"), "w")
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def mark_stale(self):
+        """次回の検索時に差分同期を行う（add_document などの書き込み後に呼ぶ）"""
+        self._last_sync = 0.0
+
+    def refresh(self) -> Dict:
+        """Supabaseと差分同期する。戻り値は変更件数の概要"""
+        lock_file = self._file_lock()
+        try:
+            manifest = self._read_manifest() or {
+                "generation": 0, "count": 0, "versions": {}
+            }
+            if manifest["generation"]:
+                with self._lock:
+                    self._load_generation(manifest)
+
+            # 1. 全教材の id と updated_at だけを取得して変更を検出
+            current = {}
+            for page in iter_pages(lambda: self.supabase.table("contents").select(
+                "id, updated_at"
+            ).order("id")):
+                for row in page:
+                    current[row["id"]] = row["updated_at"]
+
+            # 形式が古いスナップショットは全教材を取り直す
+            versions = manifest["versions"] if manifest.get("format") == ROW_FORMAT else {}
+            changed = [cid for cid, updated_at in current.items() if versions.get(cid) != updated_at]
+            deleted = [cid for cid in manifest["versions"] if cid not in current]
+
+            if not changed and not deleted and manifest["generation"]:
+                self._last_sync = time.time()
+                return {"changed": 0, "deleted": 0, "rows": manifest["count"]}
+
+            # 2. 変更された教材のメタデータとembeddingsだけを取得
+            content_meta = {}
+            new_rows, new_vectors = [], []
+            for i in range(0, len(changed), 100):
+                batch = changed[i:i + 100]
+                for page in iter_pages(lambda: self.supabase.table("contents").select(
+                    CONTENT_COLUMNS
+                ).in_("id", batch).order("id")):
+                    for row in page:
+                        content_meta[row["id"]] = row
+                # token_count / links 列はマイグレーション適用前のデータベースにはないため * で取得する
+                for page in iter_pages(lambda: self.supabase.table("content_embeddings").select(
+                    "*"
+                ).in_("content_id", batch).order("id")):
+                    page = [row for row in page if row.get("embedding")]
+                    if page:
+                        new_rows.extend(
+                            [row["content_id"], row["chunk_index"], row["chunk_text"],
+                             row.get("token_count"), row.get("links")]
+                            for row in page
+                        )
+                        new_vectors.extend(parse_embeddings([row["embedding"] for row in page]))
+
+            # 3. 変更のない行は既存スナップショットから引き継ぐ
+            replaced = set(changed) | set(deleted)
+            if self._matrix is not None and len(self._rows):
+                keep = np.array([row[0] not in replaced for row in self._rows], dtype=bool)
+                kept_rows = [row for row, k in zip(self._rows, keep) if k]
+                kept_matrix = self._matrix[keep]
+                for content in self._contents:
+                    if content["id"] not in replaced:
+                        content_meta[content["id"]] = content
+            else:
+                kept_rows = []
+                kept_matrix = np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+
+            # 取得中に削除された教材のチャンクは除外
+            fetched = [(row, vector) for row, vector in zip(new_rows, new_vectors) if row[0] in content_meta]
+            new_rows = [row for row, _ in fetched]
+            new_vectors = [vector for _, vector in fetched]
+
+            if new_vectors:
+                added = np.vstack(new_vectors)
+                added /= np.maximum(np.linalg.norm(added, axis=1, keepdims=True), 1e-12)
+            else:
+                added = np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+
+            rows = kept_rows + new_rows
+            contents = [
+                {key: meta.get(key) for key in ("id", "title", "url", "youtube_url", "chapter", "lesson", "doc_type")}
+                for meta in content_meta.values()
+            ]
+            positions = {content["id"]: i for i, content in enumerate(contents)}
+
+            # 4. 新しい世代として書き出してからマニフェストを切り替える
+            generation = manifest["generation"] + 1
+            count = len(rows)
+            if count:
+                vectors = np.lib.format.open_memmap(
+                    self._file(f".vectors-{generation}.npy"), mode="w+",
+                    dtype=np.float32, shape=(count, EMBEDDING_DIM)
+                )
+                vectors[:len(kept_rows)] = kept_matrix
+                vectors[len(kept_rows):] = added
+                vectors.flush()
+                del vectors
+                os.replace(self._file(f".vectors-{generation}.npy"), self._file(f"vectors-{generation}.npy"))
+                np.save(self._file(f"rows-{generation}.npy"),
+                        np.array([positions[row[0]] for row in rows], dtype=np.int32))
+            self._write_json(f"meta-{generation}.json", {"rows": rows, "contents": contents})
+
+            settle_limit = datetime.now(timezone.utc).timestamp() - SETTLE_SECONDS
+            self._write_json("manifest.json", {
+                "format": ROW_FORMAT,
+                "generation": generation,
+                "count": count,
+                "synced_at": datetime.now(timezone.utc).isoformat(),
+                "versions": {
+                    cid: (updated_at if _parse_time(updated_at) < settle_limit else None)
+                    for cid, updated_at in current.items()
+                }
+            })
+
+            previous = manifest["generation"]
+            with self._lock:
+                self._load_generation(self._read_manifest())
+            self._remove_generation(previous)
+            self._last_sync = time.time()
+
+            return {"changed": len(changed), "deleted": len(deleted), "rows": count}
+        finally:
+            lock_file.close()
+
+    def _remove_generation(self, generation: int):
+        """古い世代のファイルを削除（他プロセスがmmap中でもPOSIXでは安全）"""
+        names = [f"vectors-{generation}.npy", f"rows-{generation}.npy", f"meta-{generation}.json"]
+        names += [f"{mode}-{generation}.npy" for mode in QUANTIZATION_MODES]
+        names += [f"{mode}scale-{generation}.npy" for mode in QUANTIZATION_MODES]
+        for name in names:
+            try:
+                os.remove(self._file(name))
+            except OSError:
+                pass
+
+    def _refresh_in_background(self):
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error refreshing local vector index: {str(e)}")
+            finally:
+                self._syncing = False
+
+        with self._lock:
+            if self._syncing:
+                return
+            self._syncing = True
+        threading.Thread(target=run, daemon=True).start()
+
+    def _ensure_ready(self):
+        """他プロセスが作成した新しい世代を読み込み、必要なら差分同期を開始する"""
+        manifest = self._read_manifest()
+        if manifest is None or not manifest["generation"] or manifest.get("format") != ROW_FORMAT:
+            # スナップショットがまだない（または形式が古い）場合だけ同期的に作成
+            self.refresh()
+            return
+
+        with self._lock:
+            self._load_generation(manifest)
+
+        if time.time() - self._last_sync > self.refresh_interval:
+            self._refresh_in_background()
+
+    # ---- 検索 ----
+
+    def search(self, query_embedding: List[float], n_results: int = 5, chapter: str = None,
+               lesson: str = None, doc_type: str = None,
+               min_similarity: float = None) -> List[Dict]:
+        """match_documents_filtered と同じ形式の行を返す"""
+        return self.search_many([query_embedding], n_results, chapter, lesson, doc_type, min_similarity)[0]
+
+    def search_many(self, query_embeddings: List[List[float]], n_results: int = 5, chapter: str = None,
+                    lesson: str = None, doc_type: str = None,
+                    min_similarity: float = None) -> List[List[Dict]]:
+        """複数のクエリをまとめて検索し、クエリの順に結果を返す（索引との行列積はクエリ行列で1回）"""
+        if not len(query_embeddings):
+            return []
+        self._ensure_ready()
+
+        with self._lock:
+            matrix, row_content = self._matrix, self._row_content
+            compact, scale = self._compact, self._scale
+            rows, contents = self._rows, self._contents
+
+        if not len(rows) or n_results <= 0:
+            return [[] for _ in query_embeddings]
+
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+        allowed = None
+        if chapter or lesson or doc_type:
+            allowed_contents = np.array([
+                (not chapter or c.get("chapter") == chapter)
+                and (not lesson or c.get("lesson") == lesson)
+                and (not doc_type or c.get("doc_type") == doc_type)
+                for c in contents
+            ], dtype=bool)
+            allowed = allowed_contents[row_content]
+
+        results = []
+        for start in range(0, len(queries), QUERY_BLOCK_ROWS):
+            block = queries[start:start + QUERY_BLOCK_ROWS]
+            if compact is None:
+                # 正規化済みなので内積 = コサイン類似度
+                candidates = None
+                scores = block @ matrix.T
+                if allowed is not None:
+                    scores[:, ~allowed] = -np.inf
+            else:
+                # 量子化行列で候補を絞り、候補だけをfloat32で再計算
+                approx = approximate_scores(compact, scale, block)
+                if allowed is not None:
+                    approx[:, ~allowed] = -np.inf
+                n_candidates = min(approx.shape[1], n_results * self.rescore_factor)
+                candidates = np.sort(np.argpartition(-approx, n_candidates - 1, axis=1)[:, :n_candidates], axis=1)
+                scores = np.stack([matrix[c] @ query for c, query in zip(candidates, block)])
+                scores[~np.isfinite(np.take_along_axis(approx, candidates, axis=1))] = -np.inf
+
+            if min_similarity is not None:
+                scores[scores < min_similarity] = -np.inf
+
+            k = min(n_results, scores.shape[1])
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top = np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+
+            for q in range(len(block)):
+                docs = []
+                for position in top[q]:
+                    similarity = scores[q, position]
+                    if not np.isfinite(similarity):
+                        break
+                    i = position if candidates is None else candidates[q, position]
+                    content_id, chunk_index, chunk_text, token_count, links = rows[i]
+                    content = contents[row_content[i]]
+                    docs.append({
+                        "content_id": content_id,
+                        "chunk_index": chunk_index,
+                        "chunk_text": chunk_text,
+                        "token_count": token_count,
+                        "links": links,
+                        "title": content.get("title", ""),
+                        "url": content.get("url", ""),
+                        "youtube_url": content.get("youtube_url", ""),
+                        "chapter": content.get("chapter", ""),
+                        "lesson": content.get("lesson", ""),
+                        "doc_type": content.get("doc_type", ""),
+                        "similarity": float(similarity)
+                    })
+                results.append(docs)
+        return results
+
+
+def _parse_time(value: str) -> float:
+    """updated_at（ISO 8601）をUNIX時刻に変換"""
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, ValueError):
+        return 0.0
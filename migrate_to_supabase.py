@@ -1,8 +1,20 @@
 """
 ChromaDBからSupabaseへのデータ移行スクリプト
+
+ChromaDBに保存済みのチャンク・embedding・メタデータをそのままSupabaseに書き込む（embeddingは作り直さない）。
+chunk_index は元の番号を保ち、移行後に件数と抜き取ったチャンクのベクトルが一致するかを確認する。
+
+    python migrate_to_supabase.py [--chroma-path ./chroma_db] [--workers 4] [--sample 50]
 """
+import argparse
 import os
+import random
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List
+
+import numpy as np
 from dotenv import load_dotenv
 
 # 環境変数を読み込み
@@ -11,91 +23,218 @@ load_dotenv()
 # パスを追加
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from components.knowledge_base import KnowledgeBase
+import chromadb
+
+from components.bulk_importer import content_key, write_documents
+from components.context_builder import merge_overlap
 from components.knowledge_base_supabase import KnowledgeBaseSupabase
+from components.vector_index import EMBEDDING_DIM, parse_embeddings
+
+# ChromaDBから一度に読み込むチャンク数
+READ_PAGE_SIZE = 1000
+
+# 抜き取り確認で一致とみなすコサイン類似度（float32への変換誤差を許容する）
+MIN_SAMPLE_SIMILARITY = 0.9999
+
+
+def read_chroma(path: str, collection_name: str, page_size: int = READ_PAGE_SIZE) -> Dict:
+    """ChromaDBの全チャンクを教材ごとにまとめて返す（キーは (chapter, lesson, title)）"""
+    collection = chromadb.PersistentClient(path=path).get_collection(collection_name)
+    contents = {}
+    offset = 0
+    while True:
+        page = collection.get(include=["documents", "metadatas", "embeddings"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        for chunk_id, text, metadata, embedding in zip(page["ids"], page["documents"], page["metadatas"],
+                                                       page["embeddings"]):
+            key = content_key(metadata)
+            if key not in contents:
+                contents[key] = {"metadata": metadata, "chunks": []}
+            contents[key]["chunks"].append({
+                "id": chunk_id,
+                "chunk_index": metadata.get("chunk_index", 0),
+                "chunk_text": text,
+                "embedding": [float(value) for value in embedding]
+            })
+        offset += len(page["ids"])
+    return contents
+
+
+def build_documents(contents: Dict) -> Iterator[Dict]:
+    """
+    教材ごとに write_documents に渡す形にする
+    chunk_index は元の番号を使い、同じ番号が重複している教材（古いチャンクが残っているもの）だけ振り直す
+    """
+    for key, data in contents.items():
+        metadata = data["metadata"]
+        chunks = sorted(data["chunks"], key=lambda chunk: (chunk["chunk_index"], chunk["id"]))
+        renumbered = len({chunk["chunk_index"] for chunk in chunks}) < len(chunks)
+        if renumbered:
+            chunks = [dict(chunk, chunk_index=i) for i, chunk in enumerate(chunks)]
+
+        for chunk in chunks:
+            if len(chunk["embedding"]) != EMBEDDING_DIM:
+                raise ValueError(f"{metadata.get('title')}: embeddingの次元が{len(chunk['embedding'])}です"
+                                 f"（Supabaseは{EMBEDDING_DIM}次元）")
+
+        # チャンクの重なり（chunk_overlap）を取り除いて本文を復元
+        full_content = chunks[0]["chunk_text"] if chunks else ""
+        for chunk in chunks[1:]:
+            full_content = merge_overlap(full_content, chunk["chunk_text"])
+
+        yield {
+            "key": key,
+            "renumbered": renumbered,
+            "content": {
+                "chapter": metadata.get("chapter") or "",
+                "chapter_order": metadata.get("chapter_order", 0),
+                "lesson": metadata.get("lesson") or "",
+                "lesson_order": metadata.get("lesson_order", 0),
+                "title": metadata.get("title") or "",
+                "content": full_content,
+                "doc_type": metadata.get("doc_type") or "text",
+                "url": metadata.get("url") or None,
+                "youtube_url": metadata.get("youtube_url") or None
+            },
+            "chunks": chunks
+        }
+
+
+def batch_documents(documents: List[Dict], batch_rows: int) -> Iterator[List[Dict]]:
+    """チャンク数が batch_rows 前後になるように教材をまとめる（1つの教材は分けない）"""
+    batch, rows = [], 0
+    for doc in documents:
+        batch.append(doc)
+        rows += len(doc["chunks"])
+        if rows >= batch_rows:
+            yield batch
+            batch, rows = [], 0
+    if batch:
+        yield batch
+
+
+def write_batch(kb: KnowledgeBaseSupabase, batch: List[Dict]) -> int:
+    """教材のバッチを書き込み、書き込んだチャンク数を返す"""
+    return write_documents(kb, [{
+        "content": doc["content"],
+        "chunks": [{
+            "chunk_index": chunk["chunk_index"],
+            "chunk_text": chunk["chunk_text"],
+            "embedding": chunk["embedding"],
+            **kb._chunk_metadata(chunk["chunk_text"])
+        } for chunk in doc["chunks"]]
+    } for doc in batch])
 
-def migrate_data():
+
+def content_ids(kb: KnowledgeBaseSupabase, documents: List[Dict]) -> Dict:
+    """移行した教材の (chapter, lesson, title) → Supabaseのid"""
+    keys = {doc["key"] for doc in documents}
+    ids = {}
+    for chapter in {key[0] for key in keys}:
+        result = kb.supabase.table("contents").select("id, chapter, lesson, title").eq("chapter", chapter).execute()
+        for row in result.data:
+            if content_key(row) in keys:
+                ids[content_key(row)] = row["id"]
+    return ids
+
+
+def verify(kb: KnowledgeBaseSupabase, documents: List[Dict], sample_size: int) -> bool:
+    """移行後の件数と、抜き取ったチャンクの本文・ベクトルがChromaDBと一致するかを確認する"""
+    ok = True
+    ids = content_ids(kb, documents)
+    print(f"  教材数: ChromaDB {len(documents)}件 / Supabase {len(ids)}件")
+    if len(ids) != len(documents):
+        ok = False
+
+    expected = sum(len(doc["chunks"]) for doc in documents)
+    actual = 0
+    id_list = list(ids.values())
+    for i in range(0, len(id_list), 100):
+        result = kb.supabase.table("content_embeddings").select("id", count="exact").in_(
+            "content_id", id_list[i:i + 100]
+        ).limit(1).execute()
+        actual += result.count or 0
+    print(f"  チャンク数: ChromaDB {expected}件 / Supabase {actual}件")
+    if actual != expected:
+        ok = False
+
+    samples = random.sample([(doc, chunk) for doc in documents for chunk in doc["chunks"]],
+                            min(sample_size, expected))
+    mismatched = 0
+    for doc, chunk in samples:
+        result = kb.supabase.table("content_embeddings").select("chunk_text, embedding").eq(
+            "content_id", ids.get(doc["key"])
+        ).eq("chunk_index", chunk["chunk_index"]).execute()
+        if not result.data or result.data[0]["chunk_text"] != chunk["chunk_text"]:
+            mismatched += 1
+            continue
+        stored, original = parse_embeddings([result.data[0]["embedding"], chunk["embedding"]])
+        similarity = float(np.dot(stored, original) / (np.linalg.norm(stored) * np.linalg.norm(original)))
+        if similarity < MIN_SAMPLE_SIMILARITY:
+            mismatched += 1
+    print(f"  抜き取り確認: {len(samples) - mismatched}/{len(samples)}件のチャンクが一致")
+    return ok and mismatched == 0
+
+
+def migrate_data(chroma_path: str = "./chroma_db", collection_name: str = "blog_school_docs",
+                 batch_rows: int = 500, workers: int = 4, sample_size: int = 50) -> bool:
     print("データ移行を開始します...")
-    
+
     # ChromaDBからデータを取得
     print("1. ChromaDBからデータを取得中...")
-    kb_old = KnowledgeBase()
-    
+    began = time.perf_counter()
+    contents = read_chroma(chroma_path, collection_name)
+    if not contents:
+        print("移行するデータがありません。")
+        return True
+    documents = list(build_documents(contents))
+    chunk_count = sum(len(doc["chunks"]) for doc in documents)
+    print(f"  {len(documents)}件の教材（{chunk_count}チャンク）が見つかりました"
+          f"（{time.perf_counter() - began:.1f}秒）。")
+    for doc in documents:
+        if doc["renumbered"]:
+            print(f"  ⚠️ {doc['content']['title']}: chunk_index が重複していたため振り直しました")
+
+    # Supabaseに移行（embeddingはChromaDBのものをそのまま使う）
+    print("2. Supabaseにデータを移行中...")
+    kb = KnowledgeBaseSupabase()
+    began = time.perf_counter()
+    written = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for count in executor.map(lambda batch: write_batch(kb, batch), batch_documents(documents, batch_rows)):
+            written += count
+            print(f"  {written}/{chunk_count}チャンク")
+    seconds = time.perf_counter() - began
+    print(f"  書き込み完了: {seconds:.1f}秒（{written / max(seconds, 1e-9):.0f}チャンク/秒）")
+    print(f"  embedding API呼び出し: {kb.embeddings.stats()['misses']}件")
+
+    print("3. 移行結果を確認中...")
+    ok = verify(kb, documents, sample_size)
+    print("\n✅ 移行完了" if ok else "\n❌ ChromaDBとSupabaseのデータが一致しません")
+
+    # 統計情報を表示
+    stats = kb.get_stats()
+    print(f"\nSupabaseの統計:")
+    print(f"  コンテンツ数: {stats['total_contents']}")
+    print(f"  チャンク数: {stats['total_chunks']}")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ChromaDBからSupabaseへのデータ移行")
+    parser.add_argument("--chroma-path", default="./chroma_db")
+    parser.add_argument("--collection", default="blog_school_docs")
+    parser.add_argument("--batch-rows", type=int, default=500, help="1回の書き込みに含めるチャンク数の目安")
+    parser.add_argument("--workers", type=int, default=4, help="並列に書き込むバッチ数")
+    parser.add_argument("--sample", type=int, default=50, help="ベクトルを照合するチャンク数")
+    args = parser.parse_args()
+
     try:
-        all_data = kb_old.collection.get()
-        
-        if not all_data or not all_data['metadatas']:
-            print("移行するデータがありません。")
-            return
-        
-        # 教材ごとにまとめる
-        contents = {}
-        for i, metadata in enumerate(all_data['metadatas']):
-            key = f"{metadata.get('chapter', '')}_{metadata.get('lesson', '')}_{metadata.get('title', '')}"
-            
-            if key not in contents:
-                contents[key] = {
-                    'chapter': metadata.get('chapter', ''),
-                    'chapter_order': metadata.get('chapter_order', 0),
-                    'lesson': metadata.get('lesson', ''),
-                    'lesson_order': metadata.get('lesson_order', 0),
-                    'title': metadata.get('title', ''),
-                    'doc_type': metadata.get('doc_type', 'text'),
-                    'url': metadata.get('url', ''),
-                    'youtube_url': metadata.get('youtube_url', ''),
-                    'chunks': []
-                }
-            
-            contents[key]['chunks'].append({
-                'index': metadata.get('chunk_index', 0),
-                'content': all_data['documents'][i]
-            })
-        
-        print(f"  {len(contents)}件の教材が見つかりました。")
-        
-        # Supabaseに移行
-        print("2. Supabaseにデータを移行中...")
-        kb_new = KnowledgeBaseSupabase()
-        
-        success_count = 0
-        for key, data in contents.items():
-            # チャンクを結合して完全なコンテンツを復元
-            chunks = sorted(data['chunks'], key=lambda x: x['index'])
-            full_content = '\n'.join([c['content'] for c in chunks])
-            
-            print(f"  移行中: {data['title']}...")
-            
-            # Supabaseに追加
-            result = kb_new.add_document(
-                content=full_content,
-                title=data['title'],
-                url=data['url'] if data['url'] else None,
-                doc_type=data['doc_type'],
-                chapter=data['chapter'],
-                lesson=data['lesson'],
-                chapter_order=data['chapter_order'],
-                lesson_order=data['lesson_order'],
-                youtube_url=data['youtube_url'] if data['youtube_url'] else None
-            )
-            
-            if result:
-                success_count += 1
-                print(f"    ✅ 成功")
-            else:
-                print(f"    ❌ 失敗")
-        
-        print(f"\n移行完了: {success_count}/{len(contents)}件が成功しました。")
-        
-        # 統計情報を表示
-        stats = kb_new.get_stats()
-        print(f"\nSupabaseの統計:")
-        print(f"  コンテンツ数: {stats['total_contents']}")
-        print(f"  チャンク数: {stats['total_chunks']}")
-        
+        ok = migrate_data(args.chroma_path, args.collection, args.batch_rows, args.workers, args.sample)
     except Exception as e:
         print(f"エラーが発生しました: {str(e)}")
         import traceback
         traceback.print_exc()
-
-if __name__ == "__main__":
-    migrate_data()
\ No newline at end of file
+        ok = False
+    sys.exit(0 if ok else 1)
@@ -2,6 +2,7 @@ import streamlit as st
 import os
 from components.knowledge_base_supabase import KnowledgeBaseSupabase as KnowledgeBase
 from utils.auth import check_password
+from utils.ingest_jobs import get_ingest_queue, show_ingest_jobs
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -59,29 +60,31 @@ with tab1:
     with col1:
         if st.button("📤 追加", type="primary", use_container_width=True):
             if chapter and lesson and title and content:
-                with st.spinner("ナレッジベースに追加中..."):
-                    try:
-                        kb.add_document(
-                            content=content,
-                            title=title,
-                            url=url,
-                            doc_type=doc_type,
-                            chapter=chapter,
-                            lesson=lesson,
-                            chapter_order=chapter_order,
-                            lesson_order=lesson_order,
-                            youtube_url=youtube_url if doc_type == "video" else None
-                        )
-                        st.success(f"✅ {chapter} / {lesson} / {title} を追加しました！")
-                        st.balloons()
-                    except Exception as e:
-                        st.error(f"エラー: {str(e)}")
+                # embeddingの作成はバックグラウンドのワーカーで行う（画面を閉じても処理は続く）
+                try:
+                    job_id = get_ingest_queue().enqueue("add_document", {
+                        "content": content,
+                        "title": title,
+                        "url": url,
+                        "doc_type": doc_type,
+                        "chapter": chapter,
+                        "lesson": lesson,
+                        "chapter_order": chapter_order,
+                        "lesson_order": lesson_order,
+                        "youtube_url": youtube_url if doc_type == "video" else None
+                    }, label=f"追加: {chapter} / {lesson} / {title}")
+                    st.success(f"✅ {chapter} / {lesson} / {title} の追加を受け付けました（ジョブ #{job_id}）。進捗は下の一覧で確認できます。")
+                except Exception as e:
+                    st.error(f"エラー: {str(e)}")
             else:
                 st.warning("すべての必須項目を入力してください。")
     
     with col2:
         if st.button("🔄 フォームをクリア", use_container_width=True):
             st.rerun()
+    
+    st.subheader("📋 登録ジョブ")
+    show_ingest_jobs()
 
 with tab2:
     st.header("📂 登録済みの章とレッスン")
@@ -154,6 +157,21 @@ with tab3:
             avg_chunks = stats["total_chunks"] / stats["total_contents"]
             st.divider()
             st.info(f"💡 1コンテンツあたり平均 {avg_chunks:.1f} チャンクに分割されています")
+    
+    if stats.get("embedding_cache"):
+        cache_stats = stats["embedding_cache"]
+        st.divider()
+        st.subheader("⚡ Embeddingキャッシュ")
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("ヒット率", f"{cache_stats['hit_rate']:.1%}")
+        with col2:
+            st.metric("ヒット", cache_stats["memory_hits"] + cache_stats["disk_hits"],
+                      help=f"メモリ: {cache_stats['memory_hits']} / ディスク: {cache_stats['disk_hits']}")
+        with col3:
+            st.metric("ミス", cache_stats["misses"])
+        with col4:
+            st.metric("追い出し", cache_stats["memory_evictions"] + cache_stats["disk_evictions"])
 
 with tab4:
     st.header("⚙️ データ管理")
@@ -229,6 +247,18 @@ with tab4:
                     st.rerun()
                 except Exception as e:
                     st.error(f"エラー: {str(e)}")
+    
+    st.divider()
+    st.subheader("🔗 チャンク情報の再計算")
+    st.caption("トークン数・本文中のリンクが保存されていないチャンク（supabase_vector_index.sql 適用前に登録した教材）を計算して保存します。")
+    
+    if st.button("🔄 未計算のチャンクを更新"):
+        with st.spinner("更新中..."):
+            try:
+                updated = kb.backfill_chunk_metadata()
+                st.success(f"✅ {updated} チャンクを更新しました")
+            except Exception as e:
+                st.error(f"エラー: {str(e)}")
 
 st.sidebar.info("""
 **💡 使い方のヒント:**
@@ -2,6 +2,7 @@ import streamlit as st
 import os
 from components.knowledge_base_supabase import KnowledgeBaseSupabase as KnowledgeBase
 from utils.auth import check_password
+from utils.ingest_jobs import get_ingest_queue, show_ingest_jobs
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -29,6 +30,10 @@ if 'edit_mode' not in st.session_state:
 if 'selected_content' not in st.session_state:
     st.session_state.selected_content = None
 
+# 直前の保存結果（保存後の再実行で表示する）
+if st.session_state.get('last_update_message'):
+    st.success(st.session_state.pop('last_update_message'))
+
 # 章とレッスンの選択
 st.header("📂 コンテンツを選択")
 
@@ -150,25 +155,27 @@ if st.session_state.edit_mode and st.session_state.selected_content:
     with col1:
         if st.button("💾 保存", type="primary", use_container_width=True):
             if new_chapter and new_lesson and new_title and new_content:
-                with st.spinner("更新中..."):
-                    kb.update_content(
-                        old_chapter=st.session_state.selected_chapter,
-                        old_lesson=st.session_state.selected_lesson,
-                        old_title=content['title'],
-                        new_content=new_content,
-                        new_title=new_title,
-                        new_url=new_url,
-                        new_doc_type=new_doc_type,
-                        new_chapter=new_chapter,
-                        new_lesson=new_lesson,
-                        new_chapter_order=new_chapter_order,
-                        new_lesson_order=new_lesson_order,
-                        new_youtube_url=new_youtube_url if new_doc_type == "video" else None
-                    )
-                    st.success(f"✅ 「{new_title}」を更新しました！")
-                    st.session_state.edit_mode = False
-                    st.session_state.selected_content = None
-                    st.rerun()
+                # embeddingの作成はバックグラウンドのワーカーで行う（画面を閉じても処理は続く）
+                job_id = get_ingest_queue().enqueue("update_content", {
+                    "old_chapter": st.session_state.selected_chapter,
+                    "old_lesson": st.session_state.selected_lesson,
+                    "old_title": content['title'],
+                    "new_content": new_content,
+                    "new_title": new_title,
+                    "new_url": new_url,
+                    "new_doc_type": new_doc_type,
+                    "new_chapter": new_chapter,
+                    "new_lesson": new_lesson,
+                    "new_chapter_order": new_chapter_order,
+                    "new_lesson_order": new_lesson_order,
+                    "new_youtube_url": new_youtube_url if new_doc_type == "video" else None
+                }, label=f"更新: {new_chapter} / {new_lesson} / {new_title}")
+                st.session_state.last_update_message = (
+                    f"✅ 「{new_title}」の更新を受け付けました（ジョブ #{job_id}）。進捗は下の一覧で確認できます。"
+                )
+                st.session_state.edit_mode = False
+                st.session_state.selected_content = None
+                st.rerun()
             else:
                 st.warning("すべての必須項目を入力してください。")
     
@@ -178,6 +185,10 @@ if st.session_state.edit_mode and st.session_state.selected_content:
             st.session_state.selected_content = None
             st.rerun()
 
+st.divider()
+st.subheader("📋 登録ジョブ")
+show_ingest_jobs()
+
 st.sidebar.info("""
 **💡 使い方:**
 
@@ -188,5 +199,5 @@ st.sidebar.info("""
 
 **⚠️ 注意:**
 - 削除は取り消せません
-- 編集後は自動的に保存されます
+- 保存した内容はバックグラウンドで反映されます（進捗は「登録ジョブ」で確認できます）
 """)
\ No newline at end of file
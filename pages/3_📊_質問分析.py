@@ -106,6 +106,83 @@ with tab1:
         fig.update_traces(mode='lines+markers')
         st.plotly_chart(fig, use_container_width=True)
     
+    # プロンプトサイズ（回答生成時にLLMへ送った入力トークン数）
+    token_logs = [log for log in all_logs if log.get('metrics', {}).get('prompt_tokens')]
+    if token_logs:
+        st.divider()
+        st.subheader("🧮 プロンプトサイズ")
+        
+        token_df = pd.DataFrame([
+            {
+                'timestamp': pd.to_datetime(log['timestamp']),
+                'prompt_tokens': log['metrics']['prompt_tokens'],
+                'context_chunks': log['metrics'].get('context_chunks'),
+                'dropped_chunks': log['metrics'].get('dropped_chunks')
+            }
+            for log in token_logs
+        ])
+        
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("平均入力トークン", f"{token_df['prompt_tokens'].mean():.0f}")
+        with col2:
+            st.metric("95パーセンタイル", f"{token_df['prompt_tokens'].quantile(0.95):.0f}")
+        with col3:
+            st.metric("最大", f"{token_df['prompt_tokens'].max():.0f}")
+        with col4:
+            st.metric("予算超過で除いたチャンク", f"{token_df['dropped_chunks'].fillna(0).sum():.0f}",
+                      help="トークン予算（PROMPT_TOKEN_BUDGET）に収まらずプロンプトに入れなかった検索結果の数")
+        
+        fig = px.scatter(token_df, x='timestamp', y='prompt_tokens',
+                        title='リクエストごとの入力トークン数',
+                        labels={'timestamp': '日時', 'prompt_tokens': '入力トークン数'})
+        st.plotly_chart(fig, use_container_width=True)
+    
+    # 応答時間（最初の文字が表示されるまでと、回答が出そろうまで）
+    latency_logs = [log for log in all_logs if log.get('metrics', {}).get('first_token_ms')]
+    if latency_logs:
+        st.divider()
+        st.subheader("⏱️ 応答時間")
+        
+        latency_df = pd.DataFrame([
+            {
+                'timestamp': pd.to_datetime(log['timestamp']),
+                'retrieval_ms': log['metrics'].get('retrieval_ms'),
+                'first_token_ms': log['metrics']['first_token_ms'],
+                'total_ms': log['metrics'].get('total_ms'),
+                'queue_wait_ms': log['metrics'].get('queue_wait_ms')
+            }
+            for log in latency_logs
+        ])
+        
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("検索（中央値）", f"{latency_df['retrieval_ms'].median() / 1000:.2f}秒")
+        with col2:
+            st.metric("最初の文字まで（中央値）", f"{latency_df['first_token_ms'].median() / 1000:.2f}秒",
+                      help="質問を送信してから回答の最初の文字が表示されるまでの時間")
+        with col3:
+            st.metric("最初の文字まで（95パーセンタイル）", f"{latency_df['first_token_ms'].quantile(0.95) / 1000:.2f}秒")
+        with col4:
+            st.metric("回答完了まで（中央値）", f"{latency_df['total_ms'].median() / 1000:.2f}秒")
+        
+        # OpenAI APIの順番待ち（混み合っていた時間）
+        queue_waits = latency_df['queue_wait_ms'].dropna()
+        if not queue_waits.empty:
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("順番待ち（中央値）", f"{queue_waits.median() / 1000:.2f}秒")
+            with col2:
+                st.metric("順番待ち（95パーセンタイル）", f"{queue_waits.quantile(0.95) / 1000:.2f}秒",
+                          help="同時に処理できる数やレート制限を超えたため、回答の生成を待った時間")
+            with col3:
+                st.metric("順番待ちが発生した割合", f"{(queue_waits > 0).mean():.1%}")
+        
+        fig = px.scatter(latency_df, x='timestamp', y=['first_token_ms', 'total_ms'],
+                        title='リクエストごとの応答時間',
+                        labels={'timestamp': '日時', 'value': 'ミリ秒', 'variable': ''})
+        st.plotly_chart(fig, use_container_width=True)
+    
     st.divider()
     
     st.subheader("🕐 最近の質問（直近10件）")
@@ -122,6 +199,8 @@ with tab1:
                 with col2:
                     st.caption(f"📅 {log['timestamp'][:19]}")
                     st.caption(f"🏷️ {category}")
+                    if log.get('metrics', {}).get('prompt_tokens'):
+                        st.caption(f"🧮 {log['metrics']['prompt_tokens']} トークン")
     else:
         st.info("まだ質問がありません。")
 
@@ -60,26 +60,12 @@ with tab1:
                     new_orders[chapter_name] = new_order
             
             if st.form_submit_button("💾 章の順番を更新", type="primary"):
-                # 各章のコンテンツを更新
-                for chapter_name, new_order in new_orders.items():
-                    for lesson_name in chapters_data[chapter_name]['lessons']:
-                        contents = kb.get_content_by_chapter_lesson(chapter_name, lesson_name)
-                        for content in contents:
-                            kb.update_content(
-                                old_chapter=chapter_name,
-                                old_lesson=lesson_name,
-                                old_title=content['title'],
-                                new_content=content['content'],
-                                new_title=content['title'],
-                                new_url=content['url'],
-                                new_doc_type=content['doc_type'],
-                                new_chapter_order=new_order,
-                                new_lesson_order=content['lesson_order'],
-                                new_youtube_url=content.get('youtube_url')
-                            )
-                
-                st.success("✅ 章の順番を更新しました！")
-                st.rerun()
+                # 順番だけを一括更新（embeddingは作り直さない）
+                if kb.reorder_chapters(new_orders):
+                    st.success("✅ 章の順番を更新しました！")
+                    st.rerun()
+                else:
+                    st.error("章の順番の更新に失敗しました。")
     else:
         st.info("章が登録されていません。")
 
@@ -130,25 +116,12 @@ with tab2:
                             st.caption(f"(名前から抽出: {match.group(1)})")
                 
                 if st.form_submit_button("💾 レッスンの順番を更新", type="primary"):
-                    # 各レッスンのコンテンツを更新
-                    for lesson_name, new_order in new_lesson_orders.items():
-                        contents = kb.get_content_by_chapter_lesson(selected_chapter, lesson_name)
-                        for content in contents:
-                            kb.update_content(
-                                old_chapter=selected_chapter,
-                                old_lesson=lesson_name,
-                                old_title=content['title'],
-                                new_content=content['content'],
-                                new_title=content['title'],
-                                new_url=content['url'],
-                                new_doc_type=content['doc_type'],
-                                new_chapter_order=chapters_data[selected_chapter]['order'],
-                                new_lesson_order=new_order,
-                                new_youtube_url=content.get('youtube_url')
-                            )
-                    
-                    st.success(f"✅ {selected_chapter}のレッスン順番を更新しました！")
-                    st.rerun()
+                    # 順番だけを一括更新（embeddingは作り直さない）
+                    if kb.reorder_lessons(selected_chapter, new_lesson_orders):
+                        st.success(f"✅ {selected_chapter}のレッスン順番を更新しました！")
+                        st.rerun()
+                    else:
+                        st.error("レッスンの順番の更新に失敗しました。")
         else:
             st.info("この章にはレッスンがありません。")
 
@@ -180,50 +153,31 @@ with tab3:
         if st.button("📖 章の順番を1から振り直す"):
             sorted_chapters = sorted(chapters_data.items(), key=lambda x: x[1]['order'])
             
-            for i, (chapter_name, chapter_info) in enumerate(sorted_chapters, 1):
-                for lesson_name in chapter_info['lessons']:
-                    contents = kb.get_content_by_chapter_lesson(chapter_name, lesson_name)
-                    for content in contents:
-                        kb.update_content(
-                            old_chapter=chapter_name,
-                            old_lesson=lesson_name,
-                            old_title=content['title'],
-                            new_content=content['content'],
-                            new_title=content['title'],
-                            new_url=content['url'],
-                            new_doc_type=content['doc_type'],
-                            new_chapter_order=i,
-                            new_lesson_order=content['lesson_order']
-                        )
-            
-            st.success("✅ 章の順番を1から振り直しました！")
-            st.rerun()
+            if kb.reorder_chapters({chapter_name: i for i, (chapter_name, _) in enumerate(sorted_chapters, 1)}):
+                st.success("✅ 章の順番を1から振り直しました！")
+                st.rerun()
+            else:
+                st.error("章の順番の更新に失敗しました。")
     
     with col2:
         if st.button("📝 全レッスンの順番を名前から自動設定"):
+            succeeded = True
             for chapter_name, chapter_info in chapters_data.items():
+                # レッスン名から順番を抽出し、変わるレッスンだけを章ごとに一括更新
+                new_lesson_orders = {}
                 for lesson_name, lesson_info in chapter_info['lessons'].items():
-                    # レッスン名から順番を抽出
                     match = re.search(r'順番:\s*(\d+)', lesson_name)
-                    new_order = int(match.group(1)) if match else lesson_info['order']
-                    
-                    contents = kb.get_content_by_chapter_lesson(chapter_name, lesson_name)
-                    for content in contents:
-                        kb.update_content(
-                            old_chapter=chapter_name,
-                            old_lesson=lesson_name,
-                            old_title=content['title'],
-                            new_content=content['content'],
-                            new_title=content['title'],
-                            new_url=content['url'],
-                            new_doc_type=content['doc_type'],
-                            new_chapter_order=chapter_info['order'],
-                            new_lesson_order=new_order,
-                            new_youtube_url=content.get('youtube_url')
-                        )
+                    if match and int(match.group(1)) != lesson_info['order']:
+                        new_lesson_orders[lesson_name] = int(match.group(1))
+                
+                if new_lesson_orders:
+                    succeeded = kb.reorder_lessons(chapter_name, new_lesson_orders) and succeeded
             
-            st.success("✅ レッスン名から順番を自動設定しました！")
-            st.rerun()
+            if succeeded:
+                st.success("✅ レッスン名から順番を自動設定しました！")
+                st.rerun()
+            else:
+                st.error("一部のレッスンの順番の更新に失敗しました。")
 
 st.sidebar.info("""
 **💡 順番管理のヒント:**
@@ -1,8 +1,10 @@
 import streamlit as st
+import codecs
 import json
 import os
 from datetime import datetime
 from components.knowledge_base_supabase import KnowledgeBaseSupabase as KnowledgeBase
+from components.bulk_importer import BulkImporter, iter_json_array
 from utils.auth import check_password
 from dotenv import load_dotenv
 import pandas as pd
@@ -26,6 +28,9 @@ def init_knowledge_base():
 
 kb = init_knowledge_base()
 
+# インポート前に表示する教材数
+PREVIEW_ROWS = 20
+
 tab1, tab2 = st.tabs(["📤 エクスポート", "📥 インポート"])
 
 with tab1:
@@ -103,53 +108,88 @@ with tab1:
 
 with tab2:
     st.header("データインポート")
-    st.warning("⚠️ インポートすると既存のデータは全て削除されます。")
+    
+    import_mode = st.radio(
+        "インポート方法",
+        ["staged", "replace"],
+        format_func=lambda x: {
+            "staged": "新しい教材を組み立ててから切り替え（推奨）",
+            "replace": "既存の教材に上書き"
+        }[x],
+        help="切り替え方式では、取り込みが完了するまでチャットは以前の教材で回答し続けます（supabase_content_functions.sql が必要です）。"
+    )
+    st.warning("⚠️ インポートが完了すると、ファイルに含まれていない既存の教材は全て削除されます。")
     
     uploaded_file = st.file_uploader("JSONファイルを選択", type=['json'])
     
     if uploaded_file is not None:
         try:
-            # JSONファイルを読み込み
-            json_data = json.loads(uploaded_file.read())
+            importer = BulkImporter(
+                kb,
+                checkpoint_dir=os.getenv("IMPORT_CHECKPOINT_DIR", "./import_checkpoints"),
+                batch_size=int(os.getenv("IMPORT_BATCH_SIZE", "50")),
+                staged=import_mode == "staged"
+            )
+            
+            # 全体を読み込まずに件数と先頭の数件だけを確認
+            preview, total = [], 0
+            for item in iter_json_array(codecs.getreader("utf-8-sig")(uploaded_file)):
+                if len(preview) < PREVIEW_ROWS:
+                    preview.append(item)
+                total += 1
+            uploaded_file.seek(0)
             
             # データプレビュー
-            st.write(f"📊 {len(json_data)}件の教材データが見つかりました。")
+            st.write(f"📊 {total}件の教材データが見つかりました。")
             
             # データフレームで表示
-            df_preview = pd.DataFrame(json_data)[['chapter', 'lesson', 'title', 'doc_type']]
+            df_preview = pd.DataFrame(preview).reindex(columns=['chapter', 'lesson', 'title', 'doc_type'])
             st.dataframe(df_preview)
+            if total > PREVIEW_ROWS:
+                st.caption(f"先頭の{PREVIEW_ROWS}件を表示しています。")
+            
+            checkpoint = importer.load_checkpoint(uploaded_file)
+            if checkpoint:
+                st.info(f"🔁 このファイルのインポートが {checkpoint['done']}/{total}件 で中断されています。実行すると続きから再開します。")
+                if st.button("🗑️ 中断したインポートを破棄して最初から"):
+                    importer.discard_checkpoint(uploaded_file)
+                    st.rerun()
             
             if st.button("📥 インポート実行", type="primary"):
-                with st.spinner("インポート中..."):
-                    # 既存データをクリア
-                    kb.clear_all()
-                    
-                    # 新しいデータを追加
-                    success_count = 0
-                    for item in json_data:
-                        try:
-                            kb.add_document(
-                                content=item['content'],
-                                title=item['title'],
-                                url=item.get('url', ''),
-                                doc_type=item.get('doc_type', 'text'),
-                                chapter=item.get('chapter', ''),
-                                lesson=item.get('lesson', ''),
-                                chapter_order=item.get('chapter_order', 0),
-                                lesson_order=item.get('lesson_order', 0),
-                                youtube_url=item.get('youtube_url', '')
-                            )
-                            success_count += 1
-                        except Exception as e:
-                            st.error(f"エラー: {item['title']} - {str(e)}")
-                    
-                    st.success(f"✅ {success_count}/{len(json_data)}件の教材をインポートしました。")
-                    st.balloons()
+                progress_bar = st.progress(0.0, text="インポート中...")
+                
+                def show_progress(status):
+                    progress_bar.progress(min(status['done'] / max(total, 1), 1.0),
+                                          text=f"インポート中... {status['done']}/{total}件")
+                
+                result = importer.run(uploaded_file, progress=show_progress)
+                progress_bar.progress(1.0, text="完了")
+                
+                st.success(f"✅ {result['items']}/{total}件の教材をインポートしました（{result['seconds']:.1f}秒）。")
+                if result['resumed_from']:
+                    st.caption(f"前回までの{result['resumed_from']}件に続けて取り込みました。")
+                if result['deleted']:
+                    st.caption(f"ファイルに含まれていない教材を{result['deleted']}件削除しました。")
+                for error in result['errors']:
+                    st.error(f"エラー: {error['index'] + 1}件目 {error['title']} - {error['error']}")
+                
+                # 工程ごとの処理速度
+                st.dataframe(pd.DataFrame([
+                    {
+                        "工程": name,
+                        "秒": stage['seconds'],
+                        "教材/秒": stage['items_per_sec'],
+                        "チャンク/秒": stage['chunks_per_sec']
+                    }
+                    for name, stage in result['stages'].items()
+                ]))
+                st.balloons()
                     
         except json.JSONDecodeError:
             st.error("無効なJSONファイルです。")
         except Exception as e:
             st.error(f"インポート中にエラーが発生しました: {str(e)}")
+            st.info("同じファイルでもう一度実行すると、書き込みが完了した所から再開します。")
 
 st.sidebar.info("""
 **💡 使い方:**
@@ -160,7 +200,8 @@ st.sidebar.info("""
 
 **インポート:**
 1. JSONファイルから教材データを復元
-2. **注意**: 既存データは全て削除されます
+2. **注意**: ファイルにない既存データは全て削除されます
+3. 途中で止まった場合は、同じファイルで再実行すると続きから再開します
 
 **推奨ワークフロー:**
 1. ローカルで教材を登録
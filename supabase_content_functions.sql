@@ -0,0 +1,274 @@
+-- 教材の保存・メタデータの一括更新を行うRPC関数
+-- supabase_setup.sql と supabase_vector_index.sql の実行後に SQL Editor で実行してください
+
+-- 並び順（chapter_order / lesson_order）だけの変更では updated_at を変えない
+-- updated_at はローカル索引の差分同期と回答キャッシュの無効化に使うため、検索結果に関係しない変更で進めると
+-- 並べ替えのたびに全教材のembeddingsを取り直すことになる
+CREATE OR REPLACE FUNCTION update_updated_at_column()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.updated_at IS NOT DISTINCT FROM OLD.updated_at
+       AND to_jsonb(NEW) - ARRAY['chapter_order', 'lesson_order']
+           = to_jsonb(OLD) - ARRAY['chapter_order', 'lesson_order'] THEN
+        RETURN NEW;
+    END IF;
+    NEW.updated_at = TIMEZONE('utc', NOW());
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 章の表示順を一括で変更
+-- orders: {"章の名前": 順番, ...}
+-- 戻り値: 順番が変わった contents の行数
+CREATE OR REPLACE FUNCTION reorder_chapters(orders jsonb)
+RETURNS integer
+LANGUAGE sql
+AS $$
+  WITH updated AS (
+    UPDATE contents c
+    SET chapter_order = o.value::int
+    FROM jsonb_each_text(orders) AS o(key, value)
+    WHERE c.chapter = o.key
+      AND c.chapter_order IS DISTINCT FROM o.value::int
+    RETURNING 1
+  )
+  SELECT count(*)::int FROM updated;
+$$;
+
+-- 章の中のレッスンの表示順を一括で変更
+-- orders: {"レッスンの名前": 順番, ...}
+-- 戻り値: 順番が変わった contents の行数
+CREATE OR REPLACE FUNCTION reorder_lessons(target_chapter text, orders jsonb)
+RETURNS integer
+LANGUAGE sql
+AS $$
+  WITH updated AS (
+    UPDATE contents c
+    SET lesson_order = o.value::int
+    FROM jsonb_each_text(orders) AS o(key, value)
+    WHERE c.chapter = target_chapter
+      AND c.lesson = o.key
+      AND c.lesson_order IS DISTINCT FROM o.value::int
+    RETURNING 1
+  )
+  SELECT count(*)::int FROM updated;
+$$;
+
+-- 段階的インポート（データ管理ページ）で新しい教材を組み立てるテーブル
+-- supabase_vector_index.sql で content_embeddings に追加した列も引き継ぐ
+CREATE TABLE IF NOT EXISTS contents_staging (
+    LIKE contents INCLUDING DEFAULTS INCLUDING INDEXES
+);
+
+CREATE TABLE IF NOT EXISTS content_embeddings_staging (
+    LIKE content_embeddings INCLUDING DEFAULTS,
+    PRIMARY KEY (id),
+    UNIQUE (content_id, chunk_index),
+    FOREIGN KEY (content_id) REFERENCES contents_staging(id) ON DELETE CASCADE
+);
+
+-- *_staging テーブルを使っているインポート（1行だけ）
+-- *_staging は1組しかないため、別のインポートが始まると前のインポートの組み立て途中の教材は消える。
+-- チェックポイントから再開するときと入れ替えるときに、まだ自分のインポートのものかを確認する
+CREATE TABLE IF NOT EXISTS staging_import (
+    singleton boolean PRIMARY KEY DEFAULT true CHECK (singleton),
+    import_id text NOT NULL,
+    started_at timestamptz NOT NULL DEFAULT TIMEZONE('utc', NOW())
+);
+
+-- *_staging を空にして、新しいインポートの組み立てを始める
+CREATE OR REPLACE FUNCTION begin_staged_import(new_import text)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  -- 同時に始めたインポートや入れ替えとは順番に実行する
+  LOCK TABLE staging_import IN EXCLUSIVE MODE;
+  -- content_embeddings_staging はカスケードで削除される
+  DELETE FROM contents_staging WHERE true;
+  INSERT INTO staging_import (singleton, import_id) VALUES (true, new_import)
+  ON CONFLICT (singleton) DO UPDATE SET import_id = EXCLUDED.import_id, started_at = EXCLUDED.started_at;
+END;
+$$;
+
+-- *_staging を使っているインポートのidと組み立て済みの教材数
+CREATE OR REPLACE FUNCTION staged_import_status()
+RETURNS TABLE (import_id text, staged_contents integer)
+LANGUAGE sql
+AS $$
+  SELECT (SELECT s.import_id FROM staging_import s), (SELECT count(*)::int FROM contents_staging);
+$$;
+
+-- 組み立てた教材を1回のトランザクションで公開中のテーブルと入れ替える
+-- 入れ替えが完了するまで検索は以前の教材を参照し、失敗した場合は何も変わらない
+-- expected_import: 入れ替えるインポートのid（*_staging が別のインポートのものになっていたら入れ替えない）
+-- expected_contents: 組み立てたはずの教材数（*_staging の教材数と違えば入れ替えない）
+-- 戻り値: 入れ替えた教材数
+DROP FUNCTION IF EXISTS swap_staged_contents();
+CREATE OR REPLACE FUNCTION swap_staged_contents(expected_import text DEFAULT NULL, expected_contents integer DEFAULT NULL)
+RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  content_columns text;
+  embedding_columns text;
+  owner text;
+  staged integer;
+  swapped integer;
+BEGIN
+  -- 入れ替え中に別のインポートが *_staging を空にしないようにする
+  LOCK TABLE staging_import IN EXCLUSIVE MODE;
+  SELECT s.import_id INTO owner FROM staging_import s;
+  IF expected_import IS NOT NULL AND owner IS DISTINCT FROM expected_import THEN
+    RAISE EXCEPTION 'staging tables belong to another import (%)', owner;
+  END IF;
+
+  SELECT count(*)::int INTO staged FROM contents_staging;
+  IF staged = 0 THEN
+    RAISE EXCEPTION 'contents_staging is empty';
+  END IF;
+  IF expected_contents IS NOT NULL AND staged <> expected_contents THEN
+    RAISE EXCEPTION 'contents_staging has % contents, expected %', staged, expected_contents;
+  END IF;
+
+  -- 両方のテーブルにある列だけを移す（後から追加した列の順番の違いに影響されない）
+  SELECT string_agg(quote_ident(s.column_name), ', ') INTO content_columns
+  FROM information_schema.columns s
+  JOIN information_schema.columns l
+    ON l.table_schema = s.table_schema AND l.table_name = 'contents' AND l.column_name = s.column_name
+  WHERE s.table_schema = 'public' AND s.table_name = 'contents_staging';
+
+  SELECT string_agg(quote_ident(s.column_name), ', ') INTO embedding_columns
+  FROM information_schema.columns s
+  JOIN information_schema.columns l
+    ON l.table_schema = s.table_schema AND l.table_name = 'content_embeddings' AND l.column_name = s.column_name
+  WHERE s.table_schema = 'public' AND s.table_name = 'content_embeddings_staging';
+
+  -- content_embeddings はカスケードで削除される
+  DELETE FROM contents WHERE true;
+  EXECUTE format('INSERT INTO contents (%s) SELECT %s FROM contents_staging', content_columns, content_columns);
+  GET DIAGNOSTICS swapped = ROW_COUNT;
+  EXECUTE format('INSERT INTO content_embeddings (%s) SELECT %s FROM content_embeddings_staging',
+                 embedding_columns, embedding_columns);
+
+  DELETE FROM contents_staging WHERE true;
+  DELETE FROM staging_import WHERE true;
+  RETURN swapped;
+END;
+$$;
+
+-- 教材とチャンクを1回のトランザクションで保存する（add_document / update_content / 一括インポート）
+-- documents: [{"content": {contents の列}, "content_id": 更新する教材のid または null, "chunks": [...]}, ...]
+--   content_id が null の場合は (chapter, lesson, title) で upsert し、指定した場合は content に含まれる列だけを更新する
+--   chunks は chunk_index 順で、残す行は {"id", "chunk_index"}、新しい行は
+--   {"chunk_index", "chunk_text", "embedding", "token_count", "links", "chunk_hash"}
+--   chunks に含まれない既存の行は削除する
+-- staged: true の場合は段階的インポート用の *_staging テーブルに保存する
+-- 戻り値: documents の順の教材のid
+CREATE OR REPLACE FUNCTION save_contents(documents jsonb, staged boolean DEFAULT false)
+RETURNS TABLE (content_id uuid)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  contents_table text := CASE WHEN staged THEN 'contents_staging' ELSE 'contents' END;
+  embeddings_table text := CASE WHEN staged THEN 'content_embeddings_staging' ELSE 'content_embeddings' END;
+  doc jsonb;
+  target_id uuid;
+  updated integer;
+  changed_chunks integer;
+BEGIN
+  FOR doc IN SELECT value FROM jsonb_array_elements(documents) LOOP
+    target_id := NULLIF(doc->>'content_id', '')::uuid;
+
+    IF target_id IS NULL THEN
+      EXECUTE format($sql$
+        INSERT INTO %1$I (chapter, chapter_order, lesson, lesson_order, title, content, doc_type, url, youtube_url)
+        VALUES (
+          COALESCE($1->>'chapter', ''), COALESCE(($1->>'chapter_order')::int, 0),
+          COALESCE($1->>'lesson', ''), COALESCE(($1->>'lesson_order')::int, 0),
+          $1->>'title', $1->>'content', COALESCE($1->>'doc_type', 'text'), $1->>'url', $1->>'youtube_url'
+        )
+        ON CONFLICT (chapter, lesson, title) DO UPDATE SET
+          chapter_order = EXCLUDED.chapter_order,
+          lesson_order = EXCLUDED.lesson_order,
+          content = EXCLUDED.content,
+          doc_type = EXCLUDED.doc_type,
+          url = EXCLUDED.url,
+          youtube_url = EXCLUDED.youtube_url
+        RETURNING id
+      $sql$, contents_table) INTO target_id USING doc->'content';
+    ELSE
+      EXECUTE format($sql$
+        UPDATE %1$I c SET
+          chapter = CASE WHEN $2 ? 'chapter' THEN $2->>'chapter' ELSE c.chapter END,
+          chapter_order = CASE WHEN $2 ? 'chapter_order' THEN ($2->>'chapter_order')::int ELSE c.chapter_order END,
+          lesson = CASE WHEN $2 ? 'lesson' THEN $2->>'lesson' ELSE c.lesson END,
+          lesson_order = CASE WHEN $2 ? 'lesson_order' THEN ($2->>'lesson_order')::int ELSE c.lesson_order END,
+          title = CASE WHEN $2 ? 'title' THEN $2->>'title' ELSE c.title END,
+          content = CASE WHEN $2 ? 'content' THEN $2->>'content' ELSE c.content END,
+          doc_type = CASE WHEN $2 ? 'doc_type' THEN $2->>'doc_type' ELSE c.doc_type END,
+          url = CASE WHEN $2 ? 'url' THEN $2->>'url' ELSE c.url END,
+          youtube_url = CASE WHEN $2 ? 'youtube_url' THEN $2->>'youtube_url' ELSE c.youtube_url END
+        WHERE c.id = $1
+      $sql$, contents_table) USING target_id, doc->'content';
+      -- EXECUTE は FOUND を更新しないため行数で確認する
+      GET DIAGNOSTICS updated = ROW_COUNT;
+      IF updated = 0 THEN
+        RAISE EXCEPTION 'content % not found', target_id;
+      END IF;
+    END IF;
+
+    -- chunks に含まれない既存の行を削除
+    EXECUTE format($sql$
+      DELETE FROM %1$I e
+      WHERE e.content_id = $1
+        AND e.id NOT IN (
+          SELECT (c->>'id')::uuid FROM jsonb_array_elements($2) c WHERE c ? 'id'
+        )
+    $sql$, embeddings_table) USING target_id, doc->'chunks';
+    GET DIAGNOSTICS changed_chunks = ROW_COUNT;
+
+    -- 残す行の chunk_index を振り直す（(content_id, chunk_index) は一意なので、いったん負の番号に退避する）
+    EXECUTE format($sql$
+      UPDATE %1$I e SET chunk_index = -1 - (c->>'chunk_index')::int
+      FROM jsonb_array_elements($2) c
+      WHERE c ? 'id'
+        AND e.id = (c->>'id')::uuid
+        AND e.content_id = $1
+        AND e.chunk_index <> (c->>'chunk_index')::int
+    $sql$, embeddings_table) USING target_id, doc->'chunks';
+    EXECUTE format($sql$
+      UPDATE %1$I SET chunk_index = -1 - chunk_index
+      WHERE content_id = $1 AND chunk_index < 0
+    $sql$, embeddings_table) USING target_id;
+
+    -- 新しい行を挿入
+    EXECUTE format($sql$
+      INSERT INTO %1$I (content_id, chunk_index, chunk_text, embedding, token_count, links, chunk_hash)
+      SELECT
+        $1,
+        (c->>'chunk_index')::int,
+        c->>'chunk_text',
+        (c->>'embedding')::vector(1536),
+        (c->>'token_count')::int,
+        c->'links',
+        c->>'chunk_hash'
+      FROM jsonb_array_elements($2) c
+      WHERE NOT c ? 'id'
+    $sql$, embeddings_table) USING target_id, doc->'chunks';
+    GET DIAGNOSTICS updated = ROW_COUNT;
+    changed_chunks := changed_chunks + updated;
+
+    -- チャンクを削除・追加した場合は updated_at を進める（ローカル索引の差分同期と回答キャッシュの無効化に使う）
+    -- contents の列が変わらない保存（チャンクの分割方法を変えて保存し直した場合など）ではトリガーが updated_at を進めないため、ここで明示的に更新する
+    IF changed_chunks > 0 THEN
+      EXECUTE format($sql$
+        UPDATE %1$I SET updated_at = TIMEZONE('utc', NOW()) WHERE id = $1
+      $sql$, contents_table) USING target_id;
+    END IF;
+
+    content_id := target_id;
+    RETURN NEXT;
+  END LOOP;
+END;
+$$;
@@ -27,6 +27,9 @@ CREATE TABLE IF NOT EXISTS content_embeddings (
     chunk_index INTEGER NOT NULL,
     chunk_text TEXT NOT NULL,
     embedding vector(1536), -- OpenAI embedding dimension
+    token_count INTEGER, -- chunk_text のトークン数（プロンプトの予算計算用）
+    links JSONB, -- chunk_text 中のURL（[{"type": "youtube" | "resource", "url": ...}]）
+    chunk_hash TEXT, -- chunk_text のSHA-256（更新時に変わっていないチャンクを判定する）
     created_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc', NOW()),
     
     -- インデックス
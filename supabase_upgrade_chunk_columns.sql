@@ -0,0 +1,13 @@
+-- 【既存データベース用のアップグレード】content_embeddings にチャンク単位の列を追加するマイグレーション
+-- supabase_setup.sql で新しく作成したデータベースには列が含まれているため、実行は不要です
+-- 以前の supabase_setup.sql で作成したデータベースでは、supabase_vector_index.sql / supabase_content_functions.sql より先に
+-- SQL Editor で実行してください（何度実行しても安全です）
+
+-- チャンクのトークン数（登録時に計算し、プロンプトに詰めるときに使う）
+ALTER TABLE content_embeddings ADD COLUMN IF NOT EXISTS token_count INTEGER;
+
+-- チャンク本文中のURL（登録時に抽出し、検索結果に含めて返す）
+ALTER TABLE content_embeddings ADD COLUMN IF NOT EXISTS links JSONB;
+
+-- チャンク本文のSHA-256（教材の更新時に本文が変わっていないチャンクのembeddingを使い回す）
+ALTER TABLE content_embeddings ADD COLUMN IF NOT EXISTS chunk_hash TEXT;
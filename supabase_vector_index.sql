@@ -0,0 +1,190 @@
+-- ベクトル検索の高速化マイグレーション（HNSWインデックス + フィルタ付き検索RPC）
+-- supabase_setup.sql と supabase_search_function.sql の実行後に SQL Editor で実行してください
+-- （以前の supabase_setup.sql で作成したデータベースでは、先に supabase_upgrade_chunk_columns.sql を実行してください）
+-- HNSWインデックスには pgvector 0.5.0 以上が必要です
+
+-- content_embeddings.embedding のHNSWインデックス（コサイン距離）
+-- match_documents / match_documents_filtered の ORDER BY embedding <=> query_embedding で使用される
+CREATE INDEX IF NOT EXISTS idx_content_embeddings_embedding_hnsw
+    ON content_embeddings
+    USING hnsw (embedding vector_cosine_ops)
+    WITH (m = 16, ef_construction = 64);
+
+-- フィルタ条件用のインデックス
+CREATE INDEX IF NOT EXISTS idx_contents_doc_type
+    ON contents(doc_type);
+
+-- 章・レッスン・種別で絞り込めるベクトル検索
+-- ef_search: HNSW探索時の候補数（大きいほど再現率が上がり、遅くなる）
+-- min_similarity: この類似度未満の結果は返さない（NULLの場合は制限なし）
+-- 絞り込みはHNSWの探索で見つかった ef_search 件の候補に対して行われるため、条件に合うチャンクが候補に少ないと
+-- match_count 件に届かない。絞り込む場合は pgvector 0.8.0 以上なら条件に合う件数がそろうまで探索を続け
+-- （hnsw.iterative_scan）、それより古い場合は条件に合うチャンクだけの距離を計算して並べる（インデックスを使わない正確な検索）
+-- 戻り値の列を変更した場合は CREATE OR REPLACE できないため先に削除する
+DROP FUNCTION IF EXISTS match_documents_batch(jsonb, int, text, text, text, float, int);
+DROP FUNCTION IF EXISTS match_documents_filtered(vector, int, text, text, text, float, int);
+CREATE OR REPLACE FUNCTION match_documents_filtered(
+  query_embedding vector(1536),
+  match_count int DEFAULT 5,
+  filter_chapter text DEFAULT NULL,
+  filter_lesson text DEFAULT NULL,
+  filter_doc_type text DEFAULT NULL,
+  min_similarity float DEFAULT NULL,
+  ef_search int DEFAULT 40
+)
+RETURNS TABLE (
+  content_id uuid,
+  chunk_index int,
+  chunk_text text,
+  title text,
+  url text,
+  youtube_url text,
+  chapter text,
+  lesson text,
+  doc_type text,
+  token_count int,
+  links jsonb,
+  similarity float
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  filtered boolean := filter_chapter IS NOT NULL OR filter_lesson IS NOT NULL OR filter_doc_type IS NOT NULL;
+  iterative boolean;
+BEGIN
+  -- ef_search は match_count 以上でないと結果が欠けるため切り上げる
+  -- set_config の第3引数 true でこのトランザクション内のみ有効
+  PERFORM set_config('hnsw.ef_search', GREATEST(ef_search, match_count)::text, true);
+
+  SELECT string_to_array(x.extversion, '.')::int[] >= ARRAY[0, 8] INTO iterative
+  FROM pg_extension x WHERE x.extname = 'vector';
+
+  IF filtered AND NOT COALESCE(iterative, false) THEN
+    -- 条件に合うチャンクの距離を全て計算する（MATERIALIZED のCTEの列で並べるためHNSWインデックスは使われない）
+    RETURN QUERY
+    WITH candidates AS MATERIALIZED (
+      SELECT
+        e.content_id,
+        e.chunk_index,
+        e.chunk_text,
+        c.title,
+        c.url,
+        c.youtube_url,
+        c.chapter,
+        c.lesson,
+        c.doc_type,
+        e.token_count,
+        e.links,
+        e.embedding <=> query_embedding AS distance
+      FROM content_embeddings e
+      JOIN contents c ON e.content_id = c.id
+      WHERE (filter_chapter IS NULL OR c.chapter = filter_chapter)
+        AND (filter_lesson IS NULL OR c.lesson = filter_lesson)
+        AND (filter_doc_type IS NULL OR c.doc_type = filter_doc_type)
+    )
+    SELECT
+      m.content_id, m.chunk_index, m.chunk_text, m.title, m.url, m.youtube_url,
+      m.chapter, m.lesson, m.doc_type, m.token_count, m.links,
+      1 - m.distance AS similarity
+    FROM candidates m
+    WHERE min_similarity IS NULL OR 1 - m.distance >= min_similarity
+    ORDER BY m.distance
+    LIMIT match_count;
+    RETURN;
+  END IF;
+
+  IF filtered THEN
+    -- 条件に合う match_count 件がそろうまでHNSWの探索を続ける（候補の順序は厳密でなくなるため最後に並べ直す）
+    PERFORM set_config('hnsw.iterative_scan', 'relaxed_order', true);
+  END IF;
+
+  RETURN QUERY
+  WITH nearest AS MATERIALIZED (
+    SELECT
+      e.content_id,
+      e.chunk_index,
+      e.chunk_text,
+      c.title,
+      c.url,
+      c.youtube_url,
+      c.chapter,
+      c.lesson,
+      c.doc_type,
+      e.token_count,
+      e.links,
+      e.embedding <=> query_embedding AS distance
+    FROM content_embeddings e
+    JOIN contents c ON e.content_id = c.id
+    WHERE (filter_chapter IS NULL OR c.chapter = filter_chapter)
+      AND (filter_lesson IS NULL OR c.lesson = filter_lesson)
+      AND (filter_doc_type IS NULL OR c.doc_type = filter_doc_type)
+      AND (min_similarity IS NULL OR 1 - (e.embedding <=> query_embedding) >= min_similarity)
+    ORDER BY e.embedding <=> query_embedding
+    LIMIT match_count
+  )
+  SELECT
+    m.content_id, m.chunk_index, m.chunk_text, m.title, m.url, m.youtube_url,
+    m.chapter, m.lesson, m.doc_type, m.token_count, m.links,
+    1 - m.distance AS similarity
+  FROM nearest m
+  ORDER BY m.distance;
+END;
+$$;
+
+-- 複数クエリをまとめて検索（KnowledgeBaseSupabase.search_many 用）
+-- query_embeddings: embeddingのJSON配列（[[0.1, ...], [0.2, ...]]）
+-- query_index は query_embeddings 内の0始まりの位置
+-- クエリごとに match_documents_filtered で検索する（絞り込み時の探索方法も同じ）
+CREATE OR REPLACE FUNCTION match_documents_batch(
+  query_embeddings jsonb,
+  match_count int DEFAULT 5,
+  filter_chapter text DEFAULT NULL,
+  filter_lesson text DEFAULT NULL,
+  filter_doc_type text DEFAULT NULL,
+  min_similarity float DEFAULT NULL,
+  ef_search int DEFAULT 40
+)
+RETURNS TABLE (
+  query_index int,
+  content_id uuid,
+  chunk_index int,
+  chunk_text text,
+  title text,
+  url text,
+  youtube_url text,
+  chapter text,
+  lesson text,
+  doc_type text,
+  token_count int,
+  links jsonb,
+  similarity float
+)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  RETURN QUERY
+  WITH queries AS (
+    SELECT (q.position - 1)::int AS position, q.value::vector(1536) AS embedding
+    FROM jsonb_array_elements_text(query_embeddings) WITH ORDINALITY AS q(value, position)
+  )
+  SELECT
+    queries.position,
+    m.content_id,
+    m.chunk_index,
+    m.chunk_text,
+    m.title,
+    m.url,
+    m.youtube_url,
+    m.chapter,
+    m.lesson,
+    m.doc_type,
+    m.token_count,
+    m.links,
+    m.similarity
+  FROM queries
+  CROSS JOIN LATERAL match_documents_filtered(
+    queries.embedding, match_count, filter_chapter, filter_lesson, filter_doc_type, min_similarity, ef_search
+  ) m
+  ORDER BY queries.position, m.similarity DESC;
+END;
+$$;
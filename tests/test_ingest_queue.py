@@ -0,0 +1,135 @@
+"""
+教材登録ジョブのキュー（components/ingest_queue.py）の状態遷移のテスト
+
+実行:
+    python -m pytest tests/test_ingest_queue.py
+"""
+import os
+
+import pytest
+
+from components.ingest_queue import DEAD, QUEUED, RUNNING, SUCCEEDED, IngestQueue
+
+
+class Clock:
+    """time.time の代わりに進める時計"""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr("components.ingest_queue.time.time", clock)
+    return clock
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    return IngestQueue(os.path.join(tmp_path, "ingest_queue.sqlite3"), max_attempts=3, retry_backoff=10.0)
+
+
+def test_claim_takes_jobs_in_order_once(queue):
+    first = queue.enqueue("add_document", {"title": "a"}, label="a")
+    second = queue.enqueue("update_content", {"content_id": "x"})
+
+    job = queue.claim()
+    assert (job["id"], job["status"], job["attempts"], job["payload"]) == (first, RUNNING, 1, {"title": "a"})
+    assert queue.claim()["id"] == second
+    assert queue.claim() is None
+
+
+def test_enqueue_rejects_unknown_kind(queue):
+    with pytest.raises(ValueError):
+        queue.enqueue("delete_everything", {})
+
+
+def test_fail_retries_after_exponential_backoff(queue, clock):
+    job_id = queue.enqueue("add_document", {"title": "a"})
+
+    job = queue.claim()
+    assert queue.fail(job_id, job["claim_token"], "timeout")
+    assert queue.get(job_id)["status"] == QUEUED
+    assert queue.get(job_id)["error"] == "timeout"
+
+    # 1回目の失敗は retry_backoff 秒、2回目はその2倍待つ
+    clock.now += 9
+    assert queue.claim() is None
+    clock.now += 1
+    job = queue.claim()
+    assert job["attempts"] == 2
+
+    assert queue.fail(job_id, job["claim_token"], "timeout")
+    clock.now += 19
+    assert queue.claim() is None
+    clock.now += 1
+    assert queue.claim()["attempts"] == 3
+
+
+def test_job_is_dead_after_max_attempts_and_can_be_retried(queue, clock):
+    job_id = queue.enqueue("add_document", {"title": "a"})
+    for _ in range(3):
+        clock.now += 1000
+        job = queue.claim()
+        queue.fail(job_id, job["claim_token"], "broken")
+
+    assert queue.get(job_id)["status"] == DEAD
+    assert queue.counts() == {DEAD: 1}
+    clock.now += 1000
+    assert queue.claim() is None
+
+    # 一覧からの再実行で試行回数が戻る
+    assert queue.retry(job_id)
+    assert not queue.retry(job_id)
+    job = queue.claim()
+    assert (job["id"], job["attempts"]) == (job_id, 1)
+
+
+def test_complete_records_result(queue):
+    job_id = queue.enqueue("add_document", {"title": "a"})
+    job = queue.claim()
+    assert queue.set_progress(job_id, job["claim_token"], 0.5, "embedding")
+    assert queue.get(job_id)["message"] == "embedding"
+
+    assert queue.complete(job_id, job["claim_token"], {"embedded": 3})
+    job = queue.get(job_id)
+    assert (job["status"], job["progress"], job["result"]) == (SUCCEEDED, 1, {"embedded": 3})
+
+
+def test_stale_job_is_requeued(queue, clock):
+    stale_id = queue.enqueue("add_document", {"title": "stale"})
+    alive_id = queue.enqueue("add_document", {"title": "alive"})
+    stale, alive = queue.claim(), queue.claim()
+
+    clock.now += 500
+    assert queue.set_progress(alive_id, alive["claim_token"], 0.5)
+    clock.now += 200
+    assert queue.requeue_stale(600) == 1
+
+    job = queue.get(stale_id)
+    assert (job["status"], job["error"]) == (QUEUED, "ワーカーが応答しなくなりました")
+    assert queue.get(alive_id)["status"] == RUNNING
+
+
+def test_late_writes_from_a_worker_that_lost_its_job_are_dropped(queue, clock):
+    job_id = queue.enqueue("add_document", {"title": "a"})
+    first = queue.claim()
+    clock.now += 700
+    assert queue.requeue_stale(600) == 1
+    clock.now += 100
+    second = queue.claim()
+    assert second["attempts"] == 2
+
+    # 元のワーカーの進捗・完了・失敗は反映されない
+    assert not queue.set_progress(job_id, first["claim_token"], 0.9)
+    assert not queue.complete(job_id, first["claim_token"], {"embedded": 1})
+    assert not queue.fail(job_id, first["claim_token"], "late")
+    job = queue.get(job_id)
+    assert (job["status"], job["attempts"], job["result"]) == (RUNNING, 2, None)
+
+    assert queue.complete(job_id, second["claim_token"], {"embedded": 2})
+    assert queue.get(job_id)["result"] == {"embedded": 2}
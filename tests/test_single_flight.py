@@ -0,0 +1,108 @@
+"""
+プロセス間で質問の処理をまとめる共有ストア（components/single_flight.py の SqliteFlightStore）のテスト
+
+実行:
+    python -m pytest tests/test_single_flight.py
+"""
+import os
+
+import pytest
+
+from components.single_flight import SqliteFlightStore
+
+
+class Clock:
+    """time.time の代わりに進める時計"""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr("components.single_flight.time.time", clock)
+    return clock
+
+
+@pytest.fixture
+def path(tmp_path):
+    return os.path.join(tmp_path, "single_flight.sqlite3")
+
+
+def test_only_one_process_acquires_a_running_flight(path, clock):
+    leader, follower = SqliteFlightStore(path), SqliteFlightStore(path)
+
+    owner = leader.acquire("q")
+    assert owner
+    assert follower.acquire("q") is None
+    assert follower.acquire("other")
+
+
+def test_follower_reads_what_the_owner_published(path, clock):
+    leader, follower = SqliteFlightStore(path), SqliteFlightStore(path)
+    owner = leader.acquire("q")
+
+    assert leader.publish_context("q", owner, [{"title": "教材"}], None)
+    assert leader.publish_tokens("q", owner, 0, ["こん", "にち"])
+    assert leader.heartbeat("q", owner, queue_position=2)
+    state = follower.read("q", 0)
+    assert state["context"] == {"docs": [{"title": "教材"}], "cached": None}
+    assert state["tokens"] == ["こん", "にち"]
+    assert (state["queue_position"], state["finished"], state["stale"]) == (2, False, False)
+
+    assert leader.publish_tokens("q", owner, 2, ["は"])
+    assert leader.finish("q", owner, metrics={"tokens": 3})
+    state = follower.read("q", 1)
+    assert state["tokens"] == ["にち", "は"]
+    assert (state["finished"], state["metrics"]) == (True, {"tokens": 3})
+
+
+def test_stale_flight_is_taken_over_and_old_owner_is_fenced(path, clock):
+    store = SqliteFlightStore(path, stale_after=30.0)
+    first = store.acquire("q")
+    assert store.publish_tokens("q", first, 0, ["古い"])
+
+    # heartbeat があれば引き継がれない
+    clock.now += 20
+    assert store.heartbeat("q", first)
+    clock.now += 20
+    assert store.acquire("q") is None
+
+    clock.now += 31
+    assert store.read("q", 0)["stale"]
+    second = store.acquire("q")
+    assert second and second != first
+    # 引き継いだ時点で前の担当の断片は消える
+    assert store.read("q", 0)["tokens"] == []
+
+    # 元の担当の書き込みはすべて反映されない
+    assert not store.heartbeat("q", first)
+    assert not store.publish_context("q", first, [{"title": "古い"}], None)
+    assert not store.publish_tokens("q", first, 0, ["古い"])
+    assert not store.finish("q", first, error=RuntimeError("late"))
+    state = store.read("q", 0)
+    assert (state["context"], state["tokens"], state["finished"]) == (None, [], False)
+
+    assert store.publish_tokens("q", second, 0, ["新しい"])
+    assert store.finish("q", second)
+    assert store.read("q", 0)["tokens"] == ["新しい"]
+
+
+def test_finished_flight_is_reacquired_and_removed_after_retention(path, clock):
+    store = SqliteFlightStore(path, retention=60.0)
+    owner = store.acquire("q")
+    store.finish("q", owner)
+
+    # 終わった処理は次の質問が担当し直せる
+    again = store.acquire("q")
+    assert again
+    store.finish("q", again)
+    assert not store.heartbeat("q", again)
+
+    clock.now += 61
+    store.acquire("other")
+    assert store.read("q", 0) is None
@@ -0,0 +1,62 @@
+import streamlit as st
+import os
+from datetime import datetime
+from dotenv import load_dotenv
+
+from components.ingest_queue import IngestQueue, IngestWorker, QUEUED, RUNNING, SUCCEEDED, DEAD
+from components.knowledge_base_supabase import KnowledgeBaseSupabase
+
+load_dotenv()
+
+STATUS_LABELS = {
+    QUEUED: "⏳ 待機中",
+    RUNNING: "⚙️ 実行中",
+    SUCCEEDED: "✅ 完了",
+    DEAD: "❌ 失敗"
+}
+
+@st.cache_resource
+def get_ingest_queue():
+    """
+    教材登録ジョブのキュー（サーバープロセスで1つ）
+    INGEST_EMBEDDED_WORKER=false の場合は python -m components.ingest_queue で別に起動したワーカーが処理する
+    """
+    queue = IngestQueue(
+        os.getenv("INGEST_QUEUE_PATH", "./ingest_queue.sqlite3"),
+        max_attempts=int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+    )
+    if os.getenv("INGEST_EMBEDDED_WORKER", "true").lower() != "false":
+        IngestWorker(queue, KnowledgeBaseSupabase, workers=int(os.getenv("INGEST_WORKERS", "2"))).start()
+    return queue
+
+def show_ingest_jobs(limit=10):
+    """最近の登録ジョブの状態（2秒ごとに更新）"""
+    queue = get_ingest_queue()
+
+    @st.fragment(run_every=2)
+    def job_list():
+        jobs = queue.list_jobs(limit=limit)
+        if not jobs:
+            st.caption("登録ジョブはまだありません。")
+            return
+
+        for job in jobs:
+            created = datetime.fromtimestamp(job['created_at']).strftime('%m/%d %H:%M:%S')
+            label = job['label'] or job['kind']
+            col1, col2 = st.columns([4, 1])
+            with col1:
+                st.markdown(f"**#{job['id']} {label}** — {STATUS_LABELS.get(job['status'], job['status'])}（{created}）")
+                if job['status'] == RUNNING:
+                    st.progress(job['progress'], text=job['message'] or "処理中...")
+                elif job['status'] == SUCCEEDED and job['result']:
+                    st.caption(f"チャンク: {job['result'].get('embedded', 0)}件をembedding、"
+                               f"{job['result'].get('reused', 0)}件は変更なしのため再利用")
+                elif job['error']:
+                    retry_note = f"（{job['attempts']}回目の失敗、再試行を待っています）" if job['status'] == QUEUED else ""
+                    st.caption(f"エラー: {job['error']}{retry_note}")
+            with col2:
+                if job['status'] == DEAD and st.button("🔁 再実行", key=f"retry_job_{job['id']}"):
+                    queue.retry(job['id'])
+                    st.rerun(scope="fragment")
+
+    job_list()
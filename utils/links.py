@@ -0,0 +1,36 @@
+import re
+from typing import Dict, List
+
+# 本文中のURL（末尾の句読点と、URLの直後に続く日本語は含めない）
+_URL = re.compile(r'https?://[^\s<>"{}|\\^`\[\]\u0080-\uffff]+(?:[.,;!?](?=\s)|[^\s.,;!?\u0080-\uffff])*')
+_TRAILING_PUNCTUATION = re.compile(r'[.,;!?]+$')
+
+# YouTube動画のURL（URLの先頭に対して照合し、動画を特定できる部分だけを取り出す）
+_YOUTUBE = re.compile(
+    r'https?://(?:www\.)?(?:'
+    r'youtube\.com/watch\?v=[\w-]+(?:&[\w=]*)?'
+    r'|youtu\.be/[\w-]+(?:\?[\w=]*)?'
+    r'|youtube\.com/embed/[\w-]+'
+    r'|youtube\.com/v/[\w-]+'
+    r')'
+)
+
+
+def extract_links(text: str) -> List[Dict]:
+    """
+    本文中のURLを1回の走査で取り出し、YouTube動画（'youtube'）とそれ以外の資料（'resource'）に分類する
+    戻り値は出現順・重複なしの {'type', 'url'} のリスト
+    """
+    links = []
+    seen = set()
+    for match in _URL.finditer(text or ""):
+        url = match.group(0)
+        youtube = _YOUTUBE.match(url)
+        if youtube:
+            link = {'type': 'youtube', 'url': youtube.group(0)}
+        else:
+            link = {'type': 'resource', 'url': _TRAILING_PUNCTUATION.sub('', url)}
+        if link['url'] not in seen:
+            seen.add(link['url'])
+            links.append(link)
+    return links
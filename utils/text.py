@@ -0,0 +1,24 @@
+import re
+import unicodedata
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str, casefold: bool = False) -> str:
+    """
+    キャッシュキー用にテキストを正規化
+    NFKCで全角英数字・記号を半角に、半角カナを全角に揃え、連続する空白（全角スペース含む）を1つにまとめる
+    """
+    text = unicodedata.normalize("NFKC", text or "")
+    text = _WHITESPACE.sub(" ", text).strip()
+    if casefold:
+        text = text.casefold()
+    return text
+
+
+def normalize_question(text: str) -> str:
+    """
+    同じ質問かどうかの比較用に正規化（回答キャッシュのキー・処理中の質問の照合）
+    normalize_text に加えて大文字小文字を揃え、日本語では意味のない空白を除く
+    """
+    return "".join(normalize_text(text, casefold=True).split())
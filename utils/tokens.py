@@ -0,0 +1,30 @@
+from functools import lru_cache
+
+import tiktoken
+
+# 回答生成に使うチャットモデル（トークン数はこのモデルのエンコーディングで数える）
+CHAT_MODEL = "gpt-4o-mini"
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str = CHAT_MODEL):
+    """モデルに対応するtiktokenのエンコーディング（初回のみ読み込み）"""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        # モデル名を知らない古いtiktokenでは gpt-4o 系と同じエンコーディングを使う
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str, model: str = CHAT_MODEL) -> int:
+    """テキストのトークン数"""
+    return len(get_encoding(model).encode(text or "", disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int, model: str = CHAT_MODEL) -> str:
+    """先頭から max_tokens トークン分だけを残す"""
+    encoding = get_encoding(model)
+    tokens = encoding.encode(text or "", disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max(max_tokens, 0)])